@@ -4,7 +4,8 @@ import json
 import logging
 from typing import Any
 
-from rg.entry import run_rg, run_mean_rg, generate_new_visualizations
+# Each trigger imports its pipeline lazily, so a worker only loads the
+# dependencies (cv2, skimage, matplotlib, ...) of the queues it actually serves.
 
 app = func.FunctionApp()
 
@@ -18,9 +19,13 @@ async def rg_trigger(azqueue: func.QueueMessage, msg: func.Out[str]):
     logging.info('Python Queue trigger processed a message: %s',
                 azqueue.get_body().decode('utf-8'))
     logging.info("test")
+    from rg.entry import run_rg
+    from utils.constants import MESSAGE_DEADLINE
+    from utils.retry_decorator import message_deadline
     message_received = json.loads(azqueue.get_body().decode('utf-8'))
     scan_ids = message_received['scan_ids']
-    await run_rg(scan_ids)
+    with message_deadline(MESSAGE_DEADLINE):
+        await run_rg(scan_ids)
 
     msg.set(message_received)
 
@@ -30,9 +35,13 @@ async def rg_trigger(azqueue: func.QueueMessage, msg: func.Out[str]):
 async def calculate_mean_result(azqueue: func.QueueMessage):
     logging.info('Python Queue trigger processed a message: %s',
                 azqueue.get_body().decode('utf-8'))
+    from rg.mean_entry import run_mean_rg
+    from utils.constants import MESSAGE_DEADLINE
+    from utils.retry_decorator import message_deadline
     message_received = json.loads(azqueue.get_body().decode('utf-8'))
     scan_ids = message_received['scan_ids']
-    await run_mean_rg(scan_ids)
+    with message_deadline(MESSAGE_DEADLINE):
+        await run_mean_rg(scan_ids)
     output_message = [{"scan_id": scan_id} for scan_id in scan_ids]
 
 
@@ -56,6 +65,7 @@ async def calculate_mean_result(azqueue: func.QueueMessage):
 # async def new_visualizations(azqueue: func.QueueMessage):
 #     logging.info('Python Queue trigger processed a message: %s',
 #                 azqueue.get_body().decode('utf-8'))
+#     from rg.entry import generate_new_visualizations
 #     message_received = json.loads(azqueue.get_body().decode('utf-8'))
 #     scan_id = message_received['scan_id']
 #     await generate_new_visualizations(scan_id)
@@ -0,0 +1,89 @@
+import logging
+from contextlib import asynccontextmanager
+
+import anyio
+
+from utils.constants import *
+from utils.processing import check_rgb_depth_alignment
+from rg.results_utils import get_rgb_depth_allignment_result
+
+
+class AlignmentStage:
+    """
+    RGB-depth alignment of the frame pairs in plan.missing['alignment'].
+
+    Frames are handed in with add_frame as soon as they are decoded; once both frames
+    of a pair are there the pair is checked in a worker thread (at most
+    ALIGNMENT_WORKERS at a time) while downloads and the other flows continue.
+    Must be used inside `async with stage.running()`.
+    """
+
+    def __init__(self, plan, workflow_id, scan_type, threshold=0.75):
+        self.workflow_id = workflow_id
+        self.max_depth = 3 if scan_type == STANDING_TYPE else 1.5
+        self.threshold = threshold
+        rgb_by_order = {(a['scan_id'], a['order']): a for a in plan.alignment_rgb}
+        # Pairs are keyed by depth id; several depth frames of the same (scan_id, order)
+        # share one RGB frame, which is kept until all of its pairs have started
+        self.pairs = {}
+        self.pairs_by_rgb = {}
+        for depth_artifact in plan.missing['alignment']:
+            if depth_artifact['id'] in self.pairs:
+                continue
+            rgb_artifact = rgb_by_order[(depth_artifact['scan_id'], depth_artifact['order'])]
+            self.pairs[depth_artifact['id']] = {'rgb': rgb_artifact, 'depth': depth_artifact}
+            self.pairs_by_rgb.setdefault(rgb_artifact['id'], []).append(depth_artifact['id'])
+        self.frames = {}
+        self.pending = len(self.pairs)
+        self.results = []
+        self.limiter = anyio.CapacityLimiter(ALIGNMENT_WORKERS)
+        self.done = anyio.Event()
+        self.task_group = None
+        if self.pending == 0:
+            self.done.set()
+
+    @asynccontextmanager
+    async def running(self):
+        async with anyio.create_task_group() as task_group:
+            self.task_group = task_group
+            yield self
+
+    def needs(self, artifact_id):
+        return artifact_id in self.pairs or artifact_id in self.pairs_by_rgb
+
+    def add_frame(self, artifact_id, frame):
+        if not self.needs(artifact_id):
+            return
+        self.frames[artifact_id] = frame
+        for depth_id in list(self.pairs_by_rgb.get(artifact_id, [artifact_id])):
+            self.start_if_ready(depth_id)
+
+    def start_if_ready(self, depth_id):
+        pair = self.pairs[depth_id]
+        rgb_id = pair['rgb']['id']
+        if depth_id not in self.frames or rgb_id not in self.frames:
+            return
+        del self.pairs[depth_id]
+        waiting = self.pairs_by_rgb[rgb_id]
+        waiting.remove(depth_id)
+        if waiting:
+            rgb_image = self.frames[rgb_id]
+        else:
+            rgb_image = self.frames.pop(rgb_id)
+            del self.pairs_by_rgb[rgb_id]
+        self.task_group.start_soon(self.check, pair, rgb_image, self.frames.pop(depth_id))
+
+    async def check(self, pair, rgb_image, depthmap):
+        depth_artifact = pair['depth']
+        similarity_index, alignment_status = await anyio.to_thread.run_sync(
+            check_rgb_depth_alignment, rgb_image, depthmap, self.max_depth, self.threshold, limiter=self.limiter)
+        self.results.append(get_rgb_depth_allignment_result(depth_artifact['scan_id'], [depth_artifact['id']], self.workflow_id, similarity_index, alignment_status))
+        self.pending -= 1
+        if self.pending == 0:
+            logging.info("finished rgb depth alignment")
+            self.done.set()
+
+    async def get_results(self):
+        """Alignment results of all pairs, once every pair has been checked."""
+        await self.done.wait()
+        return self.results
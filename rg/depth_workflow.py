@@ -6,54 +6,95 @@ import traceback
 
 
 from utils.constants import *
-from utils.processing import get_workflow
-from utils.depth_preprocessing import get_depthmaps, compute_depth_metadata, depth_visualization, compute_angle
+from utils.workflows import get_workflow
+from utils.depth_preprocessing import compute_depth_metadata, compute_angle
+from utils.depth_rendering import render_depthmap
+from utils.executors import run_threaded
 from utils.constants import *
-from rg.results_utils import get_files_results, post_result_files, get_depth_feature_json_results, get_json_results
-from utils.inference import call_mn_height, call_pcnn_height, call_pcnn_weight
+from rg.results_utils import get_files_results, post_result_files, post_results_if_any, get_depth_feature_json_results, get_json_results
+from rg.work_plan import split_by_groups
+from utils.inference import call_mn_height, call_pcnn_height, call_pcnn_weight, score_depth_batches
 
 
-async def run_depth_img_flow(cgm_api, session, artifacts, workflows, scan_version, results, scan_type):
+def scored_artifacts(artifacts, predictions):
+    """The artifacts that got a prediction and their predictions, in artifact order."""
+    scored = [artifact for artifact in artifacts if (artifact['scan_id'], artifact['id']) in predictions]
+    return scored, [predictions[(artifact['scan_id'], artifact['id'])] for artifact in scored]
+
+
+async def run_depth_img_flow(cgm_api, session, plan, workflows, depth_pipeline, results, scan_type, checkpoint, alignment):
+    """Run the depth workflows on plan.depth_downloads, the artifacts depth_pipeline was built from,
+    and post the alignment results together with the depth results."""
     try:
         logging.info("starting depth img flow")
+        artifacts = plan.depth_downloads
         depth_img_workflow = get_workflow(workflows, DEPTH_IMG_WORKFLOW_NAME, DEPTH_IMG_WORKFLOW_VERSION)
         depth_feature_workflow = get_workflow(workflows, DEPTH_FEATURE_WORKFLOW_NAME, DEPTH_FEATURE_WORKFLOW_VERSION)
         pcnn_height_workflow = get_workflow(workflows, PLAINCNN_HEIGHT_WORKFLOW_NAME, PLAINCNN_HEIGHT_WORKFLOW_VERSION)
         pcnn_weight_workflow = get_workflow(workflows, PLAINCNN_WEIGHT_WORKFLOW_NAME, PLAINCNN_WEIGHT_WORKFLOW_VERSION)
         mn_height_workflow = get_workflow(workflows, MOBILENET_HEIGHT_WORKFLOW_NAME, MOBILENET_HEIGHT_WORKFLOW_VERSION)
-        logging.info("starting preprocessing")
-        depthmaps, in_depthmaps, pc_dmaps, mn_depthmaps, device_poses = await asyncify(get_depthmaps)(artifacts, scan_version)
+        depthmaps, device_poses = depth_pipeline.depthmaps, depth_pipeline.device_poses
+        pc_dmaps, mn_depthmaps = depth_pipeline.pc_batch, depth_pipeline.mn_batch
+        index = {artifact['id']: i for i, artifact in enumerate(artifacts)}
+        feature_artifacts = plan.missing['depth_feature']
+        depth_img_artifacts = plan.missing['depth_img']
         logging.info("starting no of zeroes")
-        no_of_zeroes_results = await asyncify(compute_depth_metadata)(depthmaps)
+        no_of_zeroes_results = await asyncify(compute_depth_metadata)([depthmaps[index[a['id']]] for a in feature_artifacts])
         logging.info("starting angle")
-        angle_results = await asyncify(compute_angle)(device_poses)
+        angle_results = await asyncify(compute_angle)([device_poses[index[a['id']]] for a in feature_artifacts])
         logging.info("starting depth viz")
-        depth_viz = await asyncify(depth_visualization)(artifacts, depthmaps, scan_type)
+        async with asyncer.create_task_group() as task_group:
+            rendered = [task_group.soonify(run_threaded)(render_depthmap, depthmaps[index[a['id']]], scan_type) for a in depth_img_artifacts]
+        depth_viz = {(a['scan_id'], a['id']): soon.value for a, soon in zip(depth_img_artifacts, rendered)}
         logging.info("starting height and weight models")
+        predictions = {}
+        models = {}
+        for key, call in (('pcnn_height', call_pcnn_height), ('pcnn_weight', call_pcnn_weight), ('mn_height', call_mn_height)):
+            if not plan.missing[key]:
+                predictions[key] = {}
+                continue
+            predictions[key] = await checkpoint.get(f'{key}_predictions', required=[(a['scan_id'], a['id']) for a in plan.missing[key]])
+            if predictions[key] is None:
+                models[key] = call
+        # Each model scores only the artifacts it is missing; the PlainCNN height and weight
+        # models score the artifacts both are missing together, each chunk encoded once
+        pcnn_groups = split_by_groups(artifacts, {key: plan.missing[key] for key in ('pcnn_height', 'pcnn_weight') if key in models})
+        mn_artifacts = plan.missing['mn_height'] if 'mn_height' in models else []
         async with asyncer.create_task_group() as task_group:
-            pcnn_height_results = task_group.soonify(call_pcnn_height)(session, pc_dmaps)
-            pcnn_weight_results = task_group.soonify(call_pcnn_weight)(session, pc_dmaps)
-            mn_height_results = task_group.soonify(call_mn_height)(session, mn_depthmaps)
-        pcnn_height_results = pcnn_height_results.value
-        pcnn_weight_results = pcnn_weight_results.value
-        mn_height_results = mn_height_results.value
+            pcnn_results = {keys: task_group.soonify(score_depth_batches)(
+                session, [models[key] for key in keys], pc_dmaps[[index[a['id']] for a in group]], [(a['scan_id'], a['id']) for a in group])
+                for keys, group in pcnn_groups.items()}
+            mn_results = task_group.soonify(score_depth_batches)(
+                session, [call_mn_height], mn_depthmaps[[index[a['id']] for a in mn_artifacts]], [(a['scan_id'], a['id']) for a in mn_artifacts])
+        scored = {key: {} for key in ('pcnn_height', 'pcnn_weight') if key in models}
+        for keys, group_results in pcnn_results.items():
+            for key, model_predictions in zip(keys, group_results.value):
+                scored[key].update(model_predictions)
+        if 'mn_height' in models:
+            scored['mn_height'] = mn_results.value[0]
+        for key, model_predictions in scored.items():
+            predictions[key] = model_predictions
+            await checkpoint.put(f'{key}_predictions', model_predictions)
+        pcnn_height_results, pcnn_weight_results, mn_height_results = predictions['pcnn_height'], predictions['pcnn_weight'], predictions['mn_height']
         logging.info("starting posting")
-        file_ids = await post_result_files(cgm_api, depth_viz)
+        file_ids = await checkpoint.run('depth_img_files', post_result_files, cgm_api, depth_viz, required=depth_viz)
         depth_img_results_dicts = get_files_results(file_ids, depth_img_workflow['id'], results.get(depth_img_workflow['id'], []))
-        depth_feature_json_results_dicts = get_depth_feature_json_results(artifacts, no_of_zeroes_results, angle_results, depth_feature_workflow['id'], results.get(depth_feature_workflow['id'], []))
-        pcnn_height_json_results_dicts = get_json_results(artifacts, pcnn_height_results, pcnn_height_workflow['id'], results.get(pcnn_height_workflow['id'], []), 'height')
-        pcnn_weight_json_results_dicts = get_json_results(artifacts, pcnn_weight_results, pcnn_weight_workflow['id'], results.get(pcnn_weight_workflow['id'], []), 'weight')
-        mn_height_json_results_dicts = get_json_results(artifacts, mn_height_results, mn_height_workflow['id'], results.get(mn_height_workflow['id'], []), 'height')
+        depth_feature_json_results_dicts = get_depth_feature_json_results(feature_artifacts, no_of_zeroes_results, angle_results, depth_feature_workflow['id'], results.get(depth_feature_workflow['id'], []))
+        pcnn_height_json_results_dicts = get_json_results(*scored_artifacts(artifacts, pcnn_height_results), pcnn_height_workflow['id'], results.get(pcnn_height_workflow['id'], []), 'height')
+        pcnn_weight_json_results_dicts = get_json_results(*scored_artifacts(artifacts, pcnn_weight_results), pcnn_weight_workflow['id'], results.get(pcnn_weight_workflow['id'], []), 'weight')
+        mn_height_json_results_dicts = get_json_results(*scored_artifacts(artifacts, mn_height_results), mn_height_workflow['id'], results.get(mn_height_workflow['id'], []), 'height')
+        alignment_results_dicts = await alignment.get_results()
 
         logging.info("uploading results")
         async with asyncer.create_task_group() as task_group:
-            depth_img_post_status = task_group.soonify(cgm_api.post_results)({"results": depth_img_results_dicts})
-            depth_feature_post_status = task_group.soonify(cgm_api.post_results)({"results": depth_feature_json_results_dicts})
-            pcnn_height_post_status = task_group.soonify(cgm_api.post_results)({"results": pcnn_height_json_results_dicts})
-            pcnn_weight_post_status = task_group.soonify(cgm_api.post_results)({"results": pcnn_weight_json_results_dicts})
+            depth_img_post_status = task_group.soonify(post_results_if_any)(cgm_api, depth_img_results_dicts)
+            depth_feature_post_status = task_group.soonify(post_results_if_any)(cgm_api, depth_feature_json_results_dicts)
+            pcnn_height_post_status = task_group.soonify(post_results_if_any)(cgm_api, pcnn_height_json_results_dicts)
+            pcnn_weight_post_status = task_group.soonify(post_results_if_any)(cgm_api, pcnn_weight_json_results_dicts)
             # if 'ir' not in scan_version:
-            mn_height_post_status = task_group.soonify(cgm_api.post_results)({"results": mn_height_json_results_dicts})
-        logging.info(f"{depth_img_post_status.value}, {depth_feature_post_status.value}, {pcnn_height_post_status.value}, {pcnn_weight_post_status.value}, {mn_height_post_status.value}")
+            mn_height_post_status = task_group.soonify(post_results_if_any)(cgm_api, mn_height_json_results_dicts)
+            alignment_post_status = task_group.soonify(post_results_if_any)(cgm_api, alignment_results_dicts)
+        logging.info(f"{depth_img_post_status.value}, {depth_feature_post_status.value}, {pcnn_height_post_status.value}, {pcnn_weight_post_status.value}, {mn_height_post_status.value}, {alignment_post_status.value}")
         return True, depthmaps
     except Exception as e:
         logging.error(f"Error in run_depth_img_flow: {e} {traceback.format_exc()}")
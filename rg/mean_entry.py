@@ -0,0 +1,65 @@
+import logging
+
+from utils.rest_api import CgmApi
+from utils.http_client import get_client_stats
+from utils.concurrency import get_limiter_stats
+from utils.constants import *
+from utils.workflows import get_workflow
+from rg.results_utils import get_mean_result, get_mean_results, filter_results, pose_score_filter, depth_feature_filter, distance_to_child_filter
+
+
+async def run_mean_rg(scan_ids):
+    try:
+        cgm_api = CgmApi()
+        workflows = await cgm_api.get_workflows()
+        results_dicts = []
+        scan_preds = []
+        for scan_id in scan_ids:
+            result_dict, scan_pred, child_visit_id = await process_scan_id(cgm_api, scan_id, workflows)
+            results_dicts.extend(result_dict)
+            if scan_pred:
+                scan_preds.append(scan_pred)
+        post_result_status_code = await cgm_api.post_results({"results": results_dicts})
+        estimate = get_mean_result(scan_preds) if scan_preds else None
+        if estimate:
+            result_data = {'mean_height': f'{estimate:.3f}'}
+        else:
+            result_data = {'mean_height': estimate}
+        status_code = await cgm_api.put_child_visit_result(child_visit_id, result_data)
+        logging.info(f"{post_result_status_code}, {status_code}")
+    finally:
+        logging.info(f"http client stats {get_client_stats()}, endpoint limits {get_limiter_stats()}")
+
+
+async def process_scan_id(cgm_api, scan_id, workflows):
+    result_dicts = []
+    sm = await cgm_api.get_scan_metadata(scan_id)
+    app_child_distance_workflow = get_workflow(workflows, 'app_child_distance', '1.0')
+    depth_feature_workflow = get_workflow(workflows, DEPTH_FEATURE_WORKFLOW_NAME, DEPTH_FEATURE_WORKFLOW_VERSION)
+    pose_workflow = get_workflow(workflows, POSE_WORKFLOW_NAME, POSE_WORKFLOW_VERSION)
+    filter_functions_dict = {
+        pose_workflow['id']: pose_score_filter,
+        depth_feature_workflow['id']: depth_feature_filter,
+        app_child_distance_workflow['id']: distance_to_child_filter,
+    }
+
+    pcnn_height_workflow = get_workflow(workflows, PLAINCNN_HEIGHT_WORKFLOW_NAME, PLAINCNN_HEIGHT_WORKFLOW_VERSION)
+    pcnn_weight_workflow = get_workflow(workflows, PLAINCNN_WEIGHT_WORKFLOW_NAME, PLAINCNN_WEIGHT_WORKFLOW_VERSION)
+    mn_height_workflow = get_workflow(workflows, MOBILENET_HEIGHT_WORKFLOW_NAME, MOBILENET_HEIGHT_WORKFLOW_VERSION)
+    pcnn_height_mean_workflow = get_workflow(workflows, MEAN_PLAINCNN_HEIGHT_WORKFLOW_NAME, MEAN_PLAINCNN_HEIGHT_WORKFLOW_VERSION)
+    pcnn_weight_mean_workflow = get_workflow(workflows, MEAN_PLAINCNN_WEIGHT_WORKFLOW_NAME, MEAN_PLAINCNN_WEIGHT_WORKFLOW_VERSION)
+    mn_height_mean_workflow = get_workflow(workflows, MEAN_MOBILENET_HEIGHT_WORKFLOW_NAME, MEAN_MOBILENET_HEIGHT_WORKFLOW_VERSION)
+
+    artifacts = sm['artifacts']
+    artifact_order_mapping = {a['id']: (scan_id, a['order']) for a in artifacts}
+    depth_artifact_ids = [a['id'] for a in artifacts if a['format'] in depth_format]
+    results = sm['results']
+    scan_type = sm['type']
+    filtered_data, results_workflow_dict = filter_results(results, artifact_order_mapping, filter_functions_dict)
+    rd, _ = get_mean_results(scan_id, filtered_data, results_workflow_dict, pcnn_height_workflow['id'], pcnn_height_mean_workflow['id'], 'height', depth_artifact_ids)
+    result_dicts.append(rd)
+    rd, _ = get_mean_results(scan_id, filtered_data, results_workflow_dict, pcnn_weight_workflow['id'], pcnn_weight_mean_workflow['id'], 'weight', depth_artifact_ids)
+    result_dicts.append(rd)
+    rd, scan_pred = get_mean_results(scan_id, filtered_data, results_workflow_dict, mn_height_workflow['id'], mn_height_mean_workflow['id'], 'height', depth_artifact_ids)
+    result_dicts.append(rd)
+    return result_dicts, scan_pred, sm['child_visit_id']
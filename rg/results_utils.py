@@ -19,6 +19,13 @@ async def post_result_files(cgm_api, files, file_format='rgb'):
         print(e)
 
 
+async def post_results_if_any(cgm_api, result_dicts):
+    """Post result dicts, skipping the request when there is nothing to post."""
+    if not result_dicts:
+        return None
+    return await cgm_api.post_results({"results": result_dicts})
+
+
 def get_result_dict(scan_id, workflow_id, source_artifacts=[], data=None, source_results=[], file=None):
     result_dict =  {}
     result_dict["id"] = str(uuid4())
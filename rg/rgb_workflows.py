@@ -1,47 +1,76 @@
 import logging
+from operator import attrgetter
+
 import anyio
 import asyncer
-from asyncer import asyncify
 
 from utils.constants import *
-from utils.processing import get_workflow, load_rgb_images, encode_rgb_images, pose_and_blur_visualsation, blur_rgb_images
+from utils.executors import run_threaded
+from utils.processing import pose_keypoints, scale_faces, scale_pose_prediction
+from utils.workflows import get_workflow
+from utils.rgb_frame import RGBFrame
 from rg.workflows import run_face_workflow, run_pose_workflow
-from rg.results_utils import get_files_results, post_result_files, get_blur_json_results, get_pose_json_results
+from rg.results_utils import get_files_results, post_result_files, post_results_if_any, get_blur_json_results, get_pose_json_results
+from rg.work_plan import select
+
+
+async def map_frames(func, frames, *args):
+    """func(frame, *per_frame_args) for every frame on the worker threads, results in order."""
+    async with asyncer.create_task_group() as task_group:
+        soon_values = [task_group.soonify(run_threaded)(func, frame, *frame_args) for frame, *frame_args in zip(frames, *args)]
+    return [soon.value for soon in soon_values]
 
 
-async def run_rgb_flow(cgm_api, session, artifacts, workflows, results):
+async def run_rgb_flow(cgm_api, session, plan, rgb_frames, workflows, results, checkpoint):
+    """Run the RGB workflows on the artifacts of the plan; rgb_frames holds an RGBFrame per plan.rgb_downloads."""
     try:
         logging.info("Starting rgb flow")
         pose_workflow = get_workflow(workflows, POSE_WORKFLOW_NAME, POSE_WORKFLOW_VERSION)
         pose_visualize_workflow = get_workflow(workflows, POSE_VISUALIZE_WORKFLOW_NAME, POSE_VISUALIZE_WORKFLOW_VERSION)
         blur_workflow = get_workflow(workflows, BLUR_WORKFLOW_NAME, BLUR_WORKFLOW_VERSION)
         faces_workflow = get_workflow(workflows, FACE_DETECTION_WORKFLOW_NAME, FACE_DETECTION_WORKFLOW_VERSION)
-        rgb_input_images = await asyncify(load_rgb_images)(artifacts)
-        encoded_images = await asyncify(encode_rgb_images)(rgb_input_images)
+        pose_ids, face_ids = [a['id'] for a in plan.poses], [a['id'] for a in plan.faces]
+        pose_results = await checkpoint.get('pose_predictions', required=pose_ids)
+        face_results = await checkpoint.get('face_predictions', required=face_ids)
+        pose_artifacts = [] if pose_results is not None else plan.poses
+        face_artifacts = [] if face_results is not None else plan.faces
+        inference_artifacts = select(plan.rgb_downloads, pose_artifacts, face_artifacts)
+        encoded_images = await map_frames(attrgetter('inference_jpeg'), [rgb_frames[a['id']] for a in inference_artifacts])
+        encoded_images = dict(zip([a['id'] for a in inference_artifacts], encoded_images))
         logging.info("generating predictions")
         async with asyncer.create_task_group() as task_group:
-            pose_results = task_group.soonify(run_pose_workflow)(session, encoded_images)
-            face_results = task_group.soonify(run_face_workflow)(session, encoded_images)
-        pose_results = pose_results.value
-        face_results = face_results.value
+            pose_predictions = task_group.soonify(run_pose_workflow)(session, [encoded_images[a['id']] for a in pose_artifacts])
+            face_predictions = task_group.soonify(run_face_workflow)(session, [encoded_images[a['id']] for a in face_artifacts])
+        # Back to full resolution when the APIs got downscaled images
+        if pose_results is None:
+            pose_results = {a['id']: scale_pose_prediction(prediction, 1 / rgb_frames[a['id']].inference_scale) for a, prediction in zip(pose_artifacts, pose_predictions.value)}
+            await checkpoint.put('pose_predictions', pose_results)
+        if face_results is None:
+            face_results = {a['id']: scale_faces(faces, 1 / rgb_frames[a['id']].inference_scale) for a, faces in zip(face_artifacts, face_predictions.value)}
+            await checkpoint.put('face_predictions', face_results)
         logging.info("generating images")
-        blurred_images, blurred_images_to_post = await asyncify(blur_rgb_images)(artifacts, face_results, rgb_input_images)
-        pose_viz = await asyncify(pose_and_blur_visualsation)(artifacts, pose_results, blurred_images)
+        await map_frames(RGBFrame.blur_faces, [rgb_frames[a['id']] for a in plan.blur], [face_results[a['id']] for a in plan.blur])
+        blur_artifacts = plan.missing['blur']
+        blurred_images = await map_frames(attrgetter('blurred_jpeg'), [rgb_frames[a['id']] for a in blur_artifacts])
+        blurred_images_to_post = {(a['scan_id'], a['id']): image for a, image in zip(blur_artifacts, blurred_images)}
+        pose_visualize_artifacts = plan.missing['pose_visualize']
+        pose_images = await map_frames(RGBFrame.pose_jpeg, [rgb_frames[a['id']] for a in pose_visualize_artifacts], [pose_keypoints(pose_results[a['id']]) for a in pose_visualize_artifacts])
+        pose_viz = {(a['scan_id'], a['id']): image for a, image in zip(pose_visualize_artifacts, pose_images)}
         logging.info("uploading images")
-        blur_file_ids = await post_result_files(cgm_api, blurred_images_to_post)
-        pose_vis_file_ids = await post_result_files(cgm_api, pose_viz)
+        blur_file_ids = await checkpoint.run('blur_files', post_result_files, cgm_api, blurred_images_to_post, required=blurred_images_to_post)
+        pose_vis_file_ids = await checkpoint.run('pose_visualize_files', post_result_files, cgm_api, pose_viz, required=pose_viz)
         blur_results_dicts = get_files_results(blur_file_ids, blur_workflow['id'], results.get(blur_workflow['id'], []))
         pose_results_dicts = get_files_results(pose_vis_file_ids, pose_visualize_workflow['id'], results.get(pose_visualize_workflow['id'], []))
-        pose_json_results_dicts = get_pose_json_results(artifacts, pose_results, pose_workflow['id'], results.get(pose_workflow['id'], []))
-        face_json_results_dicts = get_blur_json_results(artifacts, face_results, faces_workflow['id'], results.get(faces_workflow['id'], []))
+        pose_json_results_dicts = get_pose_json_results(plan.missing['pose'], [pose_results[a['id']] for a in plan.missing['pose']], pose_workflow['id'], results.get(pose_workflow['id'], []))
+        face_json_results_dicts = get_blur_json_results(plan.missing['faces'], [face_results[a['id']] for a in plan.missing['faces']], faces_workflow['id'], results.get(faces_workflow['id'], []))
         logging.info("uploading results")
         async with asyncer.create_task_group() as task_group:
-            blur_result_post_status = task_group.soonify(cgm_api.post_results)({"results": blur_results_dicts})
-            pose_result_post_status = task_group.soonify(cgm_api.post_results)({"results": pose_results_dicts})
-            pose_json_result_post_status = task_group.soonify(cgm_api.post_results)({"results": pose_json_results_dicts})
-            blur_json_result_post_status = task_group.soonify(cgm_api.post_results)({"results": face_json_results_dicts})
+            blur_result_post_status = task_group.soonify(post_results_if_any)(cgm_api, blur_results_dicts)
+            pose_result_post_status = task_group.soonify(post_results_if_any)(cgm_api, pose_results_dicts)
+            pose_json_result_post_status = task_group.soonify(post_results_if_any)(cgm_api, pose_json_results_dicts)
+            blur_json_result_post_status = task_group.soonify(post_results_if_any)(cgm_api, face_json_results_dicts)
         logging.info(f"{blur_result_post_status.value}, {pose_result_post_status.value}, {pose_json_result_post_status.value}, {blur_json_result_post_status.value}")
-        return True, rgb_input_images
+        return True, rgb_frames
     except Exception as e:
         logging.error(f"Error in run_rgb_flow: {e}")
         raise e
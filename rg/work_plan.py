@@ -0,0 +1,80 @@
+from utils.constants import *
+from utils.workflows import get_workflow
+
+
+RGB_WORKFLOWS = {
+    'pose': (POSE_WORKFLOW_NAME, POSE_WORKFLOW_VERSION),
+    'pose_visualize': (POSE_VISUALIZE_WORKFLOW_NAME, POSE_VISUALIZE_WORKFLOW_VERSION),
+    'blur': (BLUR_WORKFLOW_NAME, BLUR_WORKFLOW_VERSION),
+    'faces': (FACE_DETECTION_WORKFLOW_NAME, FACE_DETECTION_WORKFLOW_VERSION),
+}
+
+DEPTH_WORKFLOWS = {
+    'depth_img': (DEPTH_IMG_WORKFLOW_NAME, DEPTH_IMG_WORKFLOW_VERSION),
+    'depth_feature': (DEPTH_FEATURE_WORKFLOW_NAME, DEPTH_FEATURE_WORKFLOW_VERSION),
+    'pcnn_height': (PLAINCNN_HEIGHT_WORKFLOW_NAME, PLAINCNN_HEIGHT_WORKFLOW_VERSION),
+    'pcnn_weight': (PLAINCNN_WEIGHT_WORKFLOW_NAME, PLAINCNN_WEIGHT_WORKFLOW_VERSION),
+    'mn_height': (MOBILENET_HEIGHT_WORKFLOW_NAME, MOBILENET_HEIGHT_WORKFLOW_VERSION),
+    'alignment': (RGB_DEPTH_ALLIGNMENT_WORKFLOW_NAME, RGB_DEPTH_ALLIGNMENT_WORKFLOW_VERSION),
+}
+
+
+def select(artifacts, *groups):
+    """The artifacts that are in any of the groups, in their original order."""
+    ids = {artifact['id'] for group in groups for artifact in group}
+    return [artifact for artifact in artifacts if artifact['id'] in ids]
+
+
+def split_by_groups(artifacts, groups):
+    """
+    The artifacts split by which of the named groups ({name: artifacts}) they are in:
+    {tuple of group names: artifacts in their original order}. Artifacts in no group
+    are left out.
+    """
+    ids = {name: {artifact['id'] for artifact in group} for name, group in groups.items()}
+    split = {}
+    for artifact in artifacts:
+        names = tuple(name for name in groups if artifact['id'] in ids[name])
+        if names:
+            split.setdefault(names, []).append(artifact)
+    return split
+
+
+class WorkPlan:
+    """
+    What is still missing for a scan, worked out from its existing results before
+    anything is downloaded.
+
+    `missing[key]` lists the artifacts without a result for that workflow (keys of
+    RGB_WORKFLOWS and DEPTH_WORKFLOWS). The stage attributes list the artifacts each
+    stage has to run on so that every missing result can be produced: faces are
+    needed to blur, the blurred image is the background of the pose visualization,
+    and the alignment check needs both frames of a pair.
+    """
+
+    def __init__(self, workflows, results_workflow_dict, rgb_artifacts, depth_artifacts):
+        self.missing = {}
+        for key, (name, version) in RGB_WORKFLOWS.items():
+            self.missing[key] = self.find_missing(workflows, results_workflow_dict, name, version, rgb_artifacts)
+        for key, (name, version) in DEPTH_WORKFLOWS.items():
+            self.missing[key] = self.find_missing(workflows, results_workflow_dict, name, version, depth_artifacts)
+
+        self.blur = select(rgb_artifacts, self.missing['blur'], self.missing['pose_visualize'])
+        self.faces = select(rgb_artifacts, self.missing['faces'], self.blur)
+        self.poses = select(rgb_artifacts, self.missing['pose'], self.missing['pose_visualize'])
+        alignment_pairs = {(artifact['scan_id'], artifact['order']) for artifact in self.missing['alignment']}
+        self.alignment_rgb = [artifact for artifact in rgb_artifacts if (artifact['scan_id'], artifact['order']) in alignment_pairs]
+        self.rgb_downloads = select(rgb_artifacts, self.faces, self.poses, self.alignment_rgb)
+        self.depth_downloads = select(depth_artifacts, *(self.missing[key] for key in DEPTH_WORKFLOWS))
+
+    @staticmethod
+    def find_missing(workflows, results_workflow_dict, name, version, artifacts):
+        existing = set(results_workflow_dict.get(get_workflow(workflows, name, version)['id'], []))
+        return [artifact for artifact in artifacts if artifact['id'] not in existing]
+
+    @property
+    def is_complete(self):
+        return not self.rgb_downloads and not self.depth_downloads
+
+    def summary(self):
+        return {key: len(artifacts) for key, artifacts in self.missing.items()}
@@ -2,16 +2,17 @@ import anyio
 import asyncer
 from asyncer import asyncify
 
-from utils.inference import call_face_api, call_pose_api
+from utils.inference import call_face_api, predict_pose
 
 
 async def run_pose_workflow(session, encoded_images):
     async with asyncer.create_task_group() as task_group:
-        soon_values = [task_group.soonify(call_pose_api)(session, image) for image in encoded_images]
+        soon_values = [task_group.soonify(predict_pose)(session, image) for image in encoded_images]
     return [soon.value for soon in soon_values]
 
 
 async def run_face_workflow(session, encoded_images):
+    # The Face API takes one image per request, so faces are always detected per image
     async with asyncer.create_task_group() as task_group:
         soon_values = [task_group.soonify(call_face_api)(session, image) for image in encoded_images]
     return [soon.value for soon in soon_values]
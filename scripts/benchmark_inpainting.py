@@ -0,0 +1,68 @@
+"""Compare the depth inpainting backends on recorded depthmaps.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_inpainting <depthmap_dir> [--scan-version v3.0] [--holdout 0.05]
+
+<depthmap_dir> holds decrypted depthmap zip files as downloaded from /api/files.
+For each backend it prints the mean time per frame and two quality numbers:
+- holdout_mae: mean absolute error (m) on valid pixels that were hidden before inpainting
+- biharmonic_mae: mean absolute difference (m) to the biharmonic result on the missing pixels
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from utils.depth_preprocessing import (INPAINTING_METHODS, NORMALIZATION_VALUE, fill_zeros_inpainting,
+                                       get_raw_depthmaps, replace_values_above_threshold)
+
+
+def load_recorded_depthmaps(depthmap_dir, scan_version):
+    artifacts = []
+    for file_name in sorted(os.listdir(depthmap_dir)):
+        with open(os.path.join(depthmap_dir, file_name), 'rb') as f:
+            artifacts.append({'raw_file': f.read()})
+    depthmaps, _ = get_raw_depthmaps(artifacts, scan_version)
+    return [replace_values_above_threshold(dm.astype('float32'), NORMALIZATION_VALUE) for dm in depthmaps]
+
+
+def benchmark(depthmaps, holdout, seed=0):
+    rng = np.random.default_rng(seed)
+    holdout_masks = [(dm > 0) & (rng.random(dm.shape) < holdout) for dm in depthmaps]
+    reference = [fill_zeros_inpainting(dm, 'biharmonic') for dm in depthmaps]
+    report = {}
+    for method in INPAINTING_METHODS:
+        elapsed, holdout_errors, reference_errors = 0.0, [], []
+        for dm, holdout_mask, ref in zip(depthmaps, holdout_masks, reference):
+            start = time.perf_counter()
+            filled = fill_zeros_inpainting(dm, method)
+            elapsed += time.perf_counter() - start
+            reference_errors.append(np.abs(filled - ref)[dm == 0])
+            hidden = np.where(holdout_mask, 0, dm)
+            holdout_errors.append(np.abs(fill_zeros_inpainting(hidden, method) - dm)[holdout_mask])
+        report[method] = {
+            'ms_per_frame': 1000 * elapsed / len(depthmaps),
+            'holdout_mae': float(np.mean(np.concatenate(holdout_errors))),
+            'biharmonic_mae': float(np.mean(np.concatenate(reference_errors))),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('depthmap_dir')
+    parser.add_argument('--scan-version', default='v3.0')
+    parser.add_argument('--holdout', type=float, default=0.05)
+    args = parser.parse_args()
+
+    depthmaps = load_recorded_depthmaps(args.depthmap_dir, args.scan_version)
+    report = benchmark(depthmaps, args.holdout)
+    print(f"{len(depthmaps)} depthmaps")
+    print(f"{'method':<12}{'ms/frame':>12}{'holdout_mae':>14}{'biharmonic_mae':>16}")
+    for method, r in report.items():
+        print(f"{method:<12}{r['ms_per_frame']:>12.1f}{r['holdout_mae']:>14.4f}{r['biharmonic_mae']:>16.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Pixel-diff the LUT depth renderer against the matplotlib one it replaces.
+
+Usage (from the repository root):
+    python -m scripts.compare_depth_rendering <depthmap_dir> [--scan-version v3.0] [--scan-type standing]
+
+<depthmap_dir> holds decrypted depthmap zip files as downloaded from /api/files.
+For each renderer it prints the mean time and PNG size per frame, and for the pair the
+share of frames with the same output size, the mean absolute channel difference
+(0-255) and the share of pixels differing by more than --tolerance in any channel.
+"""
+import argparse
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from utils.constants import STANDING_TYPE, LYING_TYPE
+from utils.depth_preprocessing import get_raw_depthmaps, save_plot_as_binary_new
+from utils.depth_rendering import render_depthmap
+
+
+def load_recorded_depthmaps(depthmap_dir, scan_version):
+    artifacts = []
+    for file_name in sorted(os.listdir(depthmap_dir)):
+        with open(os.path.join(depthmap_dir, file_name), 'rb') as f:
+            artifacts.append({'raw_file': f.read()})
+    depthmaps, _ = get_raw_depthmaps(artifacts, scan_version)
+    return depthmaps
+
+
+def render_all(renderer, depthmaps, scan_type):
+    start = time.perf_counter()
+    pngs = [renderer(depthmap, scan_type) for depthmap in depthmaps]
+    return pngs, (time.perf_counter() - start) / len(depthmaps)
+
+
+def decode(png):
+    return np.asarray(Image.open(BytesIO(png)).convert('RGB'), dtype=np.int16)
+
+
+def compare(depthmaps, scan_type, tolerance):
+    reference, reference_time = render_all(save_plot_as_binary_new, depthmaps, scan_type)
+    rendered, rendered_time = render_all(render_depthmap, depthmaps, scan_type)
+    same_size, mean_diffs, differing = 0, [], []
+    for old, new in zip(reference, rendered):
+        old, new = decode(old), decode(new)
+        if old.shape != new.shape:
+            continue
+        same_size += 1
+        diff = np.abs(old - new)
+        mean_diffs.append(diff.mean())
+        differing.append((diff.max(axis=-1) > tolerance).mean())
+    return {
+        'matplotlib': {'ms_per_frame': 1000 * reference_time, 'png_bytes': np.mean([len(p) for p in reference])},
+        'lut': {'ms_per_frame': 1000 * rendered_time, 'png_bytes': np.mean([len(p) for p in rendered])},
+        'same_size': same_size / len(depthmaps),
+        'mean_abs_diff': float(np.mean(mean_diffs)) if mean_diffs else None,
+        'pixels_differing': float(np.mean(differing)) if differing else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('depthmap_dir')
+    parser.add_argument('--scan-version', default='v3.0')
+    parser.add_argument('--scan-type', default=STANDING_TYPE, choices=[STANDING_TYPE, LYING_TYPE])
+    parser.add_argument('--tolerance', type=int, default=8)
+    args = parser.parse_args()
+
+    depthmaps = load_recorded_depthmaps(args.depthmap_dir, args.scan_version)
+    report = compare(depthmaps, args.scan_type, args.tolerance)
+    print(f"{len(depthmaps)} depthmaps")
+    print(f"{'renderer':<12}{'ms/frame':>12}{'png_bytes':>12}")
+    for renderer in ('matplotlib', 'lut'):
+        print(f"{renderer:<12}{report[renderer]['ms_per_frame']:>12.1f}{report[renderer]['png_bytes']:>12.0f}")
+    print(f"same size: {report['same_size']:.0%}, mean abs diff: {report['mean_abs_diff']:.2f}, "
+          f"pixels differing > {args.tolerance}: {report['pixels_differing']:.2%}")
+
+
+if __name__ == '__main__':
+    main()
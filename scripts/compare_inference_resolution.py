@@ -0,0 +1,118 @@
+"""Measure how well face and pose detection on downscaled images agree with full resolution.
+
+Usage (from the repository root, with POSE_API_KEY and MS_FACE_API_KEY set):
+    python -m scripts.compare_inference_resolution <image_dir> [--max-edge 1280 960 640]
+
+<image_dir> holds RGB artifact JPEGs as downloaded from /api/files. Every image is sent
+to the face and pose APIs at full resolution and at each --max-edge, the detections are
+scaled back to full resolution like run_rgb_flow does and compared with the full
+resolution ones. Per setting it prints the mean upload size and latency per call and:
+- faces_same: share of images with the same number of faces
+- face_iou: mean IoU of the matched face rectangles
+- poses_same: share of images with the same number of poses
+- kpt_err_px: mean distance (full resolution pixels) between matching keypoints of the first pose
+- kpt_within: share of those keypoints within --tolerance of the long edge
+"""
+import argparse
+import os
+import time
+
+import anyio
+import numpy as np
+
+from utils.http_client import get_session
+from utils.inference import call_face_api, call_pose_api
+from utils.processing import pose_keypoints, scale_faces, scale_pose_prediction
+from utils.rgb_frame import RGBFrame
+
+
+def face_iou(a, b):
+    a, b = a['faceRectangle'], b['faceRectangle']
+    width = min(a['left'] + a['width'], b['left'] + b['width']) - max(a['left'], b['left'])
+    height = min(a['top'] + a['height'], b['top'] + b['height']) - max(a['top'], b['top'])
+    intersection = max(0, width) * max(0, height)
+    union = a['width'] * a['height'] + b['width'] * b['height'] - intersection
+    return intersection / union if union else 0.0
+
+
+def matched_ious(reference, faces):
+    """IoU of each reference face with its best unmatched counterpart, greedily."""
+    ious, unmatched = [], list(faces)
+    for face in reference:
+        if not unmatched:
+            break
+        best = max(unmatched, key=lambda other: face_iou(face, other))
+        ious.append(face_iou(face, best))
+        unmatched.remove(best)
+    return ious
+
+
+async def detect(session, frame):
+    jpeg = frame.inference_jpeg
+    start = time.perf_counter()
+    faces = await call_face_api(session, jpeg)
+    face_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    pose = await call_pose_api(session, jpeg)
+    pose_seconds = time.perf_counter() - start
+    factor = 1 / frame.inference_scale
+    return {'bytes': len(jpeg), 'face_seconds': face_seconds, 'pose_seconds': pose_seconds,
+            'faces': scale_faces(faces, factor), 'pose': scale_pose_prediction(pose, factor)}
+
+
+def agreement(reference, detections, long_edges, tolerance):
+    faces_same, ious, poses_same, errors, within = [], [], [], [], []
+    for ref, det, long_edge in zip(reference, detections, long_edges):
+        faces_same.append(len(ref['faces']) == len(det['faces']))
+        ious.extend(matched_ious(ref['faces'], det['faces']))
+        ref_kpts, det_kpts = pose_keypoints(ref['pose']), pose_keypoints(det['pose'])
+        poses_same.append(len(ref_kpts) == len(det_kpts))
+        if ref_kpts and det_kpts:
+            distances = np.linalg.norm(np.asarray(ref_kpts[0]) - np.asarray(det_kpts[0]), axis=-1)
+            errors.extend(distances)
+            within.extend(distances <= tolerance * long_edge)
+    return {
+        'kb': np.mean([d['bytes'] for d in detections]) / 1024,
+        'face_ms': 1000 * np.mean([d['face_seconds'] for d in detections]),
+        'pose_ms': 1000 * np.mean([d['pose_seconds'] for d in detections]),
+        'faces_same': np.mean(faces_same),
+        'face_iou': np.mean(ious) if ious else float('nan'),
+        'poses_same': np.mean(poses_same),
+        'kpt_err_px': np.mean(errors) if errors else float('nan'),
+        'kpt_within': np.mean(within) if within else float('nan'),
+    }
+
+
+async def compare(image_dir, max_edges, tolerance):
+    raw_files = []
+    for file_name in sorted(os.listdir(image_dir)):
+        with open(os.path.join(image_dir, file_name), 'rb') as f:
+            raw_files.append(f.read())
+    session = get_session('inference')
+    report = {}
+    try:
+        for max_edge in [0, *max_edges]:
+            frames = [RGBFrame(raw_file, max_edge=max_edge) for raw_file in raw_files]
+            report[max_edge] = ([await detect(session, frame) for frame in frames], [max(frame.size) for frame in frames])
+    finally:
+        await session.close()
+    reference, long_edges = report[0]
+    return {max_edge: agreement(reference, detections, long_edges, tolerance) for max_edge, (detections, _) in report.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('image_dir')
+    parser.add_argument('--max-edge', type=int, nargs='+', default=[1280, 960, 640])
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    args = parser.parse_args()
+
+    report = anyio.run(compare, args.image_dir, args.max_edge, args.tolerance)
+    columns = ['kb', 'face_ms', 'pose_ms', 'faces_same', 'face_iou', 'poses_same', 'kpt_err_px', 'kpt_within']
+    print(f"{'max_edge':<10}" + ''.join(f"{column:>12}" for column in columns))
+    for max_edge, row in report.items():
+        print(f"{max_edge or 'full':<10}" + ''.join(f"{row[column]:>12.2f}" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
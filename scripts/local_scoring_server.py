@@ -0,0 +1,53 @@
+"""Local stand-in for the depth model scoring endpoints.
+
+Usage (from the repository root):
+    python -m scripts.local_scoring_server [--port 8089]
+
+Accepts both the pickled arrays the deployed endpoints read and the encoded tensors
+of utils/tensor_codec.py on /score, and answers with one [prediction] per depthmap
+(the mean depth value), so the depth workflow can run end to end against it with
+    PCNN_HEIGHT_SCORING_URI=http://localhost:8089/score
+    PCNN_WEIGHT_SCORING_URI=http://localhost:8089/score
+    MOBILENET_HEIGHT_SCORING_URI=http://localhost:8089/score
+Every request logs the body size and the decoded batch shape, which makes it easy to
+compare the upload size of the DEPTH_TENSOR_ENCODING / DEPTH_TENSOR_COMPRESSION settings.
+"""
+import argparse
+import logging
+import pickle
+
+import numpy as np
+from aiohttp import web
+
+from utils.tensor_codec import TENSOR_CONTENT_TYPE, decode_tensor
+
+
+def decode_body(content_type, body):
+    if content_type == TENSOR_CONTENT_TYPE:
+        return decode_tensor(body)
+    return np.asarray(pickle.loads(body), dtype=np.float32)
+
+
+async def score(request):
+    body = await request.read()
+    try:
+        depthmaps = decode_body(request.content_type, body)
+    except Exception as error:
+        return web.json_response({'error': str(error)}, status=400)
+    logging.info(f"{request.content_type}: {len(body)} bytes, batch {depthmaps.shape}")
+    predictions = depthmaps.reshape(len(depthmaps), -1).mean(axis=1)
+    return web.json_response([[float(prediction)] for prediction in predictions])
+
+
+def create_app():
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    app.router.add_post('/score', score)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8089)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), port=args.port)
@@ -0,0 +1,50 @@
+"""Report the cold-start import cost of each queue trigger.
+
+Usage (from the repository root):
+    python -m scripts.profile_cold_start [--repeat 3]
+
+Every measurement runs in a fresh interpreter, like a newly scaled-out worker,
+and prints the import wall time and the peak RSS after the import.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+TRIGGER_MODULES = {
+    'rg_trigger': 'rg.entry',
+    'calculate_mean_result': 'rg.mean_entry',
+}
+
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in ('cv2', 'skimage', 'matplotlib', 'PIL', 'scipy', 'tensorflow') if m in sys.modules)
+print(json.dumps({{'seconds': elapsed, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'heavy_modules': heavy}}))
+'''
+
+
+def profile_import(module):
+    output = subprocess.run([sys.executable, '-c', PROBE.format(module=module)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'trigger':<24}{'module':<16}{'import_s':>10}{'max_rss_mb':>12}  heavy modules")
+    for trigger, module in TRIGGER_MODULES.items():
+        runs = [profile_import(module) for _ in range(args.repeat)]
+        seconds = min(r['seconds'] for r in runs)
+        rss = min(r['max_rss_mb'] for r in runs)
+        print(f"{trigger:<24}{module:<16}{seconds:>10.2f}{rss:>12.1f}  {', '.join(runs[0]['heavy_modules'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from utils.concurrency import AdaptiveLimiter
+
+pytestmark = pytest.mark.anyio
+
+
+class Response:
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+
+def response_error(status):
+    request_info = aiohttp.RequestInfo(URL('http://endpoint.test/'), 'GET', CIMultiDictProxy(CIMultiDict()))
+    return aiohttp.ClientResponseError(request_info, (), status=status)
+
+
+async def use_slot(limiter, status=None, error=None):
+    """One request through the limiter that gets `status` and/or raises `error`."""
+    try:
+        async with limiter.slot() as outcome:
+            if status is not None:
+                outcome.record(Response(status))
+            if error is not None:
+                raise error
+    except Exception as e:
+        if e is not error:
+            raise
+
+
+@pytest.mark.parametrize('status, error', [
+    (429, None), (503, None), (None, response_error(502)), (None, aiohttp.ClientConnectionError()),
+    (None, asyncio.TimeoutError()), (None, aiohttp.ServerDisconnectedError()),
+])
+async def test_back_pressure_halves_the_limit(status, error):
+    limiter = AdaptiveLimiter('test_back_pressure', initial_limit=8)
+    await use_slot(limiter, status, error)
+    assert limiter.limit == 4
+    assert limiter.stats['throttled'] == 1
+
+
+@pytest.mark.parametrize('status, error', [
+    (200, json.JSONDecodeError('Expecting value', '', 0)), (200, KeyError('scan')), (None, ValueError()), (201, TypeError()),
+])
+async def test_other_exceptions_leave_the_limit_alone(status, error):
+    limiter = AdaptiveLimiter('test_other_errors', initial_limit=8)
+    await use_slot(limiter, status, error)
+    assert limiter.limit == 8
+    assert limiter.in_flight == 0
+    assert limiter.stats == {'successes': 0, 'throttled': 0, 'client_errors': 0, 'errors': 1}
+
+
+async def test_client_errors_leave_the_limit_alone():
+    limiter = AdaptiveLimiter('test_client_errors', initial_limit=8)
+    await use_slot(limiter, error=response_error(404))
+    assert limiter.limit == 8
+    assert limiter.stats['client_errors'] == 1
+
+
+async def test_successes_raise_the_limit():
+    limiter = AdaptiveLimiter('test_successes', initial_limit=8)
+    await use_slot(limiter, 200)
+    assert limiter.limit == 8 + 1 / 8
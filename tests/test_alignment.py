@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import anyio
+import pytest
+
+pytest.importorskip('matplotlib')
+pytest.importorskip('skimage')
+
+import rg.alignment
+from rg.alignment import AlignmentStage
+from utils.constants import STANDING_TYPE
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def checked_pairs(monkeypatch):
+    """(rgb frame, depth frame) of every alignment check, which always passes."""
+    pairs = []
+
+    def check_rgb_depth_alignment(rgb_image, depthmap, max_depth, threshold):
+        pairs.append((rgb_image, depthmap))
+        return 1.0, True
+
+    monkeypatch.setattr(rg.alignment, 'check_rgb_depth_alignment', check_rgb_depth_alignment)
+    return pairs
+
+
+def artifact(artifact_id, order, scan_id='scan'):
+    return {'id': artifact_id, 'order': order, 'scan_id': scan_id}
+
+
+def make_plan(rgb, depth):
+    return SimpleNamespace(alignment_rgb=rgb, missing={'alignment': depth})
+
+
+async def run_stage(plan, frames):
+    stage = AlignmentStage(plan, 'workflow', STANDING_TYPE)
+    with anyio.fail_after(5):
+        async with stage.running():
+            for artifact_id in frames:
+                if stage.needs(artifact_id):
+                    stage.add_frame(artifact_id, f'frame {artifact_id}')
+            return await stage.get_results()
+
+
+async def test_checks_each_pair_once_both_frames_arrived(checked_pairs):
+    plan = make_plan([artifact('r1', 1), artifact('r2', 2)], [artifact('d1', 1), artifact('d2', 2)])
+    results = await run_stage(plan, ['d2', 'r1', 'r2', 'd1'])
+    assert sorted(checked_pairs) == [('frame r1', 'frame d1'), ('frame r2', 'frame d2')]
+    assert sorted(result['source_artifacts'][0] for result in results) == ['d1', 'd2']
+
+
+@pytest.mark.parametrize('frames', [['r1', 'd1', 'd2'], ['d1', 'd2', 'r1'], ['d1', 'r1', 'd2']])
+async def test_depth_frames_of_the_same_order_share_the_rgb_frame(checked_pairs, frames):
+    plan = make_plan([artifact('r1', 1)], [artifact('d1', 1), artifact('d2', 1)])
+    results = await run_stage(plan, frames)
+    assert sorted(checked_pairs) == [('frame r1', 'frame d1'), ('frame r1', 'frame d2')]
+    assert len(results) == 2
+
+
+async def test_no_pairs(checked_pairs):
+    assert await run_stage(make_plan([], []), ['r1', 'd1']) == []
+    assert checked_pairs == []
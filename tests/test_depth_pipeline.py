@@ -0,0 +1,67 @@
+import mmap
+from io import BytesIO
+from zipfile import ZipFile
+
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+pytest.importorskip('skimage')
+
+import utils.executors
+import utils.rest_api
+from utils.depth_preprocessing import DepthPreprocessingPipeline
+from utils.executors import uses_processes
+from utils.file_cache import FileCache
+from utils.rest_api import CgmApi
+
+pytestmark = pytest.mark.anyio
+
+
+def depth_artifact(seed, width=24, height=18):
+    """A depthmap zip as uploaded by the app: a header line, then 3 bytes per pixel."""
+    data = np.random.default_rng(seed).integers(0, 256, width * height * 3, dtype=np.uint8).tobytes()
+    buffer = BytesIO()
+    with ZipFile(buffer, 'w') as zip_file:
+        zip_file.writestr('data', f'{width}x{height}_0.001_7_0_0_0_1_0_0_0\n'.encode() + data)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def process_pool(monkeypatch):
+    monkeypatch.setattr(utils.executors, 'CPU_WORKERS', 1)
+    yield
+    if utils.executors.process_pool is not None:
+        utils.executors.process_pool.shutdown()
+        utils.executors.process_pool = None
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=1024 * 1024)
+    monkeypatch.setattr(utils.rest_api, 'file_cache', cache)
+    return cache
+
+
+async def test_cached_artifacts_are_preprocessed_in_worker_processes(process_pool, cache):
+    artifacts = [depth_artifact(seed) for seed in range(3)]
+    for file_id, artifact in enumerate(artifacts):
+        cache.put(file_id, artifact)
+
+    assert uses_processes()
+    pipeline = DepthPreprocessingPipeline('v1.0', len(artifacts), shared=True)
+    reference = DepthPreprocessingPipeline('v1.0', len(artifacts))
+    try:
+        for file_id, artifact in enumerate(artifacts):
+            raw_file, _ = await CgmApi().get_files(file_id)
+            assert isinstance(raw_file, mmap.mmap)
+            await pipeline.add_in_worker(file_id, raw_file)
+            reference.add(file_id, artifact)
+    finally:
+        pipeline.release_shared()
+
+    assert cache.get_stats()['hits'] == 3
+    assert np.array_equal(pipeline.pc_batch, reference.pc_batch)
+    assert np.array_equal(pipeline.mn_batch, reference.mn_batch)
+    for depthmap, expected in zip(pipeline.depthmaps, reference.depthmaps):
+        assert np.array_equal(depthmap, expected)
@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils.constants import LYING_TYPE, STANDING_TYPE
+from utils.depth_rendering import CANVAS_HEIGHT, CANVAS_WIDTH, JET_LUT, render_depthmap
+
+matplotlib = pytest.importorskip('matplotlib')
+matplotlib.use('Agg')
+
+
+def decode_png(png):
+    return cv2.imdecode(np.frombuffer(png, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_lut_matches_matplotlib_jet():
+    jet = matplotlib.colormaps['jet']
+    expected = (jet(np.arange(256))[:, :3] * 255).astype(np.uint8)
+    # JET_LUT is BGR for OpenCV
+    assert np.array_equal(JET_LUT[:, ::-1], expected)
+
+
+@pytest.mark.parametrize('scan_type', [STANDING_TYPE, LYING_TYPE])
+@pytest.mark.parametrize('shape', [(240, 180), (180, 135), (224, 224), (640, 480), (48, 36)])
+def test_output_size_matches_matplotlib(shape, scan_type):
+    pytest.importorskip('skimage')
+    from utils.depth_preprocessing import save_plot_as_binary_new
+
+    depthmap = np.random.default_rng(0).uniform(0, 3, shape).astype(np.float32)
+    assert decode_png(render_depthmap(depthmap, scan_type)).shape == decode_png(save_plot_as_binary_new(depthmap, scan_type)).shape
+
+
+def smooth_depthmap(shape):
+    """A depth field varying over tens of pixels, with a hole of invalid zeros."""
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    depthmap = 1.0 + 0.8 * np.sin(x / 17.0) * np.cos(y / 23.0) + 0.5 * y / shape[0]
+    depthmap[(x - shape[1] / 2) ** 2 + (y - shape[0] / 2) ** 2 < (shape[1] / 6) ** 2] = 0
+    return depthmap.astype(np.float32)
+
+
+@pytest.mark.parametrize('scan_type', [STANDING_TYPE, LYING_TYPE])
+@pytest.mark.parametrize('shape', [(240, 180), (224, 224), (640, 480), (180, 135), (48, 36)])
+def test_pixels_match_matplotlib(shape, scan_type):
+    """
+    Enlarged 3x or more both draw nearest-neighbour pixels and must be identical.
+    Otherwise both interpolate, slightly differently: the mean channel difference
+    must stay below 1.5 (of 255) and under 1% of pixels may differ by more than 8.
+    """
+    pytest.importorskip('skimage')
+    from utils.depth_preprocessing import save_plot_as_binary_new
+
+    depthmap = smooth_depthmap(shape)
+    rendered = decode_png(render_depthmap(depthmap, scan_type)).astype(np.int16)
+    reference = decode_png(save_plot_as_binary_new(depthmap, scan_type)).astype(np.int16)
+    diff = np.abs(rendered - reference).max(axis=-1)
+    if min(CANVAS_WIDTH / shape[0], CANVAS_HEIGHT / shape[1]) >= 3:
+        assert diff.max() == 0
+    else:
+        assert diff.mean() < 1.5
+        assert (diff > 8).mean() < 0.01
+
+
+def test_colours_follow_the_scan_type_range():
+    depthmap = np.full((240, 180), 1.5, dtype=np.float32)
+    # 1.5 m is mid-range when standing and the top of the range when lying
+    assert np.array_equal(decode_png(render_depthmap(depthmap, STANDING_TYPE))[0, 0], JET_LUT[128])
+    assert np.array_equal(decode_png(render_depthmap(depthmap, LYING_TYPE))[0, 0], JET_LUT[255])
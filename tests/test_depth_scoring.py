@@ -0,0 +1,65 @@
+import pickle
+
+import aiohttp
+import numpy as np
+import pytest
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from utils.inference import score_depth_batches
+from utils.tensor_codec import PICKLE_CONTENT_TYPE, decode_tensor
+
+pytestmark = pytest.mark.anyio
+
+
+def response_error(status):
+    request_info = aiohttp.RequestInfo(URL('http://scoring.test/score'), 'POST', CIMultiDictProxy(CIMultiDict()))
+    return aiohttp.ClientResponseError(request_info, (), status=status)
+
+
+class FakeScoringCall:
+    """Scores a depth batch with its frame ids (the first pixel), failing as told."""
+
+    __name__ = 'fake_scoring_call'
+
+    def __init__(self, bad_frames=(), status=None):
+        self.bad_frames = set(bad_frames)
+        self.status = status
+        self.batch_sizes = []
+
+    async def __call__(self, session, payload):
+        depthmaps = pickle.loads(payload.body) if payload.content_type == PICKLE_CONTENT_TYPE else decode_tensor(payload.body)
+        frame_ids = [int(depthmap.flat[0]) for depthmap in depthmaps]
+        self.batch_sizes.append(len(frame_ids))
+        if self.status is not None:
+            raise response_error(self.status)
+        if self.bad_frames & set(frame_ids):
+            raise response_error(422)
+        return [[frame_id] for frame_id in frame_ids]
+
+
+def depth_batch(count):
+    return np.arange(count, dtype=np.float32).reshape(count, 1, 1, 1) * np.ones((1, 4, 4, 1), dtype=np.float32)
+
+
+async def test_scores_every_frame_in_chunks():
+    call = FakeScoringCall()
+    [results] = await score_depth_batches(None, [call], depth_batch(10), list(range(10)), max_batch_size=4)
+    assert results == {key: [key] for key in range(10)}
+    assert sorted(call.batch_sizes) == [2, 4, 4]
+
+
+async def test_rejected_payload_is_split_to_the_failing_frame():
+    call = FakeScoringCall(bad_frames={5})
+    [results] = await score_depth_batches(None, [call], depth_batch(8), list(range(8)), max_batch_size=8)
+    assert results == {key: [key] for key in range(8) if key != 5}
+
+
+@pytest.mark.parametrize('status', [401, 404])
+async def test_endpoint_errors_are_not_split(status):
+    call = FakeScoringCall(status=status)
+    with pytest.raises(BaseException) as raised:
+        await score_depth_batches(None, [call], depth_batch(8), list(range(8)), max_batch_size=8)
+    errors = raised.value.exceptions if isinstance(raised.value, BaseExceptionGroup) else [raised.value]
+    assert [error.status for error in errors] == [status]
+    assert call.batch_sizes == [8]
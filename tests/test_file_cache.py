@@ -0,0 +1,108 @@
+import mmap
+import os
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import utils.rest_api
+from utils.file_cache import FileCache
+from utils.rest_api import CgmApi
+
+
+def cached_ids(cache, file_ids):
+    return [file_id for file_id in file_ids if os.path.exists(cache.path(cache.key(file_id)))]
+
+
+def test_evicts_least_recently_used_first(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=30)
+    for file_id in 'abc':
+        cache.put(file_id, file_id.encode() * 10)
+    assert cache.get('a') is not None  # 'b' is now the least recently used
+
+    cache.put('d', b'd' * 10)
+
+    assert cached_ids(cache, 'abcd') == ['a', 'c', 'd']
+    assert cache.get('b') is None
+    assert cache.get_stats() == {'hits': 1, 'misses': 1, 'evictions': 1, 'bytes': 30, 'entries': 3}
+
+    cache.put('e', b'e' * 20)
+    assert cached_ids(cache, 'abcde') == ['d', 'e']
+
+
+def test_files_larger_than_the_cache_are_not_stored(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=30)
+    cache.put('a', b'a' * 10)
+    cache.put('big', b'x' * 31)
+    assert cached_ids(cache, ['a', 'big']) == ['a']
+    assert cache.get_stats()['evictions'] == 0
+
+
+def test_hits_are_read_only_mmaps_of_the_stored_bytes(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=100)
+    cache.put('a', b'abc')
+    cache.put('empty', b'')
+
+    hit = cache.get('a')
+    assert isinstance(hit, mmap.mmap)
+    assert hit[:] == b'abc'
+    with pytest.raises(TypeError):
+        hit[0] = 0
+    assert cache.get('empty') == b''
+
+
+def test_rebuilds_the_lru_order_from_disk(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=30)
+    for mtime, file_id in enumerate('abc'):
+        cache.put(file_id, file_id.encode() * 10)
+        os.utime(cache.path(cache.key(file_id)), (mtime, mtime))
+
+    restarted = FileCache(str(tmp_path), max_bytes=30)
+    restarted.put('d', b'd' * 10)
+    assert cached_ids(restarted, 'abcd') == ['b', 'c', 'd']
+
+
+def test_zero_budget_bypasses_the_cache(tmp_path):
+    cache = FileCache(str(tmp_path / 'cache'), max_bytes=0)
+    assert not cache.enabled
+    cache.put('a', b'abc')
+    assert cache.get('a') is None
+    assert not os.path.exists(tmp_path / 'cache')
+    assert cache.get_stats() == {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0, 'entries': 0}
+
+
+@pytest.fixture
+async def files_server(monkeypatch):
+    files = {'1': b'first file', '2': b'second file'}
+    requests = []
+
+    async def get_file(request):
+        requests.append(request.match_info['file_id'])
+        return web.Response(body=files[request.match_info['file_id']])
+
+    app = web.Application()
+    app.router.add_get('/api/files/{file_id}', get_file)
+    async with TestServer(app) as server:
+        monkeypatch.setenv('APP_URL', str(server.make_url('')).rstrip('/'))
+        monkeypatch.setenv('API_KEY', 'test')
+        yield requests
+
+
+@pytest.mark.parametrize('max_bytes', [1024, 0])
+@pytest.mark.anyio
+async def test_get_files_downloads_each_file_once(monkeypatch, tmp_path, files_server, max_bytes):
+    cache = FileCache(str(tmp_path), max_bytes=max_bytes)
+    monkeypatch.setattr(utils.rest_api, 'file_cache', cache)
+    api = CgmApi()
+
+    results = [await api.get_files(file_id) for file_id in ['1', '2', '1', '1']]
+
+    assert [bytes(data) for data, _ in results] == [b'first file', b'second file', b'first file', b'first file']
+    assert {status for _, status in results} == {200}
+    if max_bytes:
+        assert files_server == ['1', '2']
+        assert isinstance(results[2][0], mmap.mmap)
+        assert cache.get_stats()['hits'] == 2
+        assert cache.get_stats()['misses'] == 2
+    else:
+        assert files_server == ['1', '2', '1', '1']
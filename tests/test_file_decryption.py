@@ -0,0 +1,121 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import utils.file_decryption
+import utils.rest_api
+from utils.file_cache import FileCache
+from utils.file_decryption import StreamDecryptor, decrypt_file_data
+from utils.rest_api import CgmApi
+
+KEY = bytearray(b'\x13\x8c\x5a\xf0\x27\x9e\x41')  # 7 bytes, so blocks and chunks rarely align with it
+BLOCK_SIZE = 64  # rounded down to 63 bytes (9 key lengths) per block
+
+
+def reference_decrypt(raw_file, buffer_size=8192):
+    """The original whole-buffer decrypt, XORing one byte at a time."""
+    input_stream = BytesIO(raw_file)
+    output = BytesIO()
+    key_index = 0
+    buffer = bytearray(buffer_size)
+    while True:
+        bytes_read = input_stream.readinto(buffer)
+        if bytes_read == 0:
+            break
+        for i in range(bytes_read):
+            buffer[i] ^= KEY[key_index % len(KEY)]
+            key_index += 1
+        output.write(buffer[:bytes_read])
+    return output.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def key(monkeypatch):
+    monkeypatch.setattr(utils.file_decryption, 'KEY', KEY)
+    monkeypatch.setattr(utils.file_decryption, 'DECRYPTION_BLOCK_SIZE', BLOCK_SIZE)
+    monkeypatch.setattr(utils.file_decryption, '_key_block', None)
+
+
+def ciphertext(size, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8).tobytes()
+
+
+@pytest.mark.parametrize('size', [0, 1, 6, 7, 62, 63, 64, 500, 4096])
+def test_whole_buffer_matches_reference(size):
+    raw_file = ciphertext(size, seed=size)
+    assert decrypt_file_data(raw_file) == reference_decrypt(raw_file)
+    assert decrypt_file_data(memoryview(raw_file)) == reference_decrypt(raw_file)
+
+
+@pytest.mark.parametrize('chunk_sizes', [
+    [1] * 20,
+    [3, 5, 11, 2],  # boundaries inside the key
+    [30, 40, 50],  # boundaries inside a 63-byte block
+    [62, 1, 1, 63, 64, 200],  # boundaries on and around block edges
+    [500],
+    [0, 17, 0, 100],
+])
+def test_stream_matches_whole_buffer(chunk_sizes):
+    raw_file = ciphertext(sum(chunk_sizes) + 10, seed=len(chunk_sizes))
+    decryptor = StreamDecryptor()
+    start = 0
+    for size in chunk_sizes + [10]:
+        decryptor.update(raw_file[start:start + size])
+        start += size
+    assert decryptor.getvalue() == reference_decrypt(raw_file)
+    assert decryptor.getvalue() == decrypt_file_data(raw_file)
+
+
+def test_random_chunking_matches_reference():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        raw_file = rng.integers(0, 256, int(rng.integers(0, 2000)), dtype=np.uint8).tobytes()
+        boundaries = np.sort(rng.integers(0, len(raw_file) + 1, int(rng.integers(0, 12))))
+        decryptor = StreamDecryptor()
+        for chunk in np.split(np.frombuffer(raw_file, dtype=np.uint8), boundaries):
+            decryptor.update(chunk.tobytes())
+        assert decryptor.getvalue() == reference_decrypt(raw_file)
+
+
+@pytest.fixture
+async def files_server(monkeypatch):
+    files = {'1': ciphertext(1000, seed=1)}
+
+    async def get_file(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        body = files[request.match_info['file_id']]
+        for start in range(0, len(body), 100):
+            await response.write(body[start:start + 100])
+        return response
+
+    app = web.Application()
+    app.router.add_get('/api/files/{file_id}', get_file)
+    async with TestServer(app) as server:
+        monkeypatch.setenv('APP_URL', str(server.make_url('')).rstrip('/'))
+        monkeypatch.setenv('API_KEY', 'test')
+        yield files
+
+
+@pytest.mark.parametrize('max_bytes', [0, 4096])
+@pytest.mark.anyio
+async def test_get_files_decrypts_downloads_and_cache_hits(monkeypatch, tmp_path, files_server, max_bytes):
+    monkeypatch.setattr(utils.rest_api, 'DOWNLOAD_CHUNK_SIZE', 40)  # boundaries inside blocks
+    cache = FileCache(str(tmp_path), max_bytes=max_bytes)
+    monkeypatch.setattr(utils.rest_api, 'file_cache', cache)
+    api = CgmApi()
+    expected = reference_decrypt(files_server['1'])
+
+    downloaded, status = await api.get_files('1', decrypt=True)
+    assert (bytes(downloaded), status) == (expected, 200)
+
+    # The cache keeps the file as served
+    raw_file, _ = await api.get_files('1')
+    assert bytes(raw_file) == files_server['1']
+
+    again, _ = await api.get_files('1', decrypt=True)
+    assert bytes(again) == expected
+    assert cache.get_stats()['hits'] == (2 if max_bytes else 0)
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import threading
+
+import pytest
+
+from utils.http_client import ClientManager
+
+
+async def open_session(manager):
+    return manager.get_session('test')
+
+
+def test_reuses_the_session_within_a_loop():
+    manager = ClientManager()
+
+    async def main():
+        first, second = manager.get_session('test'), manager.get_session('test')
+        await manager.close()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first is second
+
+
+def test_closes_the_session_of_a_running_previous_loop():
+    manager = ClientManager()
+    old_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=old_loop.run_forever)
+    thread.start()
+    try:
+        stale = asyncio.run_coroutine_threadsafe(open_session(manager), old_loop).result(5)
+
+        async def main():
+            session = manager.get_session('test')
+            for _ in range(100):
+                if stale.closed:
+                    break
+                await asyncio.sleep(0.01)
+            await manager.close()
+            return session
+
+        assert asyncio.run(main()) is not stale
+        assert stale.closed
+    finally:
+        old_loop.call_soon_threadsafe(old_loop.stop)
+        thread.join()
+        old_loop.close()
+
+
+@pytest.mark.filterwarnings('ignore::ResourceWarning')
+def test_logs_the_session_of_a_stopped_previous_loop(caplog):
+    manager = ClientManager()
+    stale = asyncio.run(open_session(manager))
+
+    async def main():
+        session = manager.get_session('test')
+        await manager.close()
+        return session
+
+    with caplog.at_level(logging.WARNING):
+        assert asyncio.run(main()) is not stale
+    assert "stopped event loop" in caplog.text
@@ -0,0 +1,206 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+pytest.importorskip('skimage')
+
+from utils.depth_preprocessing import inpaint_depth_by_columnwise_mean, inpaint_depth_by_rowwise_mean
+
+
+def reference_rowwise_mean(depth, mask, max_depth, rng):
+    """
+    inpaint_depth_by_rowwise_mean as it was before vectorizing, drawing from `rng`.
+
+    Inpaint missing values in depth using row-wise IQR mean.
+    - If >10% of row is missing, sample randomly in (mean-0.1, mean+0.1).
+    - Otherwise, use normal IQR mean.
+    - If the entire row is missing, check adjacent rows (left or right) for valid depth and adjust.
+    """
+    inpainted = depth.copy()
+    height, width = depth.shape
+
+    mask_valid = (mask > 0)
+    depth_valid = (depth > 0) & (depth <= max_depth)
+    overall_valid_mask = mask_valid & depth_valid
+    overall_mask_mean = depth[overall_valid_mask].mean() if np.any(overall_valid_mask) else 0
+
+    for row in range(height):
+        row_mask = mask_valid[row, :]
+        row_depth = depth[row, :]
+        valid_row = row_mask & (row_depth > 0) & (row_depth <= max_depth)
+        
+        missing_row = row_mask & ((row_depth == 0) | (row_depth > max_depth))
+        missing_ratio = np.sum(missing_row) / np.sum(row_mask) if np.sum(row_mask) > 0 else 1.0
+
+        if np.any(valid_row):
+            row_valid_depths = row_depth[valid_row]
+            q1 = np.percentile(row_valid_depths, 25)
+            q3 = np.percentile(row_valid_depths, 75)
+            iqr_values = row_valid_depths[(row_valid_depths >= q1) & (row_valid_depths <= q3)]
+            row_mean = iqr_values.mean() if len(iqr_values) > 0 else row_valid_depths.mean()
+
+            if missing_ratio > 0.1:
+                # Sample randomly around the overall_mask_mean
+                low = overall_mask_mean - 0.1
+                high = overall_mask_mean + 0.1
+                sampled_values = rng.uniform(low, high, size=np.sum(missing_row))
+            else:
+                sampled_values = np.full(np.sum(missing_row), row_mean)
+        else:
+            # Entire row invalid — check adjacent rows (left or right)
+            above = row - 1 if row > 0 else None
+            below = row + 1 if row < height - 1 else None
+            means = []
+            if above is not None:
+                valid_above = mask_valid[above, :] & (depth[above, :] > 0) & (depth[above, :] < max_depth)
+                if np.any(valid_above):
+                    row_valid_above = depth[above, :][valid_above]
+                    q1_above = np.percentile(row_valid_above, 25)
+                    q3_above = np.percentile(row_valid_above, 75)
+                    iqr_above = row_valid_above[(row_valid_above >= q1_above) & (row_valid_above <= q3_above)]
+                    means.append(iqr_above.mean() if len(iqr_above) > 0 else row_valid_above.mean())
+            if below is not None:
+                valid_below = mask_valid[below, :] & (depth[below, :] > 0) & (depth[below, :] < max_depth)
+                if np.any(valid_below):
+                    row_valid_below = depth[below, :][valid_below]
+                    q1_below = np.percentile(row_valid_below, 25)
+                    q3_below = np.percentile(row_valid_below, 75)
+                    iqr_below = row_valid_below[(row_valid_below >= q1_below) & (row_valid_below <= q3_below)]
+                    means.append(iqr_below.mean() if len(iqr_below) > 0 else row_valid_below.mean())
+
+            if means:
+                row_mean = np.mean(means)
+            else:
+                row_mean = overall_mask_mean
+
+            sampled_values = rng.uniform(row_mean - 0.1, row_mean + 0.1, size=np.sum(missing_row))
+
+        missing_indices = np.where(missing_row)[0]
+        inpainted[row, missing_indices] = sampled_values
+
+    return inpainted
+
+
+def reference_columnwise_mean(depth, mask, max_depth, rng):
+    """
+    inpaint_depth_by_columnwise_mean as it was before vectorizing, drawing from `rng`.
+
+    Inpaint missing values in depth using column-wise IQR mean for lying children.
+    - If >10% of column is missing, sample randomly in (mean-0.05, mean+0.05).
+    - Otherwise, use normal IQR mean.
+    - If the entire column is missing, check adjacent columns (left or right) for valid depth and adjust.
+    """
+    inpainted = depth.copy()
+    height, width = depth.shape
+
+    mask_valid = (mask > 0)
+    depth_valid = (depth > 0) & (depth <= max_depth)
+    overall_valid_mask = mask_valid & depth_valid
+    overall_mask_mean = depth[overall_valid_mask].mean() if np.any(overall_valid_mask) else 0
+
+    for col in range(width):
+        col_mask = mask_valid[:, col]
+        col_depth = depth[:, col]
+        valid_col = col_mask & (col_depth > 0) & (col_depth <= max_depth)
+
+        missing_col = col_mask & ((col_depth == 0) | (col_depth > max_depth))
+        missing_ratio = np.sum(missing_col) / np.sum(col_mask) if np.sum(col_mask) > 0 else 1.0
+
+        if np.any(valid_col):
+            col_valid_depths = col_depth[valid_col]
+            q1 = np.percentile(col_valid_depths, 25)
+            q3 = np.percentile(col_valid_depths, 75)
+            iqr_values = col_valid_depths[(col_valid_depths >= q1) & (col_valid_depths <= q3)]
+            col_mean = iqr_values.mean() if len(iqr_values) > 0 else col_valid_depths.mean()
+
+            if missing_ratio > 0.1:
+                # Sample randomly around the overall_mask_mean
+                low = overall_mask_mean - 0.05
+                high = overall_mask_mean + 0.05
+                sampled_values = rng.uniform(low, high, size=np.sum(missing_col))
+            else:
+                sampled_values = np.full(np.sum(missing_col), col_mean)
+        else:
+            # Entire column invalid — check adjacent columns (left or right)
+            left = col - 1 if col > 0 else None
+            right = col + 1 if col < width - 1 else None
+            means = []
+            if left is not None:
+                valid_left = mask_valid[:, left] & (depth[:, left] > 0) & (depth[:, left] < max_depth)
+                if np.any(valid_left):
+                    left_depths = depth[:, left][valid_left]
+                    q1_left = np.percentile(left_depths, 25)
+                    q3_left = np.percentile(left_depths, 75)
+                    iqr_left = left_depths[(left_depths >= q1_left) & (left_depths <= q3_left)]
+                    means.append(iqr_left.mean() if len(iqr_left) > 0 else left_depths.mean())
+            if right is not None:
+                valid_right = mask_valid[:, right] & (depth[:, right] > 0) & (depth[:, right] < max_depth)
+                if np.any(valid_right):
+                    right_depths = depth[:, right][valid_right]
+                    q1_right = np.percentile(right_depths, 25)
+                    q3_right = np.percentile(right_depths, 75)
+                    iqr_right = right_depths[(right_depths >= q1_right) & (right_depths <= q3_right)]
+                    means.append(iqr_right.mean() if len(iqr_right) > 0 else right_depths.mean())
+
+            if means:
+                col_mean = np.mean(means)
+            else:
+                col_mean = overall_mask_mean
+
+            sampled_values = rng.uniform(col_mean - 0.05, col_mean + 0.05, size=np.sum(missing_col))
+
+        missing_indices = np.where(missing_col)[0]
+        inpainted[missing_indices, col] = sampled_values
+
+    return inpainted
+
+
+def child_depthmap(seed, shape=(240, 180), max_depth=3.0):
+    """
+    A depthmap with a child mask and missing depth: scattered holes, a few rows and
+    columns missing more than 10%, fully missing ones, and values above max_depth.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    y, x = np.mgrid[:height, :width]
+    mask = (((y - height / 2) / (height * 0.4)) ** 2 + ((x - width / 2) / (width * 0.3)) ** 2 < 1).astype(np.uint8)
+    depth = rng.uniform(0.2, max_depth, shape).astype(np.float32)
+    depth[rng.random(shape) < 0.03] = 0
+    depth[rng.random(shape) < 0.01] = max_depth + 1
+    for index in rng.choice(height, 8, replace=False):
+        depth[index, rng.random(width) < 0.3] = 0
+    for index in rng.choice(width, 8, replace=False):
+        depth[rng.random(height) < 0.3, index] = 0
+    depth[rng.choice(height, 3, replace=False)] = 0
+    depth[:, rng.choice(width, 3, replace=False)] = 0
+    # Two adjacent empty rows and columns, so some have no valid neighbour either
+    depth[height // 2:height // 2 + 2] = 0
+    depth[:, width // 2:width // 2 + 2] = 0
+    return depth, mask
+
+
+def assert_same_fill(inpainted, expected, depth):
+    assert inpainted.dtype == expected.dtype
+    assert np.array_equal(inpainted != depth, expected != depth)
+    np.testing.assert_allclose(inpainted, expected, rtol=0, atol=5e-7)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_rowwise_matches_loop(seed):
+    depth, mask = child_depthmap(seed)
+    inpainted = inpaint_depth_by_rowwise_mean(depth, mask, 3.0, rng=seed)
+    assert_same_fill(inpainted, reference_rowwise_mean(depth, mask, 3.0, np.random.default_rng(seed)), depth)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_columnwise_matches_loop(seed):
+    depth, mask = child_depthmap(seed, max_depth=1.5)
+    inpainted = inpaint_depth_by_columnwise_mean(depth, mask, 1.5, rng=seed)
+    assert_same_fill(inpainted, reference_columnwise_mean(depth, mask, 1.5, np.random.default_rng(seed)), depth)
+
+
+def test_nothing_to_fill():
+    depth = np.full((12, 9), 1.0, dtype=np.float32)
+    mask = np.ones((12, 9), dtype=np.uint8)
+    assert np.array_equal(inpaint_depth_by_rowwise_mean(depth, mask), depth)
+    assert np.array_equal(inpaint_depth_by_columnwise_mean(depth, mask), depth)
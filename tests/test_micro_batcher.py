@@ -0,0 +1,71 @@
+import anyio
+import pytest
+
+from utils.inference import MicroBatcher
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingBatchCall:
+    def __init__(self, hang_first=False):
+        self.batches = []
+        self.hang_first = hang_first
+
+    async def __call__(self, session, items):
+        self.batches.append(list(items))
+        if self.hang_first and len(self.batches) == 1:
+            await anyio.sleep_forever()
+        return [f"result {item}" for item in items]
+
+
+async def submit_into(batcher, item, results):
+    results[item] = await batcher.submit(None, item)
+
+
+async def test_batches_up_to_max_size():
+    call = RecordingBatchCall()
+    batcher = MicroBatcher(call, max_batch_size=3, max_wait=1)
+    results = {}
+    async with anyio.create_task_group() as task_group:
+        for item in range(5):
+            task_group.start_soon(submit_into, batcher, item, results)
+    assert results == {item: f"result {item}" for item in range(5)}
+    assert sorted(map(sorted, call.batches)) == [[0, 1, 2], [3, 4]]
+
+
+async def test_leader_cancelled_while_waiting():
+    call = RecordingBatchCall()
+    batcher = MicroBatcher(call, max_batch_size=10, max_wait=0.2)
+    results = {}
+
+    async def leader():
+        with anyio.move_on_after(0.05):
+            await batcher.submit(None, 'leader')
+
+    with anyio.fail_after(5):
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(leader)
+            await anyio.sleep(0.01)
+            task_group.start_soon(submit_into, batcher, 'follower', results)
+    assert results == {'follower': "result follower"}
+    assert call.batches == [['follower']]
+    assert batcher.batch is None
+
+
+async def test_leader_cancelled_while_sending():
+    call = RecordingBatchCall(hang_first=True)
+    batcher = MicroBatcher(call, max_batch_size=2, max_wait=0.2)
+    results = {}
+
+    async def leader():
+        with anyio.move_on_after(0.1):
+            await batcher.submit(None, 'leader')
+
+    with anyio.fail_after(5):
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(leader)
+            await anyio.sleep(0.01)
+            task_group.start_soon(submit_into, batcher, 'follower', results)
+    assert results == {'follower': "result follower"}
+    assert batcher.batch is None
+    assert await batcher.submit(None, 'later') == "result later"
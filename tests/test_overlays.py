@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('matplotlib')
+pytest.importorskip('skimage')
+
+import cv2
+
+from utils.processing import add_label_cv, composite_masks, encode_image, overlay_mask, plot_with_masks_on_image
+
+
+def reference_overlay_mask(image, mask, color, alpha=0.3):
+    """overlay_mask as it was before composite_masks."""
+    if image.ndim == 2:
+        image = np.stack([image] * 3, axis=-1)
+    overlay = image.copy()
+    for c in range(3):
+        overlay[..., c] = np.where(mask, (1 - alpha) * overlay[..., c] + alpha * color[c] * 255, overlay[..., c])
+    return np.clip(overlay, 0, 255).astype(np.uint8)
+
+
+def reference_label_anchor(mask, margin=50):
+    """Where add_label_cv put the label before it searched a subsampled mask."""
+    H, W = mask.shape[:2]
+    pos = np.argwhere(mask)
+    pos = pos[(pos[:, 0] > margin) & (pos[:, 0] < H - margin) & (pos[:, 1] > margin) & (pos[:, 1] < W - margin)]
+    return tuple(pos[len(pos) // 2]) if len(pos) else None
+
+
+def random_masks(rng, count, shape=(320, 240)):
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    for _ in range(count):
+        cy, cx = rng.uniform(0, shape[0]), rng.uniform(0, shape[1])
+        ry, rx = rng.uniform(10, shape[0]), rng.uniform(10, shape[1])
+        yield (((y - cy) / ry) ** 2 + ((x - cx) / rx) ** 2 < 1) | (rng.random(shape) < 0.01)
+
+
+def test_composite_matches_repeated_overlay_mask():
+    rng = np.random.default_rng(0)
+    image = (rng.random((320, 240, 3)) * 255).astype(np.uint8)
+    layers = [(mask, color) for mask, color in zip(random_masks(rng, 3), [(0.6, 1.0, 0.6), (1.0, 0.7, 0.8), (0.4, 0.7, 1.0)])]
+    expected = image
+    for mask, color in layers:
+        expected = reference_overlay_mask(expected, mask, color)
+    assert np.array_equal(composite_masks(image.copy(), layers, chunk_rows=64), expected)
+
+
+def test_overlay_mask_matches_reference_for_grayscale():
+    rng = np.random.default_rng(1)
+    image = (rng.random((50, 40)) * 255).astype(np.uint8)
+    mask = rng.random((50, 40)) > 0.5
+    assert np.array_equal(overlay_mask(image, mask, (1.0, 0.7, 0.8)), reference_overlay_mask(image, mask, (1.0, 0.7, 0.8)))
+
+
+def test_none_masks_leave_the_image_alone():
+    rng = np.random.default_rng(4)
+    image = np.full((60, 40, 3), 100, dtype=np.uint8)
+    [mask] = random_masks(rng, 1, shape=(60, 40))
+    expected = reference_overlay_mask(reference_overlay_mask(image, mask, (0.6, 1.0, 0.6)), None, (1.0, 0.7, 0.8))
+    assert np.array_equal(composite_masks(image.copy(), [(mask, (0.6, 1.0, 0.6)), (None, (1.0, 0.7, 0.8))]), expected)
+    assert np.array_equal(composite_masks(image.copy(), [(None, (1.0, 0.7, 0.8))]), image)
+    assert np.array_equal(overlay_mask(image, None, (1.0, 0.7, 0.8)), image)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.int32])
+def test_overlay_mask_blends_other_dtypes_before_clipping(dtype):
+    rng = np.random.default_rng(5)
+    image = (rng.random((50, 40, 3)) * 300 - 20).astype(dtype)
+    mask = rng.random((50, 40)) > 0.5
+    assert np.array_equal(overlay_mask(image, mask, (0.4, 0.7, 1.0)), reference_overlay_mask(image, mask, (0.4, 0.7, 1.0)))
+
+
+def reference_plot_with_masks(image, wall_mask, floor_mask, child_mask, foot_mask, is_standing):
+    """plot_with_masks_on_image as it was before composite_masks, for a non-depth image."""
+    combined = reference_overlay_mask(image, floor_mask, (0.6, 1.0, 0.6))
+    combined = reference_overlay_mask(combined, child_mask, (1.0, 0.7, 0.8))
+    if is_standing:
+        combined = reference_overlay_mask(combined, wall_mask, (0.4, 0.7, 1.0))
+    elif foot_mask is not None:
+        combined = reference_overlay_mask(combined, foot_mask, (0.9, 0.9, 0.1))
+    combined = add_label_cv(combined, child_mask, "Child", color=(255, 0, 0))
+    combined = add_label_cv(combined, floor_mask, "Floor", color=(0, 255, 0))
+    return encode_image(cv2.rotate(combined, cv2.ROTATE_90_COUNTERCLOCKWISE)[:, :, ::-1])
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.float32])
+@pytest.mark.parametrize('is_standing, with_wall, with_foot', [(True, True, False), (True, False, False), (False, False, True), (False, False, False)])
+def test_plot_with_masks_matches_reference(dtype, is_standing, with_wall, with_foot):
+    rng = np.random.default_rng(6)
+    image = (rng.random((320, 240, 3)) * 255).astype(dtype)
+    wall, floor, child, foot = random_masks(rng, 4)
+    wall, foot = (wall if with_wall else None), (foot if with_foot else None)
+    plotted = plot_with_masks_on_image(image.copy(), wall, floor, child, foot, is_standing=is_standing)
+    assert plotted == reference_plot_with_masks(image, wall, floor, child, foot, is_standing)
+
+
+def test_label_position_matches_reference_with_step_1():
+    rng = np.random.default_rng(2)
+    for mask in random_masks(rng, 50):
+        anchor = reference_label_anchor(mask)
+        blank = np.zeros(mask.shape + (3,), dtype=np.uint8)
+        drawn = add_label_cv(blank.copy(), mask, "X")
+        expected = blank.copy()
+        if anchor is not None:
+            y, x = anchor
+            cv2.putText(expected, "X", (int(x), int(y)), cv2.FONT_HERSHEY_SIMPLEX, fontScale=2, color=(0, 0, 255), thickness=2)
+        assert np.array_equal(drawn, expected)
+
+
+def test_subsampled_label_stays_on_the_mask():
+    rng = np.random.default_rng(3)
+    for mask in random_masks(rng, 20, shape=(960, 720)):
+        blank = np.zeros(mask.shape + (3,), dtype=np.uint8)
+        drawn = add_label_cv(blank, mask, "X", step=8)
+        if drawn.any():
+            rows, cols = np.nonzero(drawn.any(axis=-1))
+            # The text starts at the anchor, which lies on the mask, and rises above it
+            y, x = rows.max(), cols.min()
+            assert mask[max(0, y - 12):y + 12, max(0, x - 12):x + 12].any()
@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('matplotlib')
+pytest.importorskip('skimage')
+
+from rg.results_utils import get_pose_json_results
+from utils.processing import pose_keypoints, scale_pose_prediction
+
+
+def pose_prediction():
+    """A downscaled pose API response with one detected pose."""
+    pose = {
+        'bbox_coordinates': [[10.0, 20.0], [110.0, 220.0]],
+        'bbox_confidence_score': 0.9,
+        'key_points_coordinate': [{'nose': {'x': 50.0, 'y': 40.0}}, {'left_eye': {'x': 52, 'y': 38}}],
+        'key_points_prob': [{'nose': {'score': 0.8}}, {'left_eye': {'score': 0.7}}],
+        'body_pose_score': 0.75,
+        'draw_kpt': [[50.0, 40.0], [52.0, 38.0]],
+    }
+    return [[1, [0.75], [pose]]]
+
+
+def test_scales_every_coordinate_field():
+    _, _, [pose] = scale_pose_prediction(pose_prediction(), 2)[0]
+    assert pose['bbox_coordinates'] == [[20.0, 40.0], [220.0, 440.0]]
+    assert pose['key_points_coordinate'] == [{'nose': {'x': 100.0, 'y': 80.0}}, {'left_eye': {'x': 104.0, 'y': 76.0}}]
+    assert pose['draw_kpt'] == [[100.0, 80.0], [104.0, 76.0]]
+    assert pose['bbox_confidence_score'] == 0.9
+    assert pose['key_points_prob'] == [{'nose': {'score': 0.8}}, {'left_eye': {'score': 0.7}}]
+    assert pose['body_pose_score'] == 0.75
+
+
+def test_leaves_the_prediction_alone_at_full_resolution():
+    prediction = pose_prediction()
+    assert scale_pose_prediction(prediction, 1) is prediction
+
+
+def test_posted_results_are_in_full_resolution():
+    scaled = scale_pose_prediction(pose_prediction(), 2)
+    artifact = {'id': 'a1', 'scan_id': 's1'}
+    _, posted = get_pose_json_results([artifact], [scaled], 'w1', {})
+    assert str({'x': 100.0, 'y': 80.0}) in posted['data']['Pose Results']
+    assert "[[20.0, 40.0], [220.0, 440.0]]" in posted['data']['Pose Results']
+    assert pose_keypoints(scaled) == [[100.0, 80.0], [104.0, 76.0]]
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+pytest.importorskip('skimage')
+
+from utils.depth_preprocessing import parse_depth, prepare_depthmap
+
+
+def reference_prepare_depthmap(data, width, height, depth_scale):
+    """prepare_depthmap as it was before decoding the whole buffer at once."""
+    output = np.zeros((width, height, 1))
+    for cx in range(width):
+        for cy in range(height):
+            output[cx][height - cy - 1] = parse_depth(cx, cy, data, depth_scale, width)
+    arr = np.array(output, dtype='float32')
+    return arr.reshape(width, height)
+
+
+@pytest.mark.parametrize('width, height', [(240, 180), (241, 179), (17, 1), (1, 9), (33, 65)])
+@pytest.mark.parametrize('depth_scale', [0.001, 0.00025])
+def test_matches_pixel_by_pixel_decoding(width, height, depth_scale):
+    rng = np.random.default_rng(width * height)
+    data = rng.integers(0, 256, width * height * 3, dtype=np.uint8).tobytes()
+    decoded = prepare_depthmap(data, width, height, depth_scale)
+    assert decoded.dtype == np.float32
+    assert decoded.shape == (width, height)
+    assert np.array_equal(decoded, reference_prepare_depthmap(data, width, height, depth_scale))
+
+
+def test_ignores_bytes_after_the_depthmap():
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 256, 24 * 18 * 3, dtype=np.uint8).tobytes()
+    assert np.array_equal(prepare_depthmap(data + b'\x01\x02\x03\x04', 24, 18, 0.001), prepare_depthmap(data, 24, 18, 0.001))
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+pytest.importorskip('skimage')
+
+from utils.depth_preprocessing import replace_values_above_threshold
+
+
+def reference_replace_values_above_threshold(depth_map, threshold, sequential=True):
+    """
+    The per-pixel loop replace_values_above_threshold used to be, with the map's own
+    bounds instead of the hard-coded 224x224. sequential=False reads every neighbour
+    from the input map instead of the partly updated one.
+    """
+    height, width = depth_map.shape[:2]
+    source = depth_map if sequential else depth_map.copy()
+    for i, j, k in np.argwhere(depth_map > threshold):
+        neighbors = []
+        if i > 0:
+            neighbors.append(source[i - 1, j, k])
+        if i < height - 1:
+            neighbors.append(source[i + 1, j, k])
+        if j > 0:
+            neighbors.append(source[i, j - 1, k])
+        if j < width - 1:
+            neighbors.append(source[i, j + 1, k])
+        non_zero_neighbors = [neighbor for neighbor in neighbors if neighbor != 0]
+        if non_zero_neighbors:
+            depth_map[i, j, k] = np.mean(non_zero_neighbors)
+        else:
+            depth_map[i, j, k] = 0
+    return depth_map
+
+
+def outlier_depthmap(seed, shape, dtype):
+    """Depth in metres with zeros, lone outliers and runs of neighbouring outliers."""
+    rng = np.random.default_rng(seed)
+    depth_map = rng.uniform(0.2, 3.0, shape).astype(dtype)
+    depth_map[rng.random(shape) < 0.15] = 0
+    depth_map[rng.random(shape) < 0.1] = rng.uniform(10, 100)
+    rows, cols = rng.integers(0, shape[0], 5), rng.integers(0, shape[1], 5)
+    for row, col in zip(rows, cols):
+        depth_map[row:row + 4, col:col + 6] = 50
+    return depth_map
+
+
+@pytest.mark.parametrize('sequential', [True, False])
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('shape', [(224, 224, 1), (240, 180, 1), (31, 17, 1), (12, 9, 2), (1, 7, 1)])
+def test_matches_the_per_pixel_loop(shape, dtype, sequential):
+    for seed in range(3):
+        depth_map = outlier_depthmap(seed, shape, dtype)
+        expected = reference_replace_values_above_threshold(depth_map.copy(), 7.5, sequential)
+        replaced = replace_values_above_threshold(depth_map, 7.5, sequential=sequential)
+        assert replaced is depth_map
+        assert np.array_equal(replaced, expected)
+
+
+def test_sequential_sees_earlier_replacements():
+    depth_map = np.array([[1.0, 9.0, 9.0, 1.0]], dtype=np.float32)[..., None]
+    sequential = replace_values_above_threshold(depth_map.copy(), 5)
+    parallel = replace_values_above_threshold(depth_map.copy(), 5, sequential=False)
+    # (1 + 9) / 2, then (5 + 1) / 2 when the first replacement is seen
+    assert sequential[0, :, 0].tolist() == [1, 5, 3, 1]
+    assert parallel[0, :, 0].tolist() == [1, 5, 5, 1]
+
+
+def test_no_outliers_is_a_no_op():
+    depth_map = outlier_depthmap(0, (20, 15, 1), np.float32).clip(0, 3)
+    assert np.array_equal(replace_values_above_threshold(depth_map.copy(), 7.5), depth_map)
@@ -0,0 +1,55 @@
+"""
+resize_bilinear against outputs of tf.image.resize stored in tests/data/resize.
+
+Regenerate them (needs tensorflow) with:
+    python -m tests.test_resize
+"""
+import os
+
+import numpy as np
+import pytest
+
+from utils.resize import resize_bilinear
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data', 'resize')
+
+# name: (input shape, output size, input dtype)
+CASES = {
+    'upscale': ((18, 24, 1), (32, 40), 'float32'),
+    'downscale': ((48, 64, 1), (22, 22), 'float32'),
+    'odd_sizes': ((13, 7, 1), (19, 11), 'float32'),
+    'float64_input': ((18, 24, 1), (24, 18), 'float64'),
+    'channels': ((10, 12, 3), (15, 9), 'float32'),
+    'identity': ((9, 7, 1), (9, 7), 'float32'),
+}
+
+
+def make_input(name):
+    shape, _, dtype = CASES[name]
+    seed = sorted(CASES).index(name)
+    return (np.random.default_rng(seed).random(shape) * 3).astype(dtype)
+
+
+@pytest.mark.parametrize('name', sorted(CASES))
+def test_matches_tensorflow(name):
+    _, size, _ = CASES[name]
+    image = make_input(name)
+    expected = np.load(os.path.join(DATA_DIR, f'{name}.npy'))
+    resized = resize_bilinear(image, size)
+    assert resized.dtype == np.float32
+    assert resized.shape == expected.shape
+    np.testing.assert_allclose(resized, expected, rtol=0, atol=1e-6)
+
+
+def test_two_dimensional_input():
+    image = make_input('upscale')
+    assert np.array_equal(resize_bilinear(image[:, :, 0], (32, 40)), resize_bilinear(image, (32, 40))[:, :, 0])
+
+
+if __name__ == '__main__':
+    import tensorflow as tf
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    for name, (_, size, _) in CASES.items():
+        np.save(os.path.join(DATA_DIR, f'{name}.npy'), np.array(tf.image.resize(make_input(name), size)))
@@ -0,0 +1,141 @@
+import asyncio
+
+import aiohttp
+import anyio
+import pytest
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from utils.retry_decorator import (
+    CircuitBreaker, CircuitOpenError, DeadlineExceededError, RetryPolicy, circuit_breakers, is_retryable, message_deadline,
+    remaining_budget,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def response_error(status):
+    request_info = aiohttp.RequestInfo(URL('http://endpoint.test/score'), 'POST', CIMultiDictProxy(CIMultiDict()))
+    return aiohttp.ClientResponseError(request_info, (), status=status)
+
+
+@pytest.mark.parametrize('error', [
+    response_error(503), response_error(429), aiohttp.ClientConnectionError(), aiohttp.ServerDisconnectedError(),
+    asyncio.TimeoutError(), TimeoutError(), ConnectionResetError(),
+])
+def test_retries_transient_errors(error):
+    assert is_retryable(error)
+
+
+@pytest.mark.parametrize('error', [
+    response_error(400), response_error(404), ValueError("bad prediction count"), KeyError('id'), TypeError(),
+    CircuitOpenError(), DeadlineExceededError(),
+])
+def test_does_not_retry_other_errors(error):
+    assert not is_retryable(error)
+
+
+@pytest.fixture
+def breaker():
+    """A circuit for the 'test' endpoint that opens after one failure and is half-open 50 ms later."""
+    circuit_breakers['test'] = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    yield circuit_breakers['test']
+    del circuit_breakers['test']
+
+
+class Endpoint:
+    __name__ = 'endpoint'
+
+    def __init__(self, error=None, latency=0.0):
+        self.error = error
+        self.latency = latency
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await anyio.sleep(self.latency)
+        if self.error is not None:
+            raise self.error
+        return 'ok'
+
+
+async def open_circuit(policy):
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await policy.call(Endpoint(aiohttp.ClientConnectionError()))
+    with pytest.raises(CircuitOpenError):
+        await policy.call(Endpoint())
+    await anyio.sleep(0.06)
+
+
+async def test_half_open_lets_a_single_probe_through(breaker):
+    policy = RetryPolicy(retries=1, endpoint='test')
+    await open_circuit(policy)
+    endpoint = Endpoint(latency=0.05)
+    outcomes = []
+
+    async def call():
+        try:
+            outcomes.append(await policy.call(endpoint))
+        except CircuitOpenError:
+            outcomes.append('rejected')
+
+    async with anyio.create_task_group() as task_group:
+        for _ in range(3):
+            task_group.start_soon(call)
+    assert endpoint.calls == 1
+    assert sorted(outcomes) == ['ok', 'rejected', 'rejected']
+    assert breaker.state == 'closed'
+    assert await policy.call(endpoint) == 'ok'
+
+
+async def test_failed_probe_opens_the_circuit_again(breaker):
+    policy = RetryPolicy(retries=1, endpoint='test')
+    await open_circuit(policy)
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await policy.call(Endpoint(aiohttp.ClientConnectionError()))
+    assert breaker.state == 'open'
+
+
+async def test_probe_slot_is_freed_after_a_non_retryable_error(breaker):
+    policy = RetryPolicy(retries=1, endpoint='test')
+    await open_circuit(policy)
+    with pytest.raises(ValueError):
+        await policy.call(Endpoint(ValueError()))
+    assert breaker.state == 'half-open'
+    assert await policy.call(Endpoint()) == 'ok'
+    assert breaker.state == 'closed'
+
+
+async def test_probe_slot_is_freed_when_the_probe_is_cancelled(breaker):
+    policy = RetryPolicy(retries=1, endpoint='test')
+    await open_circuit(policy)
+    with anyio.move_on_after(0.01):
+        await policy.call(Endpoint(latency=1))
+    assert await policy.call(Endpoint()) == 'ok'
+
+
+def test_no_deadline_by_default():
+    with message_deadline(0):
+        assert remaining_budget() is None
+    with message_deadline(10):
+        assert 9 < remaining_budget() <= 10
+    assert remaining_budget() is None
+
+
+async def test_running_out_of_message_budget_is_not_an_endpoint_failure(breaker):
+    policy = RetryPolicy(retries=3, endpoint='test')
+    endpoint = Endpoint(latency=1)
+    with message_deadline(0.05):
+        with pytest.raises(DeadlineExceededError):
+            await policy.call(endpoint)
+    assert endpoint.calls == 1
+    assert breaker.failures == 0
+    assert breaker.state == 'closed'
+
+
+async def test_call_timeouts_still_count_against_the_circuit(breaker):
+    policy = RetryPolicy(retries=1, call_timeout=0.01, endpoint='test')
+    with message_deadline(10):
+        with pytest.raises(TimeoutError):
+            await policy.call(Endpoint(latency=1))
+    assert breaker.state == 'open'
@@ -0,0 +1,81 @@
+import aiohttp
+import numpy as np
+import pytest
+from aiohttp.test_utils import TestServer
+
+from scripts.local_scoring_server import create_app
+from utils.inference import call_pcnn_height
+from utils.tensor_codec import PICKLE_CONTENT_TYPE, TENSOR_CONTENT_TYPE, TensorPayload, decode_tensor, encode_tensor, lz4, zstandard
+
+ENCODINGS = ['float32', 'float16', 'uint16']
+COMPRESSIONS = [
+    'none',
+    pytest.param('zstd', marks=pytest.mark.skipif(zstandard is None, reason="zstandard is not installed")),
+    pytest.param('lz4', marks=pytest.mark.skipif(lz4 is None, reason="lz4 is not installed")),
+]
+
+
+def depth_batch(seed=0, shape=(3, 24, 18, 1)):
+    """Depth values in metres like the model inputs, with some invalid zeros."""
+    rng = np.random.default_rng(seed)
+    depthmaps = rng.uniform(0.3, 3.0, shape).astype(np.float32)
+    depthmaps[rng.random(shape) < 0.1] = 0
+    return depthmaps
+
+
+def max_error(depthmaps, encoding):
+    if encoding == 'float32':
+        return 0
+    if encoding == 'float16':
+        # float16 keeps 11 significant bits
+        return float(np.abs(depthmaps).max()) * 2 ** -11
+    return float(depthmaps.max() - depthmaps.min()) / 131070 + 1e-6
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+@pytest.mark.parametrize('encoding', ENCODINGS)
+def test_round_trip(encoding, compression):
+    depthmaps = depth_batch()
+    decoded = decode_tensor(encode_tensor(depthmaps, encoding, compression))
+    assert decoded.dtype == np.float32
+    assert decoded.shape == depthmaps.shape
+    np.testing.assert_allclose(decoded, depthmaps, rtol=0, atol=max_error(depthmaps, encoding))
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+@pytest.mark.parametrize('encoding', ENCODINGS)
+@pytest.mark.parametrize('depthmaps', [np.full((2, 3, 4), 1.5, dtype=np.float32), np.zeros((0, 5, 5, 1), dtype=np.float32)], ids=['constant', 'empty'])
+def test_round_trip_of_degenerate_arrays(encoding, compression, depthmaps):
+    decoded = decode_tensor(encode_tensor(depthmaps, encoding, compression))
+    assert decoded.shape == depthmaps.shape
+    assert np.array_equal(decoded, depthmaps)
+
+
+def test_rejects_unknown_settings():
+    with pytest.raises(ValueError):
+        encode_tensor(depth_batch(), 'int8')
+    with pytest.raises(ValueError):
+        encode_tensor(depth_batch(), 'float32', 'gzip')
+    with pytest.raises(ValueError):
+        decode_tensor(b'PKL\x00' + bytes(16))
+
+
+def test_payload_content_types():
+    assert TensorPayload(depth_batch(), 'pickle').content_type == PICKLE_CONTENT_TYPE
+    assert TensorPayload(depth_batch(), 'float16').content_type == TENSOR_CONTENT_TYPE
+    assert len(TensorPayload(depth_batch(), 'uint16')) == 3
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+@pytest.mark.parametrize('encoding', ['pickle', *ENCODINGS])
+async def test_local_scoring_server_decodes_every_encoding(monkeypatch, encoding, compression):
+    depthmaps = depth_batch(seed=1)
+    async with TestServer(create_app()) as server:
+        monkeypatch.setenv('PCNN_HEIGHT_SCORING_URI', str(server.make_url('/score')))
+        monkeypatch.setenv('PCC_HEIGHT_KEY', 'test')
+        async with aiohttp.ClientSession() as session:
+            predictions = await call_pcnn_height(session, TensorPayload(depthmaps, encoding, compression))
+    expected = depthmaps.reshape(len(depthmaps), -1).mean(axis=1)
+    assert len(predictions) == len(depthmaps)
+    np.testing.assert_allclose([prediction for [prediction] in predictions], expected, rtol=0, atol=max_error(depthmaps, encoding))
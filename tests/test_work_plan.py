@@ -0,0 +1,30 @@
+from rg.work_plan import select, split_by_groups
+
+
+def artifacts(*ids):
+    return [{'id': artifact_id, 'scan_id': 'scan'} for artifact_id in ids]
+
+
+def ids(split):
+    return {names: [artifact['id'] for artifact in group] for names, group in split.items()}
+
+
+def test_select_keeps_the_original_order():
+    assert [a['id'] for a in select(artifacts('a', 'b', 'c', 'd'), artifacts('d', 'a'), artifacts('b'))] == ['a', 'b', 'd']
+
+
+def test_split_by_groups():
+    all_artifacts = artifacts('a', 'b', 'c', 'd', 'e')
+    split = split_by_groups(all_artifacts, {'pcnn_height': artifacts('d', 'a', 'b'), 'pcnn_weight': artifacts('b', 'c', 'd')})
+    assert ids(split) == {('pcnn_height',): ['a'], ('pcnn_height', 'pcnn_weight'): ['b', 'd'], ('pcnn_weight',): ['c']}
+
+
+def test_split_of_identical_groups_is_a_single_group():
+    all_artifacts = artifacts('a', 'b', 'c')
+    split = split_by_groups(all_artifacts, {'pcnn_height': all_artifacts, 'pcnn_weight': all_artifacts})
+    assert ids(split) == {('pcnn_height', 'pcnn_weight'): ['a', 'b', 'c']}
+
+
+def test_split_without_groups_is_empty():
+    assert split_by_groups(artifacts('a'), {}) == {}
+    assert split_by_groups(artifacts('a'), {'pcnn_height': []}) == {}
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import anyio
+
+from utils.constants import CHECKPOINT_STORE, CHECKPOINT_DIR, CHECKPOINT_TTL
+
+
+class NullCheckpointStore:
+    """Store that keeps nothing, every stage runs again on a retried message."""
+
+    def get(self, key, stage):
+        return False, None
+
+    def put(self, key, stage, value):
+        pass
+
+    def clear(self, key):
+        pass
+
+
+class LocalCheckpointStore:
+    """Pickled stage outputs under directory/<key>/<stage>.pkl, shared by the triggers of a worker.
+
+    Checkpoints of messages that never completed are removed after `ttl` seconds.
+    """
+
+    def __init__(self, directory=CHECKPOINT_DIR, ttl=CHECKPOINT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.cleaned = False
+
+    def path(self, key, stage=None):
+        return os.path.join(self.directory, key) if stage is None else os.path.join(self.directory, key, f"{stage}.pkl")
+
+    def remove_expired(self):
+        if not os.path.isdir(self.directory):
+            return
+        for key in os.listdir(self.directory):
+            path = self.path(key)
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def get(self, key, stage):
+        if not self.cleaned:
+            self.cleaned = True
+            self.remove_expired()
+        try:
+            with open(self.path(key, stage), 'rb') as f:
+                return True, pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except (OSError, pickle.UnpicklingError, EOFError) as error:
+            logging.warning(f"ignoring unreadable checkpoint {key}/{stage}: {error}")
+            return False, None
+
+    def put(self, key, stage, value):
+        directory = self.path(key)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(key, stage))
+        except OSError as error:
+            logging.warning(f"could not write checkpoint {key}/{stage}: {error}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def clear(self, key):
+        shutil.rmtree(self.path(key), ignore_errors=True)
+
+
+CHECKPOINT_STORES = {'local': LocalCheckpointStore, 'none': NullCheckpointStore}
+checkpoint_store = CHECKPOINT_STORES[CHECKPOINT_STORE]()
+
+
+def message_key(scan_ids):
+    """Checkpoint key of a queue message, identical for every redelivery of it."""
+    return hashlib.sha256(','.join(sorted(map(str, scan_ids))).encode()).hexdigest()
+
+
+class Checkpoint:
+    """
+    Stage outputs of one message, so a redelivered message resumes at the first
+    stage that did not finish instead of starting over.
+    """
+
+    def __init__(self, key, store=None):
+        self.key = key
+        self.store = store or checkpoint_store
+
+    @classmethod
+    def for_scans(cls, scan_ids):
+        return cls(message_key(scan_ids))
+
+    async def get(self, stage, required=None):
+        """The checkpointed output of `stage`, or None. With `required`, a checkpointed
+        dict is only returned when it has all of those keys."""
+        found, value = await anyio.to_thread.run_sync(self.store.get, self.key, stage)
+        if not found or value is None or (required is not None and not all(k in value for k in required)):
+            return None
+        logging.info(f"resuming {stage} from checkpoint")
+        return value
+
+    async def put(self, stage, value):
+        await anyio.to_thread.run_sync(self.store.put, self.key, stage, value)
+
+    async def run(self, stage, func, *args, required=None, **kwargs):
+        """Return the checkpointed output of `stage`, or await func(*args, **kwargs) and checkpoint it."""
+        value = await self.get(stage, required)
+        if value is not None:
+            return value
+        value = await func(*args, **kwargs)
+        await self.put(stage, value)
+        return value
+
+    async def clear(self):
+        await anyio.to_thread.run_sync(self.store.clear, self.key)
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+import anyio
+
+
+limiters = {}
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class Outcome:
+    """What happened to one request made inside AdaptiveLimiter.slot()."""
+
+    def __init__(self):
+        self.status = None
+        self.retry_after = None
+        self.failed = False  # transport error or timeout
+        self.errored = False  # any other exception, e.g. a bad response body or a caller bug
+
+    def record(self, resp):
+        self.status = resp.status
+        self.retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+
+    @property
+    def throttled(self):
+        return self.failed or self.status == 429 or (self.status is not None and self.status >= 500)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one endpoint.
+
+    The limit grows by about one slot per limit's worth of healthy responses
+    (success with latency within `latency_tolerance` times the usual latency) and is
+    multiplied by `decrease_factor` on 429, 5xx, a transport error or a timeout, at most
+    once per usual latency. A Retry-After header holds back all new requests for that
+    long. Other exceptions release the slot and leave the limit alone.
+    """
+
+    def __init__(self, name, initial_limit, min_limit=1, max_limit=32, decrease_factor=0.5, latency_tolerance=2.0):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.latency = None  # EWMA of healthy request latency in seconds
+        self.condition = anyio.Condition()
+        self.stats = {'successes': 0, 'throttled': 0, 'client_errors': 0, 'errors': 0}
+        limiters[name] = self
+
+    async def acquire(self):
+        while True:
+            delay = self.blocked_until - time.monotonic()
+            if delay > 0:
+                await anyio.sleep(delay)
+                continue
+            async with self.condition:
+                if self.in_flight < max(int(self.limit), self.min_limit):
+                    self.in_flight += 1
+                    return
+                await self.condition.wait()
+
+    async def release(self, outcome, latency):
+        async with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome.throttled:
+                self.stats['throttled'] += 1
+                if now - self.last_decrease > (self.latency or 0.0):
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+                if outcome.retry_after:
+                    self.blocked_until = max(self.blocked_until, now + outcome.retry_after)
+            elif outcome.errored:
+                # Not back-pressure, and the response may never have been read completely
+                self.stats['errors'] += 1
+            elif outcome.status is not None and outcome.status >= 400:
+                # Client errors say nothing about the endpoint's capacity
+                self.stats['client_errors'] += 1
+            else:
+                self.stats['successes'] += 1
+                healthy = self.latency is None or latency <= self.latency_tolerance * self.latency
+                self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+                if healthy:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one slot for a request; call `outcome.record(resp)` with the response."""
+        await self.acquire()
+        outcome = Outcome()
+        start = time.monotonic()
+        try:
+            yield outcome
+        except aiohttp.ClientResponseError as e:
+            outcome.status = e.status
+            outcome.retry_after = parse_retry_after((e.headers or {}).get('Retry-After'))
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            outcome.failed = True
+            raise
+        except Exception:
+            outcome.errored = True
+            raise
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.release(outcome, time.monotonic() - start)
+
+    def get_stats(self):
+        return {'limit': round(self.limit, 2), 'in_flight': self.in_flight,
+                'latency_ms': None if self.latency is None else round(1000 * self.latency), **self.stats}
+
+
+def get_limiter_stats():
+    return {name: limiter.get_stats() for name, limiter in limiters.items()}
@@ -1,3 +1,5 @@
+import os
+import tempfile
 from os import getenv
 
 MOBILENET_HEIGHT_WORKFLOW_NAME = "mobilenet-v2-height"
@@ -79,6 +81,76 @@ CocoColors = [[255, 0, 0], [255, 85, 0], [255, 170, 0], [255, 255, 0], [170, 255
 
 NUM_KPTS = 17
 
+# Shared HTTP connection pools (see utils/http_client.py)
+HTTP_POOL_LIMIT = int(getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_DNS_CACHE_TTL = int(getenv("HTTP_DNS_CACHE_TTL", "300"))
+
+# Downloaded but not yet parsed artifact bytes held at once (see utils/processing.stream_artifacts)
+ARTIFACT_INFLIGHT_BYTES = int(getenv("ARTIFACT_INFLIGHT_BYTES", str(64 * 1024 * 1024)))
+ARTIFACT_SIZE_ESTIMATE = int(getenv("ARTIFACT_SIZE_ESTIMATE", str(2 * 1024 * 1024)))
+
+# On-disk cache of /api/files downloads (see utils/file_cache.py), off by default: set
+# FILE_CACHE_MAX_BYTES (e.g. 536870912) to cap the disk it may use; 0 disables it
+FILE_CACHE_DIR = getenv("FILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cgm-rg-file-cache"))
+FILE_CACHE_MAX_BYTES = int(getenv("FILE_CACHE_MAX_BYTES", "0"))
+
+# Pose requests are micro-batched across scans when POSE_BATCH_SIZE > 1 (see utils/inference.py)
+POSE_BATCH_SIZE = int(getenv("POSE_BATCH_SIZE", "1"))
+POSE_BATCH_MAX_WAIT = float(getenv("POSE_BATCH_MAX_WAIT", "0.05"))
+
+# Seconds the /api/workflows response is cached in process (see utils/workflows.py)
+WORKFLOW_CACHE_TTL = float(getenv("WORKFLOW_CACHE_TTL", "3600"))
+
+# Backend used by fill_zeros_inpainting: biharmonic, telea, ns or nearest
+DEPTH_INPAINTING_METHOD = getenv("DEPTH_INPAINTING_METHOD", "biharmonic")
+
+# Wire format of depth batches sent to the scoring endpoints (see utils/tensor_codec.py):
+# pickle (what the deployed endpoints read), float32, float16 or uint16; none, zstd or lz4
+DEPTH_TENSOR_ENCODING = getenv("DEPTH_TENSOR_ENCODING", "pickle")
+DEPTH_TENSOR_COMPRESSION = getenv("DEPTH_TENSOR_COMPRESSION", "none")
+
+# Most depthmaps sent to a depth model in one request (see utils/inference.score_depth_batches)
+DEPTH_BATCH_MAX_SIZE = int(getenv("DEPTH_BATCH_MAX_SIZE", "16"))
+
+# zlib level (0-9) of the depth visualization PNGs (see utils/depth_rendering.py)
+DEPTH_VIZ_PNG_COMPRESSION = int(getenv("DEPTH_VIZ_PNG_COMPRESSION", "1"))
+
+# Every how many rows and columns of a mask add_label_cv looks for the label position
+# (see utils/processing.py); 1 gives the exact centre in raster order, 8 is ~20x faster on 4K masks
+OVERLAY_LABEL_STEP = int(getenv("OVERLAY_LABEL_STEP", "1"))
+
+# JPEG quality (0-100) of the RGB images made for the APIs and uploads (see utils/rgb_frame.py).
+# RGB_EXIF_ROTATION=1 sends the pose and face APIs the original JPEG tagged with an EXIF
+# orientation instead of a re-encoded upright copy; the services must honour the tag
+RGB_JPEG_QUALITY = int(getenv("RGB_JPEG_QUALITY", "95"))
+RGB_EXIF_ROTATION = getenv("RGB_EXIF_ROTATION", "0") == "1"
+# Longest edge in pixels of the images sent to the pose and face APIs, 0 sends full
+# resolution; their coordinates are scaled back to full resolution (see utils/rgb_frame.py)
+RGB_INFERENCE_MAX_EDGE = int(getenv("RGB_INFERENCE_MAX_EDGE", "0"))
+
+# Executors (see utils/executors.py): worker processes for GIL-bound per-frame work
+# (0 runs it on threads instead) and threads for GIL-releasing OpenCV/numpy work
+CPU_WORKERS = int(getenv("CPU_WORKERS", "0"))
+THREAD_WORKERS = int(getenv("THREAD_WORKERS", "8"))
+
+# Worker threads for the RGB-depth alignment checks (see rg/alignment.py)
+ALIGNMENT_WORKERS = int(getenv("ALIGNMENT_WORKERS", "4"))
+
+# Stage checkpoints of run_rg (see utils/checkpoints.py): 'none' or 'local', where and how long to keep them.
+# Off by default: 'local' pickles stage outputs of every message to a directory shared by the worker
+CHECKPOINT_STORE = getenv("CHECKPOINT_STORE", "none")
+CHECKPOINT_DIR = getenv("CHECKPOINT_DIR", os.path.join(tempfile.gettempdir(), "cgm-rg-checkpoints"))
+CHECKPOINT_TTL = float(getenv("CHECKPOINT_TTL", str(24 * 3600)))
+
+# Retry policy (see utils/retry_decorator.py): time budget in seconds shared by all calls
+# for one queue message (0, the default, sets none), and consecutive failures / cool-down
+# before an endpoint's circuit opens
+MESSAGE_DEADLINE = float(getenv("MESSAGE_DEADLINE", "0"))
+CIRCUIT_FAILURE_THRESHOLD = int(getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
 hex_key = getenv("DECRYPTION_KEY", "")
 
 # Convert back to bytearray
@@ -4,10 +4,12 @@ from zipfile import ZipFile
 from io import BytesIO
 from matplotlib import pyplot as plt
 import math
-import tensorflow as tf
-from skimage.transform import resize
 from skimage.restoration import inpaint
-from utils.constants import STANDING_TYPE, LYING_TYPE
+from scipy import ndimage
+from utils.constants import STANDING_TYPE, LYING_TYPE, DEPTH_INPAINTING_METHOD
+from utils.resize import resize_bilinear
+from utils.depth_rendering import render_depthmap
+from utils.executors import SharedArray, attach_shared_array, run_cpu, run_threaded
 import cv2
 import traceback
 import logging
@@ -25,69 +27,134 @@ IDENTITY_MATRIX_4D = [1., 0., 0., 0.,
                       0., 0., 1., 0.,
                       0., 0., 0., 1.]
 
-def replace_values_above_threshold(depth_map, threshold):
+def neighbour_sum_and_count(depth_map):
+    """
+    Sum and count the non-zero 4-neighbours (up, down, left, right) of every pixel.
+
+    Pixels outside the map count as zero, so edges are handled for any shape.
+    Works on (H, W) and (H, W, C) arrays.
+    """
+    pad_width = [(1, 1), (1, 1)] + [(0, 0)] * (depth_map.ndim - 2)
+    padded = np.pad(depth_map, pad_width)
+    neighbour_sum = np.zeros_like(depth_map)
+    neighbour_count = np.zeros(depth_map.shape, dtype=depth_map.dtype)
+    for neighbour in (padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2], padded[1:-1, 2:]):
+        neighbour_sum += neighbour
+        neighbour_count += neighbour != 0
+    return neighbour_sum, neighbour_count
+
+
+def replace_values_above_threshold(depth_map, threshold, sequential=True):
     """
     Replace depth values in a depth map above a given threshold with the average
     of their four non-zero neighbors.
 
+    With sequential=True (default) pixels are replaced in row-major order and a
+    replaced pixel is seen by the pixels below and to the right of it, exactly as
+    the original per-pixel loop did. This is computed one anti-diagonal at a time,
+    since pixels on the same anti-diagonal never neighbour each other.
+
+    With sequential=False ("parallel update") every pixel above the threshold is
+    replaced in one step using the neighbour values of the input map.
+
     Args:
-    - depth_map (numpy.ndarray): The input depth map.
+    - depth_map (numpy.ndarray): The input depth map of shape (H, W) or (H, W, C).
+      It is modified in place.
     - threshold (float): The threshold value.
+    - sequential (bool): Use sequential (default) or parallel update semantics.
 
     Returns:
     - numpy.ndarray: The depth map with values above the threshold replaced by
                     the average of their four non-zero neighbors.
     """
-    # Ensure depth_map is a 3D array (240, 180, 1)
-    # if depth_map.shape != (240, 180, 1):
-    #     raise ValueError("Input depth_map should have a shape of (240, 180, 1)")
-
     # Create a binary mask for values above the threshold
     above_threshold_mask = depth_map > threshold
+    if not np.any(above_threshold_mask):
+        return depth_map
 
-    # Get the indices of the values above the threshold
-    above_threshold_indices = np.argwhere(above_threshold_mask)
+    if not sequential:
+        neighbour_sum, neighbour_count = neighbour_sum_and_count(depth_map)
+        averages = np.divide(neighbour_sum, neighbour_count,
+                             out=np.zeros_like(neighbour_sum), where=neighbour_count > 0)
+        depth_map[above_threshold_mask] = averages[above_threshold_mask]
+        return depth_map
 
-    # Iterate over the indices and replace values with the average of neighbors
-    for i, j, k in above_threshold_indices:
-        neighbors = []
-        if i > 0:
-            neighbors.append(depth_map[i - 1, j, k])  
-        if i < IMAGE_TARGET_HEIGHT - 1:
-            neighbors.append(depth_map[i + 1, j, k])
-        if j > 0:
-            neighbors.append(depth_map[i, j - 1, k])  
-        if j < IMAGE_TARGET_WIDTH - 1:
-            neighbors.append(depth_map[i, j + 1, k])
-
-        # Filter out zero values
-        non_zero_neighbors = [neighbor for neighbor in neighbors if neighbor != 0]
-
-        if non_zero_neighbors:
-            # Calculate the average of non-zero neighbors
-            avg_neighbor_value = np.mean(non_zero_neighbors)
-            depth_map[i, j, k] = avg_neighbor_value
-        else:
-            # If all neighbors are zero, set the value to zero
-            depth_map[i, j, k] = 0
+    pad_width = [(1, 1), (1, 1)] + [(0, 0)] * (depth_map.ndim - 2)
+    padded = np.pad(depth_map, pad_width)
 
+    # Group the indices above the threshold by anti-diagonal (i + j)
+    above_threshold_indices = np.argwhere(above_threshold_mask)
+    diagonals = above_threshold_indices[:, 0] + above_threshold_indices[:, 1]
+    order = np.argsort(diagonals, kind='stable')
+    above_threshold_indices = above_threshold_indices[order] + np.array([1, 1] + [0] * (depth_map.ndim - 2))
+    splits = np.flatnonzero(np.diff(diagonals[order])) + 1
+
+    for indices in np.split(above_threshold_indices, splits):
+        i, j, rest = indices[:, 0], indices[:, 1], tuple(indices[:, 2:].T)
+        neighbour_sum = np.zeros(len(indices), dtype=depth_map.dtype)
+        neighbour_count = np.zeros(len(indices), dtype=depth_map.dtype)
+        for neighbour in (padded[(i - 1, j) + rest], padded[(i + 1, j) + rest],
+                          padded[(i, j - 1) + rest], padded[(i, j + 1) + rest]):
+            neighbour_sum += neighbour
+            neighbour_count += neighbour != 0
+        # If all neighbours are zero, set the value to zero
+        padded[(i, j) + rest] = np.divide(neighbour_sum, neighbour_count,
+                                          out=np.zeros_like(neighbour_sum), where=neighbour_count > 0)
+
+    depth_map[...] = padded[1:-1, 1:-1]
     return depth_map
 
 
-def fill_zeros_inpainting(depth_map):
+def inpaint_biharmonic(depth_map, mask):
+    return inpaint.inpaint_biharmonic(depth_map, mask=mask)
+
+
+def inpaint_opencv(depth_map, mask, flags):
+    depth_2d = depth_map.reshape(depth_map.shape[:2]).astype(np.float32)
+    filled = cv2.inpaint(depth_2d, mask.reshape(depth_map.shape[:2]).astype(np.uint8), inpaintRadius=3, flags=flags)
+    return filled.reshape(depth_map.shape)
+
+
+def inpaint_telea(depth_map, mask):
+    return inpaint_opencv(depth_map, mask, cv2.INPAINT_TELEA)
+
+
+def inpaint_navier_stokes(depth_map, mask):
+    return inpaint_opencv(depth_map, mask, cv2.INPAINT_NS)
+
+
+def inpaint_nearest(depth_map, mask):
+    """Fill every masked pixel with the value of the nearest unmasked pixel."""
+    if np.all(mask):
+        return depth_map.copy()
+    rows, cols = ndimage.distance_transform_edt(mask.reshape(depth_map.shape[:2]),
+                                                return_distances=False, return_indices=True)
+    return depth_map[rows, cols]
+
+
+INPAINTING_METHODS = {
+    'biharmonic': inpaint_biharmonic,
+    'telea': inpaint_telea,
+    'ns': inpaint_navier_stokes,
+    'nearest': inpaint_nearest,
+}
+
+
+def fill_zeros_inpainting(depth_map, method=DEPTH_INPAINTING_METHOD):
     """
     Fill zero values in a depth map using inpainting.
 
     Args:
         depth_map (numpy.ndarray): Input depth map with zero values.
+        method (str): Inpainting backend, one of INPAINTING_METHODS. Defaults to
+            the DEPTH_INPAINTING_METHOD setting ('biharmonic' unless configured).
 
     Returns:
         numpy.ndarray: Depth map with zero values filled using inpainting.
     """
-    # Apply inpainting to fill in zero values using biharmonic interpolation
-    depth_map_filled = inpaint.inpaint_biharmonic(depth_map, mask=(depth_map == 0))
-    
-    return depth_map_filled
+    if method not in INPAINTING_METHODS:
+        raise ValueError(f"Unknown inpainting method: {method}.")
+    return INPAINTING_METHODS[method](depth_map, depth_map == 0)
 
 
 def load_depth(response) -> Tuple[bytes, int, int, float, float]:
@@ -123,14 +190,16 @@ def parse_depth(tx: int, ty: int, data: bytes, depth_scale: float, width: int) -
 
 
 def prepare_depthmap(data: bytes, width: int, height: int, depth_scale: float) -> np.array:
-    """Convert bytes array into np.array"""
-    output = np.zeros((width, height, 1))
-    for cx in range(width):
-        for cy in range(height):
-            # depth data scaled to be visible
-            output[cx][height - cy - 1] = parse_depth(cx, cy, data, depth_scale, width)
-    arr = np.array(output, dtype='float32')
-    return arr.reshape(width, height)
+    """Convert bytes array into np.array
+
+    Each pixel is stored as 3 bytes (depth high byte, depth low byte, confidence),
+    row by row. The whole buffer is decoded at once; the result has the same
+    (width, height) orientation as reading it pixel by pixel with `parse_depth`.
+    """
+    pixels = np.frombuffer(data, dtype=np.uint8, count=width * height * 3).reshape(height, width, 3)
+    depth = (pixels[:, :, 0].astype(np.uint16) << 8) | pixels[:, :, 1]
+    output = depth.T[:, ::-1] * depth_scale
+    return np.ascontiguousarray(output, dtype='float32')
 
 
 def get_inpainted_depthmaps(artifacts):
@@ -143,7 +212,7 @@ def get_inpainted_depthmaps(artifacts):
         in_depthmap = fill_zeros_inpainting(replace_values_above_threshold(depthmap, NORMALIZATION_VALUE))
         in_depthmap = in_depthmap / NORMALIZATION_VALUE
         if in_depthmap.shape[:2] != (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH):
-            in_depthmap = tf.image.resize(in_depthmap, (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH))
+            in_depthmap = resize_bilinear(in_depthmap, (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH))
         in_depthmaps.append(in_depthmap)
     return in_depthmaps
 
@@ -151,8 +220,7 @@ def get_inpainted_depthmaps(artifacts):
 def eval_preprocessing(depthmap):
     depthmap = depthmap.astype("float32")
     depthmap = depthmap / PCC_NORMALIZATION_VALUE
-    depthmap = tf.image.resize(depthmap, (PCC_IMAGE_TARGET_HEIGHT, PCC_IMAGE_TARGET_WIDTH))
-    depthmap.set_shape((PCC_IMAGE_TARGET_HEIGHT, PCC_IMAGE_TARGET_WIDTH, 1))
+    depthmap = resize_bilinear(depthmap, (PCC_IMAGE_TARGET_HEIGHT, PCC_IMAGE_TARGET_WIDTH))
     return depthmap
 
 
@@ -172,65 +240,122 @@ def get_depthmaps_old(artifacts, scan_version):
         in_depthmap = fill_zeros_inpainting(replace_values_above_threshold(in_depthmap, NORMALIZATION_VALUE))
         in_depthmap = in_depthmap / NORMALIZATION_VALUE
         if in_depthmap.shape[:2] != (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH):
-            in_depthmap = tf.image.resize(in_depthmap, (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH))
-        in_depthmap.set_shape((IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH, 1))
+            in_depthmap = resize_bilinear(in_depthmap, (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH))
         in_depthmaps.append(in_depthmap)
         ev_depthmap = eval_preprocessing(depthmap)
         depthmaps.append(np.array(ev_depthmap))
     return depthmaps, in_depthmaps
 
 
-def get_depthmaps(artifacts, scan_version):
-    depthmaps, in_depthmaps, pc_dmaps, mn_depthmaps, device_poses = [], [], [], [], []
-    for artifact in artifacts:
-        data, width, height, depth_scale, _max_confidence, device_pose = load_depth(artifact['raw_file'])
-        if 'ir' in scan_version:
-            depthmap = np.frombuffer(data, dtype=np.uint16).reshape(height, width)
-            depthmap = depthmap * depth_scale
-            depthmap = np.rot90(depthmap, k=-1)
-        else:
-            depthmap = prepare_depthmap(data, width, height, depth_scale)
-        depthmap = np.expand_dims(depthmap, axis=2)
-        depthmaps.append(depthmap)
-        device_poses.append(device_pose)
-        if 'ir' not in scan_version:
-            in_depthmap = depthmap.copy()
-            in_depthmap = fill_zeros_inpainting(replace_values_above_threshold(in_depthmap, NORMALIZATION_VALUE))
-            in_depthmap = in_depthmap / NORMALIZATION_VALUE
-            in_depthmaps.append(in_depthmap)
-            mn_dmap = in_depthmap.copy()
-            if mn_dmap.shape[:2] != (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH):
-                mn_dmap = tf.image.resize(mn_dmap, (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH))
-            mn_dmap.set_shape((IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH, 1))
-            mn_depthmaps.append(mn_dmap)
+def decode_depthmap(raw_file, scan_version):
+    """Decode a depthmap zip into a (width, height, 1) depthmap and its device pose."""
+    data, width, height, depth_scale, _max_confidence, device_pose = load_depth(raw_file)
+    if 'ir' in scan_version:
+        depthmap = np.frombuffer(data, dtype=np.uint16).reshape(height, width)
+        depthmap = depthmap * depth_scale
+        depthmap = np.rot90(depthmap, k=-1)
+    else:
+        depthmap = prepare_depthmap(data, width, height, depth_scale)
+    depthmap = np.expand_dims(depthmap, axis=2)
+    return depthmap, device_pose
+
+
+def preprocess_depth_frame(raw_file, scan_version, pc_out, mn_out=None):
+    """
+    Decode one depth artifact and write its PlainCNN input into pc_out and, when
+    given, its inpainted MobileNet input into mn_out. Returns the depthmap and device pose.
+    """
+    depthmap, device_pose = decode_depthmap(raw_file, scan_version)
+    pc_dmap = depthmap.astype("float32") / PCC_NORMALIZATION_VALUE
+    pc_out[...] = resize_bilinear(pc_dmap, (PCC_IMAGE_TARGET_HEIGHT, PCC_IMAGE_TARGET_WIDTH))
+    if mn_out is None:
+        return depthmap, device_pose
+
+    # replace_values_above_threshold works in place, so it gets its own buffer
+    if 'ir' in scan_version:
+        in_depthmap = resize_bilinear(depthmap, (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH))
+    else:
+        in_depthmap = depthmap.copy()
+    in_depthmap = fill_zeros_inpainting(replace_values_above_threshold(in_depthmap, NORMALIZATION_VALUE))
+    in_depthmap /= NORMALIZATION_VALUE
+    if in_depthmap.shape[:2] != (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH):
+        in_depthmap = resize_bilinear(in_depthmap, (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH))
+    mn_out[...] = in_depthmap
+    return depthmap, device_pose
+
+
+def preprocess_shared_depth_frame(raw_file, scan_version, index, pc_spec, mn_spec=None):
+    """preprocess_depth_frame in a worker process, writing row `index` of shared batches."""
+    pc_shm, pc_batch = attach_shared_array(pc_spec)
+    mn_shm, mn_batch = attach_shared_array(mn_spec) if mn_spec is not None else (None, None)
+    try:
+        return preprocess_depth_frame(raw_file, scan_version, pc_batch[index], None if mn_batch is None else mn_batch[index])
+    finally:
+        del pc_batch, mn_batch
+        pc_shm.close()
+        if mn_shm is not None:
+            mn_shm.close()
+
+
+class DepthPreprocessingPipeline:
+    """
+    Decode each depth artifact of a scan once and derive every model input from it.
+
+    PlainCNN (240x180) and MobileNet (224x224) inputs are written straight into
+    preallocated float32 batches of shape (N, H, W, 1) that can be pickled as is.
+    The inpainted MobileNet input is only computed for the indices in mn_indices
+    (all of them when it is None); the other rows of mn_batch are left unset.
+
+    With `shared=True` the batches live in shared memory so that add_in_worker can
+    fill them from worker processes; call release_shared once all frames are added.
+    """
+
+    def __init__(self, scan_version, num_artifacts, mn_indices=None, shared=False):
+        self.scan_version = scan_version
+        self.mn_indices = mn_indices
+        self.depthmaps = [None] * num_artifacts
+        self.device_poses = [None] * num_artifacts
+        pc_shape = (num_artifacts, PCC_IMAGE_TARGET_HEIGHT, PCC_IMAGE_TARGET_WIDTH, 1)
+        mn_shape = (num_artifacts, IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH, 1)
+        self.shared = None
+        if shared:
+            self.shared = {'pc': SharedArray(pc_shape, np.float32), 'mn': SharedArray(mn_shape, np.float32)}
+            self.pc_batch, self.mn_batch = self.shared['pc'].array, self.shared['mn'].array
         else:
-            in_depthmap = depthmap.copy()
-            in_depthmap = tf.image.resize(in_depthmap, (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH))
-            in_depthmap = fill_zeros_inpainting(replace_values_above_threshold(np.array(in_depthmap), NORMALIZATION_VALUE))
-            in_depthmap = in_depthmap / NORMALIZATION_VALUE
-            in_depthmaps.append(in_depthmap)
-            mn_dmap = in_depthmap.copy()
-            mn_dmap = tf.image.resize(mn_dmap, (IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH))
-            mn_dmap.set_shape((IMAGE_TARGET_HEIGHT, IMAGE_TARGET_WIDTH, 1))
-            mn_depthmaps.append(mn_dmap)
-        pc_dmap = depthmap.copy()
-        pc_dmap = eval_preprocessing(pc_dmap)
-        pc_dmaps.append(np.array(pc_dmap))
-    return depthmaps, in_depthmaps, pc_dmaps, mn_depthmaps, device_poses
+            self.pc_batch = np.empty(pc_shape, dtype=np.float32)
+            self.mn_batch = np.empty(mn_shape, dtype=np.float32)
+
+    def needs_mn(self, index):
+        return self.mn_indices is None or index in self.mn_indices
+
+    def add(self, index, raw_file):
+        mn_out = self.mn_batch[index] if self.needs_mn(index) else None
+        self.depthmaps[index], self.device_poses[index] = preprocess_depth_frame(raw_file, self.scan_version, self.pc_batch[index], mn_out)
+
+    async def add_in_worker(self, index, raw_file):
+        """Add a frame in the process pool when the batches are shared, else on a worker thread."""
+        if self.shared is None:
+            await run_threaded(self.add, index, raw_file)
+            return
+        mn_spec = self.shared['mn'].spec if self.needs_mn(index) else None
+        # The file cache hands out read-only mmaps, which cannot be pickled to the workers
+        if not isinstance(raw_file, bytes):
+            raw_file = bytes(raw_file)
+        self.depthmaps[index], self.device_poses[index] = await run_cpu(
+            preprocess_shared_depth_frame, raw_file, self.scan_version, index, self.shared['pc'].spec, mn_spec)
+
+    def release_shared(self):
+        """Move the batches out of shared memory; the pipeline then behaves like an unshared one."""
+        if self.shared is not None:
+            self.pc_batch, self.mn_batch = self.shared['pc'].release(), self.shared['mn'].release()
+            self.shared = None
 
 
 def get_raw_depthmaps(artifacts, scan_version):
     depthmaps = []
     device_poses = []
     for artifact in artifacts:
-        data, width, height, depth_scale, _max_confidence, device_pose = load_depth(artifact['raw_file'])
-        if 'ir' in scan_version:
-            depthmap = np.frombuffer(data, dtype=np.uint16).reshape(height, width)
-            depthmap = depthmap * depth_scale
-            depthmap = np.rot90(depthmap, k=-1)
-        else:
-            depthmap = prepare_depthmap(data, width, height, depth_scale)
-        depthmap = np.expand_dims(depthmap, axis=2)
+        depthmap, device_pose = decode_depthmap(artifact['raw_file'], scan_version)
         depthmaps.append(depthmap)
         device_poses.append(device_pose)
     return depthmaps, device_poses
@@ -303,7 +428,7 @@ def save_plot_as_binary_new(depthmap, scan_type):
 def depth_visualization(artifacts, depthmaps, scan_type):
     depth_viz = {}
     for artifact, depthmap in zip(artifacts, depthmaps):
-        bin_file = save_plot_as_binary_new(depthmap, scan_type)
+        bin_file = render_depthmap(depthmap, scan_type)
         depth_viz[(artifact['scan_id'], artifact['id'])] = bin_file
     return depth_viz
 
@@ -405,152 +530,100 @@ def compute_angle(device_poses):
     return angles
 
 
-def inpaint_depth_by_rowwise_mean(depth, mask, max_depth=3.0):
+def sorted_row_percentile(ordered, counts, q):
     """
-    Inpaint missing values in depth using row-wise IQR mean.
-    - If >10% of row is missing, sample randomly in (mean-0.1, mean+0.1).
-    - Otherwise, use normal IQR mean.
-    - If the entire row is missing, check adjacent rows (left or right) for valid depth and adjust.
+    np.percentile (linear interpolation) at fraction q of the first counts[i] values
+    of each row of an ascending sorted 2D array.
     """
-    inpainted = depth.copy()
-    height, width = depth.shape
+    position = np.maximum(counts - 1, 0) * q
+    below = np.floor(position).astype(np.intp)
+    above = np.minimum(below + 1, np.maximum(counts - 1, 0))
+    rows = np.arange(len(ordered))
+    low, high = ordered[rows, below], ordered[rows, above]
+    t = position - below
+    with np.errstate(invalid='ignore'):
+        # Same rounding as numpy's _lerp
+        return np.where(t >= 0.5, high - (high - low) * (1 - t), low + (high - low) * t)
+
+
+def masked_iqr_means(values, valid):
+    """
+    Per row of `values`, the mean of its `valid` values between the row's 25th and 75th
+    percentile, or of all its valid values when none lie in between; nan for rows
+    without valid values. All rows are computed at once.
+    """
+    counts = valid.sum(axis=1)
+    ordered = np.sort(np.where(valid, values, np.inf), axis=1)
+    q1 = sorted_row_percentile(ordered, counts, 0.25)
+    q3 = sorted_row_percentile(ordered, counts, 0.75)
+    in_iqr = valid & (values >= q1[:, None]) & (values <= q3[:, None])
+    iqr_counts = in_iqr.sum(axis=1)
+    iqr_sums = np.where(in_iqr, values, 0).sum(axis=1, dtype=np.float64)
+    all_sums = np.where(valid, values, 0).sum(axis=1, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(iqr_counts > 0, iqr_sums / iqr_counts, all_sums / counts)
+
+
+def inpaint_rows_by_iqr_mean(depth, mask, max_depth, spread, rng):
+    """
+    Row-wise IQR mean inpainting of the missing depth (0 or above max_depth) inside the mask.
 
+    Rows with valid depth and at most 10% missing get the row's IQR mean; rows with
+    more missing are sampled in overall_mask_mean +- spread; rows without valid depth
+    are sampled in +- spread around the mean of the neighbouring rows' IQR means.
+    The random values are drawn in raster order, as the per-row loop used to.
+    """
+    inpainted = depth.copy()
     mask_valid = (mask > 0)
     depth_valid = (depth > 0) & (depth <= max_depth)
     overall_valid_mask = mask_valid & depth_valid
     overall_mask_mean = depth[overall_valid_mask].mean() if np.any(overall_valid_mask) else 0
+    missing = mask_valid & ((depth == 0) | (depth > max_depth))
+    if not missing.any():
+        return inpainted
+
+    has_valid = overall_valid_mask.any(axis=1)
+    mask_counts = mask_valid.sum(axis=1)
+    missing_ratio = np.where(mask_counts > 0, missing.sum(axis=1) / np.maximum(mask_counts, 1), 1.0)
+    row_means = masked_iqr_means(depth, overall_valid_mask)
+
+    # Neighbouring rows count as valid strictly below max_depth
+    neighbour_means = masked_iqr_means(depth, mask_valid & (depth > 0) & (depth < max_depth))
+    neighbours = np.stack([np.concatenate([[np.nan], neighbour_means[:-1]]), np.concatenate([neighbour_means[1:], [np.nan]])])
+    found = ~np.isnan(neighbours)
+    neighbours_mean = np.where(found, neighbours, 0).sum(axis=0) / np.maximum(found.sum(axis=0), 1)
+    centre = np.where(has_valid, overall_mask_mean, np.where(found.any(axis=0), neighbours_mean, overall_mask_mean))
+
+    constant_rows = has_valid & (missing_ratio <= 0.1)
+    filled = missing & constant_rows[:, None]
+    inpainted[filled] = np.broadcast_to(row_means[:, None], depth.shape)[filled]
+    sampled = missing & ~constant_rows[:, None]
+    sampled_rows = np.nonzero(sampled)[0]
+    inpainted[sampled] = rng.uniform(centre[sampled_rows] - spread, centre[sampled_rows] + spread)
+    return inpainted
 
-    rng = np.random.default_rng()
-
-    for row in range(height):
-        row_mask = mask_valid[row, :]
-        row_depth = depth[row, :]
-        valid_row = row_mask & (row_depth > 0) & (row_depth <= max_depth)
-        
-        missing_row = row_mask & ((row_depth == 0) | (row_depth > max_depth))
-        missing_ratio = np.sum(missing_row) / np.sum(row_mask) if np.sum(row_mask) > 0 else 1.0
-
-        if np.any(valid_row):
-            row_valid_depths = row_depth[valid_row]
-            q1 = np.percentile(row_valid_depths, 25)
-            q3 = np.percentile(row_valid_depths, 75)
-            iqr_values = row_valid_depths[(row_valid_depths >= q1) & (row_valid_depths <= q3)]
-            row_mean = iqr_values.mean() if len(iqr_values) > 0 else row_valid_depths.mean()
-
-            if missing_ratio > 0.1:
-                # Sample randomly around the overall_mask_mean
-                low = overall_mask_mean - 0.1
-                high = overall_mask_mean + 0.1
-                sampled_values = rng.uniform(low, high, size=np.sum(missing_row))
-            else:
-                sampled_values = np.full(np.sum(missing_row), row_mean)
-        else:
-            # Entire row invalid — check adjacent rows (left or right)
-            above = row - 1 if row > 0 else None
-            below = row + 1 if row < height - 1 else None
-            means = []
-            if above is not None:
-                valid_above = mask_valid[above, :] & (depth[above, :] > 0) & (depth[above, :] < max_depth)
-                if np.any(valid_above):
-                    row_valid_above = depth[above, :][valid_above]
-                    q1_above = np.percentile(row_valid_above, 25)
-                    q3_above = np.percentile(row_valid_above, 75)
-                    iqr_above = row_valid_above[(row_valid_above >= q1_above) & (row_valid_above <= q3_above)]
-                    means.append(iqr_above.mean() if len(iqr_above) > 0 else row_valid_above.mean())
-            if below is not None:
-                valid_below = mask_valid[below, :] & (depth[below, :] > 0) & (depth[below, :] < max_depth)
-                if np.any(valid_below):
-                    row_valid_below = depth[below, :][valid_below]
-                    q1_below = np.percentile(row_valid_below, 25)
-                    q3_below = np.percentile(row_valid_below, 75)
-                    iqr_below = row_valid_below[(row_valid_below >= q1_below) & (row_valid_below <= q3_below)]
-                    means.append(iqr_below.mean() if len(iqr_below) > 0 else row_valid_below.mean())
-
-            if means:
-                row_mean = np.mean(means)
-            else:
-                row_mean = overall_mask_mean
-
-            sampled_values = rng.uniform(row_mean - 0.1, row_mean + 0.1, size=np.sum(missing_row))
-
-        missing_indices = np.where(missing_row)[0]
-        inpainted[row, missing_indices] = sampled_values
 
-    return inpainted
+def inpaint_depth_by_rowwise_mean(depth, mask, max_depth=3.0, rng=None):
+    """
+    Inpaint missing values in depth using row-wise IQR mean.
+    - If >10% of row is missing, sample randomly in (mean-0.1, mean+0.1).
+    - Otherwise, use normal IQR mean.
+    - If the entire row is missing, check adjacent rows (left or right) for valid depth and adjust.
+    rng is a seed or np.random.Generator for the sampled values.
+    """
+    return inpaint_rows_by_iqr_mean(depth, np.asarray(mask), max_depth, 0.1, np.random.default_rng(rng))
 
 
-def inpaint_depth_by_columnwise_mean(depth, mask, max_depth=1.5):
+def inpaint_depth_by_columnwise_mean(depth, mask, max_depth=1.5, rng=None):
     """
     Inpaint missing values in depth using column-wise IQR mean for lying children.
     - If >10% of column is missing, sample randomly in (mean-0.05, mean+0.05).
     - Otherwise, use normal IQR mean.
     - If the entire column is missing, check adjacent columns (left or right) for valid depth and adjust.
+    rng is a seed or np.random.Generator for the sampled values.
     """
-    inpainted = depth.copy()
-    height, width = depth.shape
-
-    mask_valid = (mask > 0)
-    depth_valid = (depth > 0) & (depth <= max_depth)
-    overall_valid_mask = mask_valid & depth_valid
-    overall_mask_mean = depth[overall_valid_mask].mean() if np.any(overall_valid_mask) else 0
-
-    rng = np.random.default_rng()
-
-    for col in range(width):
-        col_mask = mask_valid[:, col]
-        col_depth = depth[:, col]
-        valid_col = col_mask & (col_depth > 0) & (col_depth <= max_depth)
-
-        missing_col = col_mask & ((col_depth == 0) | (col_depth > max_depth))
-        missing_ratio = np.sum(missing_col) / np.sum(col_mask) if np.sum(col_mask) > 0 else 1.0
-
-        if np.any(valid_col):
-            col_valid_depths = col_depth[valid_col]
-            q1 = np.percentile(col_valid_depths, 25)
-            q3 = np.percentile(col_valid_depths, 75)
-            iqr_values = col_valid_depths[(col_valid_depths >= q1) & (col_valid_depths <= q3)]
-            col_mean = iqr_values.mean() if len(iqr_values) > 0 else col_valid_depths.mean()
-
-            if missing_ratio > 0.1:
-                # Sample randomly around the overall_mask_mean
-                low = overall_mask_mean - 0.05
-                high = overall_mask_mean + 0.05
-                sampled_values = rng.uniform(low, high, size=np.sum(missing_col))
-            else:
-                sampled_values = np.full(np.sum(missing_col), col_mean)
-        else:
-            # Entire column invalid — check adjacent columns (left or right)
-            left = col - 1 if col > 0 else None
-            right = col + 1 if col < width - 1 else None
-            means = []
-            if left is not None:
-                valid_left = mask_valid[:, left] & (depth[:, left] > 0) & (depth[:, left] < max_depth)
-                if np.any(valid_left):
-                    left_depths = depth[:, left][valid_left]
-                    q1_left = np.percentile(left_depths, 25)
-                    q3_left = np.percentile(left_depths, 75)
-                    iqr_left = left_depths[(left_depths >= q1_left) & (left_depths <= q3_left)]
-                    means.append(iqr_left.mean() if len(iqr_left) > 0 else left_depths.mean())
-            if right is not None:
-                valid_right = mask_valid[:, right] & (depth[:, right] > 0) & (depth[:, right] < max_depth)
-                if np.any(valid_right):
-                    right_depths = depth[:, right][valid_right]
-                    q1_right = np.percentile(right_depths, 25)
-                    q3_right = np.percentile(right_depths, 75)
-                    iqr_right = right_depths[(right_depths >= q1_right) & (right_depths <= q3_right)]
-                    means.append(iqr_right.mean() if len(iqr_right) > 0 else right_depths.mean())
-
-            if means:
-                col_mean = np.mean(means)
-            else:
-                col_mean = overall_mask_mean
-
-            sampled_values = rng.uniform(col_mean - 0.05, col_mean + 0.05, size=np.sum(missing_col))
-
-        missing_indices = np.where(missing_col)[0]
-        inpainted[missing_indices, col] = sampled_values
-
-    return inpainted
+    inpainted = inpaint_rows_by_iqr_mean(depth.T, np.asarray(mask).T, max_depth, 0.05, np.random.default_rng(rng))
+    return np.ascontiguousarray(inpainted.T)
 
 
 def inpaint_depth_by_interpolation(depth, child_mask, max_depth):
@@ -579,10 +652,12 @@ def inpaint_depth_by_interpolation(depth, child_mask, max_depth):
     
     return inpainted_depth
 
-def inpaint_depth_all_masks(depth, pose_type, child_mask, floor_mask=None, wall_mask=None, foot_mask=None, max_depth=3.0, foot_area_threshold=0.3):
+def inpaint_depth_all_masks(depth, pose_type, child_mask, floor_mask=None, wall_mask=None, foot_mask=None, max_depth=3.0, foot_area_threshold=0.3, rng=None):
     """
     Generalized depth inpainting function for both lying and standing children.
+    rng (a seed or np.random.Generator) makes the sampled fill values reproducible.
     """
+    rng = np.random.default_rng(rng)
     # Calculate percentage of missing values in child mask
     child_mask_missing_percentage = np.sum(child_mask == 0) / child_mask.size * 100
 
@@ -590,25 +665,25 @@ def inpaint_depth_all_masks(depth, pose_type, child_mask, floor_mask=None, wall_
 
         # If child mask has more than 10% missing values, perform row-wise inpainting; otherwise, use interpolation
         if child_mask_missing_percentage > 10:
-            depth = inpaint_depth_by_rowwise_mean(depth, child_mask, max_depth)
+            depth = inpaint_depth_by_rowwise_mean(depth, child_mask, max_depth, rng)
         else:
             depth = inpaint_depth_by_interpolation(depth, child_mask, max_depth)
         # Inpainting for standing children: Use row-wise mean for floor_mask, and wall_mask
         if floor_mask is not None:
-            depth = inpaint_depth_by_rowwise_mean(depth, floor_mask, max_depth)
+            depth = inpaint_depth_by_rowwise_mean(depth, floor_mask, max_depth, rng)
         if wall_mask is not None:
-            depth = inpaint_depth_by_rowwise_mean(depth, wall_mask, max_depth)
+            depth = inpaint_depth_by_rowwise_mean(depth, wall_mask, max_depth, rng)
 
     elif pose_type == "lying":
 
         # If child mask has more than 10% missing values, perform column-wise inpainting; otherwise, use interpolation
         if child_mask_missing_percentage > 10:
-            depth = inpaint_depth_by_columnwise_mean(depth, child_mask, max_depth)
+            depth = inpaint_depth_by_columnwise_mean(depth, child_mask, max_depth, rng)
         else:
             depth = inpaint_depth_by_interpolation(depth, child_mask, max_depth)
         # Inpainting for lying children: Use column-wise mean for child_mask and floor_mask
         if floor_mask is not None:
-            depth = inpaint_depth_by_columnwise_mean(depth, floor_mask, max_depth=max_depth)
+            depth = inpaint_depth_by_columnwise_mean(depth, floor_mask, max_depth=max_depth, rng=rng)
         # Foot region inpainting for lying children using floor_mask column mean
         if foot_mask is not None:
             foot_mask = (foot_mask == 1).astype(np.uint8)
@@ -619,7 +694,7 @@ def inpaint_depth_all_masks(depth, pose_type, child_mask, floor_mask=None, wall_
                 # Inpaint using the floor mask (foot region is too small)
                 depth[foot_mask == 1] = 0
                 remaining_mask = 1 - child_mask
-                depth = inpaint_depth_by_columnwise_mean(depth, remaining_mask, max_depth=max_depth)
+                depth = inpaint_depth_by_columnwise_mean(depth, remaining_mask, max_depth=max_depth, rng=rng)
                 print("foot inpaint")
             else:
                 # If foot area is too large, return None (image not usable)
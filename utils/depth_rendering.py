@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+
+from utils.constants import STANDING_TYPE, LYING_TYPE, DEPTH_VIZ_PNG_COMPRESSION
+
+
+# matplotlib's 'jet' colormap as (x, value) anchors per channel
+JET_SEGMENTS = {
+    'red': ((0., 0.), (0.35, 0.), (0.66, 1.), (0.89, 1.), (1., 0.5)),
+    'green': ((0., 0.), (0.125, 0.), (0.375, 1.), (0.64, 1.), (0.91, 0.), (1., 0.)),
+    'blue': ((0., 0.5), (0.11, 1.), (0.34, 1.), (0.65, 0.), (1., 0.)),
+}
+
+
+def make_jet_lut(size=256):
+    """BGR uint8 lookup table equal to matplotlib's 256-entry jet colormap."""
+    x = np.linspace(0, 1, size)
+    channels = [np.interp(x, *zip(*JET_SEGMENTS[channel])) for channel in ('blue', 'green', 'red')]
+    return (np.stack(channels, axis=-1) * 255).astype(np.uint8)
+
+
+JET_LUT = make_jet_lut()
+MAX_DEPTH_BY_SCAN_TYPE = {STANDING_TYPE: 3.0, LYING_TYPE: 1.5}
+
+# Canvas the old matplotlib figure was drawn on (720x480 at 100 dpi); the image is
+# scaled to fit it and the output is cropped to the image
+CANVAS_WIDTH, CANVAS_HEIGHT = 720, 480
+
+
+def render_depthmap(depthmap, scan_type, compression=DEPTH_VIZ_PNG_COMPRESSION):
+    """
+    PNG of a depthmap in the jet colormap, rotated by 90 degrees, as shown to users.
+
+    Matches what save_plot_as_binary_new renders with matplotlib: same colours and
+    vmin=0 / vmax per scan type, same output size, nearest-neighbour scaling when
+    enlarging 3x or more and smooth scaling otherwise.
+    """
+    max_depth = MAX_DEPTH_BY_SCAN_TYPE[scan_type]
+    depthmap = np.asarray(depthmap)
+    if depthmap.ndim == 3:
+        depthmap = depthmap[..., 0]
+    rotated = np.rot90(depthmap, k=1)
+    height, width = rotated.shape
+    scale = min(CANVAS_WIDTH / width, CANVAS_HEIGHT / height)
+    size = (int(width * scale), int(height * scale))
+
+    indices = np.clip(rotated * (len(JET_LUT) / max_depth), 0, len(JET_LUT) - 1).astype(np.uint8)
+    if scale >= 3:
+        image = JET_LUT[cv2.resize(indices, size, interpolation=cv2.INTER_NEAREST_EXACT)]
+    else:
+        image = cv2.resize(JET_LUT[indices], size, interpolation=cv2.INTER_LINEAR)
+    _, png = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, compression])
+    return png.tobytes()
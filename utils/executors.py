@@ -0,0 +1,73 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import anyio
+import numpy as np
+
+from utils.constants import CPU_WORKERS, THREAD_WORKERS
+
+
+# GIL-releasing work (OpenCV, zlib, large numpy operations) runs on these threads
+thread_limiter = anyio.CapacityLimiter(THREAD_WORKERS)
+process_pool = None
+
+
+def uses_processes():
+    return CPU_WORKERS > 0
+
+
+def get_process_pool():
+    """Worker processes for GIL-bound work, started on first use. Spawned rather than
+    forked so they never inherit the event loop or open connections."""
+    global process_pool
+    if process_pool is None:
+        process_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return process_pool
+
+
+async def run_threaded(func, *args, **kwargs):
+    """Run GIL-releasing work on a worker thread."""
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=thread_limiter)
+
+
+async def run_cpu(func, *args, **kwargs):
+    """
+    Run GIL-bound work in the process pool, or on a worker thread when CPU_WORKERS is 0.
+
+    `func` and its arguments are pickled to the worker; pass large arrays as
+    SharedArray specs instead.
+    """
+    if not uses_processes():
+        return await run_threaded(func, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), functools.partial(func, *args, **kwargs))
+
+
+class SharedArray:
+    """A numpy array in shared memory; worker processes attach to it through `spec`."""
+
+    def __init__(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        self.shm = SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.spec = (self.shm.name, tuple(shape), dtype.str)
+
+    def release(self):
+        """Copy the array out of shared memory and free the segment."""
+        array = self.array.copy()
+        del self.array
+        self.shm.close()
+        self.shm.unlink()
+        return array
+
+
+def attach_shared_array(spec):
+    """Open a SharedArray in a worker process; close the returned SharedMemory when done."""
+    name, shape, dtype = spec
+    # Pool workers share the parent's resource tracker, so attaching does not
+    # hand ownership of the segment to the worker
+    shm = SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
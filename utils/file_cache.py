@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from utils.constants import FILE_CACHE_DIR, FILE_CACHE_MAX_BYTES
+
+
+class FileCache:
+    """On-disk LRU cache of files downloaded from /api/files, shared by all triggers of a worker.
+
+    Entries are addressed by the SHA-256 of the file id (uploaded files never change),
+    written atomically through a temporary file and os.replace, and read back through
+    a read-only mmap. The total size is capped at max_bytes by evicting the least
+    recently used entries. Files are stored exactly as served, i.e. still encrypted.
+    """
+
+    def __init__(self, directory: str = FILE_CACHE_DIR, max_bytes: int = FILE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = None  # key -> size, least recently used first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    @staticmethod
+    def key(file_id):
+        return hashlib.sha256(str(file_id).encode()).hexdigest()
+
+    def load_index(self):
+        """Rebuild the LRU order from the files already on disk (oldest mtime first)."""
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        found = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                found.append((stat.st_mtime, name, stat.st_size))
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(found))
+        self.total_bytes = sum(self.entries.values())
+
+    def get(self, file_id):
+        """Return the cached file as a read-only mmap (or b'' when empty), or None on a miss."""
+        if not self.enabled:
+            return None
+        key = self.key(file_id)
+        with self.lock:
+            if self.entries is None:
+                self.load_index()
+            if key not in self.entries:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+        path = self.path(key)
+        try:
+            os.utime(path)
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b''
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            # Evicted by another worker process sharing the directory
+            with self.lock:
+                self.total_bytes -= self.entries.pop(key, 0)
+                self.stats['hits'] -= 1
+                self.stats['misses'] += 1
+            return None
+
+    def put(self, file_id, data):
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        key = self.key(file_id)
+        path = self.path(key)
+        with self.lock:
+            if self.entries is None:
+                self.load_index()
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as error:
+            logging.warning(f"could not cache file {file_id}: {error}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self.lock:
+            self.total_bytes += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.evict()
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.stats['evictions'] += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def get_stats(self):
+        return {**self.stats, 'bytes': self.total_bytes, 'entries': len(self.entries or ())}
+
+
+file_cache = FileCache()
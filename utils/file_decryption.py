@@ -1,27 +1,63 @@
-from io import BytesIO
+import numpy as np
 from utils.constants import DECRYPTION_KEY as KEY
 
-BUFFER_SIZE = 8192
+# Number of bytes XORed per numpy call, rounded down to a multiple of the key length
+DECRYPTION_BLOCK_SIZE = 1 << 20
+
+_key_block = None
+
+
+def get_key_block():
+    """Return the key tiled to one decryption block plus one extra key length.
+
+    The extra key length lets a block start at any key offset by slicing.
+    """
+    global _key_block
+    if _key_block is None:
+        key = np.frombuffer(bytes(KEY), dtype=np.uint8)
+        _key_block = np.tile(key, DECRYPTION_BLOCK_SIZE // len(key) + 2)
+    return _key_block
+
+
+def decrypt_in_place(buffer, key_offset=0):
+    """XOR a writable buffer (bytearray or memoryview) with the key in place.
+
+    Args:
+        buffer: writable bytes-like object holding encrypted data.
+        key_offset (int): position in the key stream of the first byte of buffer.
+
+    Returns:
+        int: key offset of the byte following the buffer.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    key_length = len(KEY)
+    key_block = get_key_block()
+    step = max(DECRYPTION_BLOCK_SIZE // key_length, 1) * key_length
+    phase = key_offset % key_length
+    for start in range(0, len(data), step):
+        block = data[start:start + step]
+        np.bitwise_xor(block, key_block[phase:phase + len(block)], out=block)
+    return key_offset + len(data)
+
+
+class StreamDecryptor:
+    """Decrypt a file incrementally while its chunks are still being downloaded."""
+
+    def __init__(self):
+        self.key_offset = 0
+        self.output = bytearray()
+
+    def update(self, chunk):
+        chunk = bytearray(chunk)
+        self.key_offset = decrypt_in_place(chunk, self.key_offset)
+        self.output += chunk
+
+    def getvalue(self):
+        return self.output
 
 
 def decrypt_file_data(raw_file):
-    try:
-        input_stream = BytesIO(raw_file)
-        output = BytesIO()
-    
-        key_index = 0
-        buffer = bytearray(BUFFER_SIZE)
-    
-        while True:
-            bytes_read = input_stream.readinto(buffer)
-            if bytes_read == 0:
-                break
-            for i in range(bytes_read):
-                buffer[i] ^= KEY[key_index % len(KEY)]
-                key_index += 1
-            output.write(buffer[:bytes_read])
-    
-        decrypted_data = output.getvalue()
-        return decrypted_data
-    except Exception as error:
-        raise error
+    """Decrypt a whole file and return the plain data as a bytearray."""
+    decrypted_data = bytearray(raw_file)
+    decrypt_in_place(decrypted_data)
+    return decrypted_data
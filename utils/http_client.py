@@ -0,0 +1,80 @@
+import asyncio
+import logging
+
+import aiohttp
+
+from utils.constants import HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_KEEPALIVE_TIMEOUT, HTTP_DNS_CACHE_TTL
+
+
+class ClientManager:
+    """Process-wide aiohttp sessions, one per named client, shared by all invocations.
+
+    Sessions are created lazily on first use and kept open, so the pooled
+    keep-alive connections to the CGM backend and the inference endpoints are
+    reused by every queue message handled by the worker.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.stats = {}
+
+    def get_session(self, name: str) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session, session_loop = self.sessions.get(name, (None, None))
+        if session is None or session.closed or session_loop is not loop:
+            if session is not None and not session.closed:
+                self.close_stale(name, session, session_loop)
+            stats = self.stats.setdefault(name, {'requests': 0, 'connections_created': 0, 'connections_reused': 0})
+            connector = aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                                             keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT, ttl_dns_cache=HTTP_DNS_CACHE_TTL)
+            session = aiohttp.ClientSession(connector=connector, trace_configs=[self.trace_config(stats)])
+            self.sessions[name] = (session, loop)
+        return session
+
+    @staticmethod
+    def close_stale(name, session, session_loop):
+        """
+        Close a session left open by another event loop. Its connections can only be
+        closed on that loop, so this is only possible while the loop still runs.
+        """
+        if session_loop.is_running() and not session_loop.is_closed():
+            logging.info(f"closing the {name} session of a previous event loop")
+            asyncio.run_coroutine_threadsafe(session.close(), session_loop)
+        else:
+            logging.warning(f"dropping the {name} session of a stopped event loop, its connections are left to the garbage collector")
+
+    @staticmethod
+    def trace_config(stats) -> aiohttp.TraceConfig:
+        async def on_request_start(session, context, params):
+            stats['requests'] += 1
+
+        async def on_connection_create_end(session, context, params):
+            stats['connections_created'] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            stats['connections_reused'] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def get_stats(self):
+        return {name: dict(stats) for name, stats in self.stats.items()}
+
+    async def close(self):
+        for session, _ in self.sessions.values():
+            await session.close()
+        self.sessions = {}
+
+
+client_manager = ClientManager()
+
+
+def get_session(name: str) -> aiohttp.ClientSession:
+    return client_manager.get_session(name)
+
+
+def get_client_stats():
+    return client_manager.get_stats()
@@ -4,40 +4,149 @@ from aiolimiter import AsyncLimiter
 import anyio
 import logging
 from utils.retry_decorator import retry
+from utils.concurrency import AdaptiveLimiter
+from utils.tensor_codec import TensorPayload, as_payload
 import pickle
-import numpy as np
+from utils.constants import POSE_BATCH_SIZE, POSE_BATCH_MAX_WAIT, DEPTH_BATCH_MAX_SIZE
 
 
-pose_api_semaphore = anyio.Semaphore(4)
-face_api_limiter = AsyncLimiter(3, 1)  # 3 requests per second
+pose_api_limiter = AdaptiveLimiter('pose', initial_limit=4, max_limit=16)
+face_api_limiter = AsyncLimiter(3, 1)  # 3 requests per second, the Face API quota
+face_api_concurrency = AdaptiveLimiter('face', initial_limit=3, max_limit=10)
+sam_api_limiter = AdaptiveLimiter('sam', initial_limit=2, max_limit=8)
+pcnn_height_limiter = AdaptiveLimiter('pcnn_height', initial_limit=2, max_limit=8)
+pcnn_weight_limiter = AdaptiveLimiter('pcnn_weight', initial_limit=2, max_limit=8)
+mn_height_limiter = AdaptiveLimiter('mn_height', initial_limit=2, max_limit=8)
 
 
-@retry(retries=3, delay=2)
+@retry(retries=3, delay=2, endpoint='sam')
 async def call_sam_api(session, payload):
     pose_score_uri = 'https://sam-endpoint-2.centralindia.inference.ml.azure.com/score'
     api_key = getenv("SAM_API_KEY")
     headers_up = {'Content-Type':'application/octer-stream', 'Authorization':('Bearer '+ api_key), 'azureml-model-deployment': 'blue'}
-    async with session.post(pose_score_uri, headers=headers_up, data=payload) as resp:
-        if resp.status != 200:
-            logging.error('call sam api failed')
-        data = await resp.read()
-        return pickle.loads(data)
+    async with sam_api_limiter.slot() as outcome:
+        async with session.post(pose_score_uri, headers=headers_up, data=payload) as resp:
+            outcome.record(resp)
+            if resp.status != 200:
+                logging.error('call sam api failed')
+                resp.raise_for_status()
+            data = await resp.read()
+            return pickle.loads(data)
 
 
-@retry(retries=3, delay=2)
+@retry(retries=3, delay=2, endpoint='pose')
 async def call_pose_api(session, payload):
     pose_score_uri = 'https://pose-endpoint-2.centralindia.inference.ml.azure.com/score'
     api_key = getenv("POSE_API_KEY")
     headers_up = {'Content-Type':'application/octer-stream', 'Authorization':('Bearer '+ api_key), 'azureml-model-deployment': 'blue'}
-    async with pose_api_semaphore:
+    async with pose_api_limiter.slot() as outcome:
         async with session.post(pose_score_uri, headers=headers_up, data=payload) as resp:
+            outcome.record(resp)
             if resp.status != 200:
                 logging.error('call pose api failed')
+                resp.raise_for_status()
             data = await resp.read()
             return json.loads(data)
 
 
-@retry(retries=3, delay=2)
+@retry(retries=3, delay=2, endpoint='pose')
+async def call_pose_batch_api(session, images):
+    """Send several encoded images in one request; returns one pose result per image, in order."""
+    pose_score_uri = 'https://pose-endpoint-2.centralindia.inference.ml.azure.com/score'
+    api_key = getenv("POSE_API_KEY")
+    headers_up = {'Content-Type':'application/octer-stream', 'Authorization':('Bearer '+ api_key), 'azureml-model-deployment': 'blue'}
+    payload = pickle.dumps(list(images))
+    async with pose_api_limiter.slot() as outcome:
+        async with session.post(pose_score_uri, headers=headers_up, data=payload) as resp:
+            outcome.record(resp)
+            if resp.status != 200:
+                logging.error('call pose batch api failed')
+                resp.raise_for_status()
+            data = await resp.read()
+            results = json.loads(data)
+    if len(results) != len(images):
+        raise ValueError(f"pose batch api returned {len(results)} results for {len(images)} images")
+    return results
+
+
+class BatchCancelledError(Exception):
+    """The request that was sending a batch got cancelled before the batch was sent or answered."""
+
+
+class PendingBatch:
+    def __init__(self):
+        self.items = []
+        self.results = None
+        self.error = None
+        self.full = anyio.Event()
+        self.done = anyio.Event()
+
+
+class MicroBatcher:
+    """
+    Collect single requests for up to `max_wait` seconds or `max_batch_size` items and
+    send them as one `call_batch(session, items)` call.
+
+    The first request of a batch waits for the batch to fill up and sends it; every
+    request then gets the result at its own position. Shared by all scans and
+    invocations of the worker. When that first request is cancelled, the others
+    submit their items again instead of waiting on a batch nobody sends.
+    """
+
+    def __init__(self, call_batch, max_batch_size, max_wait):
+        self.call_batch = call_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch = None
+
+    async def submit(self, session, item):
+        is_leader = self.batch is None
+        if is_leader:
+            self.batch = PendingBatch()
+        batch = self.batch
+        position = len(batch.items)
+        batch.items.append(item)
+        if len(batch.items) >= self.max_batch_size:
+            self.batch = None
+            batch.full.set()
+
+        if is_leader:
+            try:
+                with anyio.move_on_after(self.max_wait):
+                    await batch.full.wait()
+                if self.batch is batch:
+                    self.batch = None
+                batch.results = await self.call_batch(session, batch.items)
+            except Exception as e:
+                batch.error = e
+            except BaseException:
+                batch.error = BatchCancelledError()
+                raise
+            finally:
+                if self.batch is batch:
+                    self.batch = None
+                batch.done.set()
+        else:
+            await batch.done.wait()
+
+        if isinstance(batch.error, BatchCancelledError):
+            return await self.submit(session, item)
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[position]
+
+
+pose_batcher = MicroBatcher(call_pose_batch_api, POSE_BATCH_SIZE, POSE_BATCH_MAX_WAIT)
+
+
+async def predict_pose(session, image):
+    """Pose prediction for one encoded image, micro-batched when POSE_BATCH_SIZE > 1."""
+    if POSE_BATCH_SIZE > 1:
+        return await pose_batcher.submit(session, image)
+    return await call_pose_api(session, image)
+
+
+@retry(retries=3, delay=2, endpoint='face')
 async def call_face_api(session, image_data):
     """Call Microsoft Face API with rate limiting."""
     params = {
@@ -52,45 +161,115 @@ async def call_face_api(session, image_data):
         'Content-Type': 'application/octet-stream',
         'Ocp-Apim-Subscription-Key': getenv('MS_FACE_API_KEY'),
     }
-    async with face_api_limiter:
+    async with face_api_limiter, face_api_concurrency.slot() as outcome:
         async with session.post(face_api_url, headers=ms_face_api_headers, params=params, data=image_data) as resp:
+            outcome.record(resp)
             if resp.status != 200:
                 logging.error('call face api failed')
+                resp.raise_for_status()
             data = await resp.read()
             return json.loads(data)
 
 
-@retry(retries=3, delay=2)
+@retry(retries=3, delay=2, endpoint='pcnn_height')
 async def call_pcnn_height(session, depthmaps):
-    scoring_uri = "https://height-plaincnn-endpoint-test.centralindia.inference.ml.azure.com/score"
+    scoring_uri = getenv('PCNN_HEIGHT_SCORING_URI', "https://height-plaincnn-endpoint-test.centralindia.inference.ml.azure.com/score")
     api_key = getenv('PCC_HEIGHT_KEY')
-    headers = {'Content-Type':'application/octer-stream', 'Authorization':('Bearer '+ api_key), 'azureml-model-deployment': 'blue'}
-    pickled_input_data = pickle.dumps(np.array(depthmaps))
-    async with session.post(scoring_uri, data=pickled_input_data, headers=headers) as resp:
-        print(resp.status)
-        data = await resp.read()
-        return json.loads(data)
+    payload = as_payload(depthmaps)
+    headers = {'Content-Type':payload.content_type, 'Authorization':('Bearer '+ api_key), 'azureml-model-deployment': 'blue'}
+    async with pcnn_height_limiter.slot() as outcome:
+        async with session.post(scoring_uri, data=payload.body, headers=headers) as resp:
+            outcome.record(resp)
+            print(resp.status)
+            resp.raise_for_status()
+            data = await resp.read()
+            return json.loads(data)
 
 
-@retry(retries=3, delay=2)
+@retry(retries=3, delay=2, endpoint='pcnn_weight')
 async def call_pcnn_weight(session, depthmaps):
-    scoring_uri = "https://weight-plaincnn-endpoint.centralindia.inference.ml.azure.com/score"
+    scoring_uri = getenv('PCNN_WEIGHT_SCORING_URI', "https://weight-plaincnn-endpoint.centralindia.inference.ml.azure.com/score")
     api_key = getenv('PCC_WEIGHT_KEY')
-    headers = {'Content-Type':'application/octer-stream', 'Authorization':('Bearer '+ api_key), 'azureml-model-deployment': 'blue'}
-    pickled_input_data = pickle.dumps(np.array(depthmaps))
-    async with session.post(scoring_uri, data=pickled_input_data, headers=headers) as resp:
-        print(resp.status)
-        data = await resp.read()
-        return json.loads(data)
+    payload = as_payload(depthmaps)
+    headers = {'Content-Type':payload.content_type, 'Authorization':('Bearer '+ api_key), 'azureml-model-deployment': 'blue'}
+    async with pcnn_weight_limiter.slot() as outcome:
+        async with session.post(scoring_uri, data=payload.body, headers=headers) as resp:
+            outcome.record(resp)
+            print(resp.status)
+            resp.raise_for_status()
+            data = await resp.read()
+            return json.loads(data)
 
 
-@retry(retries=3, delay=2)
+@retry(retries=3, delay=2, endpoint='mn_height')
 async def call_mn_height(session, depthmaps):
-    scoring_uri = "https://mobilenet-v2-height-endpoint-2.centralindia.inference.ml.azure.com/score"
+    scoring_uri = getenv('MOBILENET_HEIGHT_SCORING_URI', "https://mobilenet-v2-height-endpoint-2.centralindia.inference.ml.azure.com/score")
     api_key = getenv('MOBILENET_HEIGHT_KEY')
-    headers = {'Content-Type':'application/octer-stream', 'Authorization':('Bearer '+ api_key), 'azureml-model-deployment': 'blue'}
-    pickled_input_data = pickle.dumps(np.array(depthmaps))
-    async with session.post(scoring_uri, data=pickled_input_data, headers=headers) as resp:
-        print(resp.status)
-        data = await resp.read()
-        return json.loads(data)
+    payload = as_payload(depthmaps)
+    headers = {'Content-Type':payload.content_type, 'Authorization':('Bearer '+ api_key), 'azureml-model-deployment': 'blue'}
+    async with mn_height_limiter.slot() as outcome:
+        async with session.post(scoring_uri, data=payload.body, headers=headers) as resp:
+            outcome.record(resp)
+            print(resp.status)
+            resp.raise_for_status()
+            data = await resp.read()
+            return json.loads(data)
+
+
+# Responses that blame the request body: a chunk failing with one of these is split
+# to isolate the frames the endpoint rejects
+PAYLOAD_ERROR_STATUSES = {400, 413, 422}
+
+
+class PredictionCountError(ValueError):
+    pass
+
+
+def is_payload_error(error):
+    return isinstance(error, PredictionCountError) or getattr(error, 'status', None) in PAYLOAD_ERROR_STATUSES
+
+
+async def score_depth_chunk(session, call, depthmaps, keys, results, payload=None):
+    """
+    Score one chunk. When the endpoint rejects the payload, the chunk is split in half
+    until the failing frames are isolated and dropped; endpoint and transport errors
+    are raised once the retry policy gives up.
+    """
+    try:
+        if payload is None:
+            payload = await anyio.to_thread.run_sync(TensorPayload, depthmaps)
+        predictions = await call(session, payload)
+        if len(predictions) != len(keys):
+            raise PredictionCountError(f"{call.__name__} returned {len(predictions)} predictions for {len(keys)} depthmaps")
+    except Exception as e:
+        if not is_payload_error(e):
+            raise
+        if len(keys) == 1:
+            logging.error(f"{call.__name__} failed for {keys[0]}: {e}")
+            return
+        logging.warning(f"{call.__name__} failed for a chunk of {len(keys)} depthmaps, splitting it: {e}")
+        half = len(keys) // 2
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(score_depth_chunk, session, call, depthmaps[:half], keys[:half], results)
+            task_group.start_soon(score_depth_chunk, session, call, depthmaps[half:], keys[half:], results)
+        return
+    results.update(zip(keys, predictions))
+
+
+async def score_depth_batches(session, calls, depthmaps, keys, max_batch_size=DEPTH_BATCH_MAX_SIZE):
+    """
+    Score a depth batch with each of `calls` in chunks of at most `max_batch_size` frames.
+
+    Each chunk is encoded once for all calls and every (call, chunk) request is in
+    flight at the same time, bounded by the endpoints' limiters. Returns one
+    {key: prediction} dict per call, keys being e.g. (scan_id, artifact_id); frames
+    the endpoint rejected are missing from it.
+    """
+    results = [{} for _ in calls]
+    async with anyio.create_task_group() as task_group:
+        for start in range(0, len(keys), max_batch_size):
+            chunk, chunk_keys = depthmaps[start:start + max_batch_size], keys[start:start + max_batch_size]
+            payload = await anyio.to_thread.run_sync(TensorPayload, chunk)
+            for call, call_results in zip(calls, results):
+                task_group.start_soon(score_depth_chunk, session, call, chunk, chunk_keys, call_results, payload)
+    return results
@@ -1,9 +1,8 @@
 import os
 import json
-from copy import deepcopy
+from functools import lru_cache
 import anyio
 import asyncer
-from asyncer import asyncify
 from datetime import datetime
 import cv2
 import numpy as np
@@ -12,7 +11,6 @@ from io import BytesIO
 from matplotlib import pyplot as plt
 from utils.constants import *
 from skimage.metrics import structural_similarity as ssim
-from utils.file_decryption import decrypt_file_data
 
 
 def get_scan_by_format(artifacts, file_format):
@@ -21,32 +19,76 @@ def get_scan_by_format(artifacts, file_format):
 
 async def download_artifacts(cgm_api, artifacts, scan_version):
     try:
+        decrypt = scan_version.startswith('ir-2.') or scan_version.startswith('v3.')
         async with asyncer.create_task_group() as task_group:
-            soon_values = [task_group.soonify(cgm_api.get_files)(artifact['file']) for artifact in artifacts]
+            soon_values = [task_group.soonify(cgm_api.get_files)(artifact['file'], decrypt=decrypt) for artifact in artifacts]
 
     # 🔹 Ensure results are properly accessed after task_group exits
         results = [soon.value for soon in soon_values]
         for result, artifact in zip(results, artifacts):
             content, status = result
-            if status == 200:
-                if scan_version.startswith('ir-2.') or scan_version.startswith('v3.'):
-                    artifact['raw_file'] = await asyncify(decrypt_file_data)(content)
-                else:
-                    artifact['raw_file'] = content
-            else:
-                content, status = await cgm_api.get_files(artifact['file'])
-                if scan_version.startswith('ir-2.') or scan_version.startswith('v3.'):
-                    artifact['raw_file'] = await asyncify(decrypt_file_data)(content)
-                else:
-                    artifact['raw_file'] = content
+            if status != 200:
+                content, status = await cgm_api.get_files(artifact['file'], decrypt=decrypt)
+            artifact['raw_file'] = content
     except Exception as error:
         print(error)
 
 
-def get_workflow(workflows, workflow_name, workflow_version):
-    workflow = [w for w in workflows if w['name'] == workflow_name and w['version'] == workflow_version]
-    
-    return workflow[0]
+class ByteBudget:
+    """Bound the number of artifact bytes that are downloaded but not yet parsed."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.condition = anyio.Condition()
+
+    async def acquire(self, nbytes):
+        async with self.condition:
+            # A single reservation larger than the limit is let through when nothing else is in flight
+            while self.in_use > 0 and self.in_use + nbytes > self.limit:
+                await self.condition.wait()
+            self.in_use += nbytes
+
+    async def adjust(self, nbytes):
+        async with self.condition:
+            self.in_use += nbytes
+            self.condition.notify_all()
+
+    async def release(self, nbytes):
+        await self.adjust(-nbytes)
+
+
+async def stream_artifacts(cgm_api, artifacts, scan_version, process_artifact,
+                           max_inflight_bytes=ARTIFACT_INFLIGHT_BYTES):
+    """
+    Download artifacts concurrently and process each one as soon as it arrives.
+
+    `process_artifact(artifact)` is awaited with artifact['raw_file'] set, while the
+    remaining downloads continue. Afterwards the raw bytes are dropped from the
+    artifact. At most `max_inflight_bytes` of downloaded but unprocessed data is
+    held at once; each download reserves ARTIFACT_SIZE_ESTIMATE bytes up front and
+    the reservation is corrected to the actual size once the file is received.
+    """
+    decrypt = scan_version.startswith('ir-2.') or scan_version.startswith('v3.')
+    budget = ByteBudget(max_inflight_bytes)
+
+    async def download_and_process(artifact):
+        await budget.acquire(ARTIFACT_SIZE_ESTIMATE)
+        reserved = ARTIFACT_SIZE_ESTIMATE
+        try:
+            content, status = await cgm_api.get_files(artifact['file'], decrypt=decrypt)
+            await budget.adjust(len(content) - reserved)
+            reserved = len(content)
+            artifact['raw_file'] = content
+            await process_artifact(artifact)
+        finally:
+            artifact.pop('raw_file', None)
+            await budget.release(reserved)
+
+    async with anyio.create_task_group() as task_group:
+        for artifact in artifacts:
+            task_group.start_soon(download_and_process, artifact)
+
 
 def load_rgb_images(artifacts):
     input_images = {}
@@ -64,59 +106,48 @@ def load_rgb_image(rgb_binary_file):
     return rgb
 
 
-def encode_rgb_images(images):
-    return [encode_image(img) for img in images.values()]
-
-def encode_image(img):
-    _, bin_file = cv2.imencode('.JPEG', img)
+def encode_image(img, quality=RGB_JPEG_QUALITY):
+    _, bin_file = cv2.imencode('.JPEG', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
     bin_file = bin_file.tobytes()
 
     return bin_file
 
-def blur_img(im,height,width,origin):
-    #Create ROI
-    h,w = height,width
-    x,y = origin[0],origin[1]
-    roi = im[int(y):int(y)+int(h),int(x):int(x)+int(w)]
-    #Blur image in ROI
-    blurred_img = cv2.GaussianBlur(roi,(91,91),0)
-    #Add blur to the overall img
-    im[int(y):int(y)+int(h),int(x):int(x)+int(w)] = blurred_img
-    return im
-
-
-def blur_face(input_image, detected_faces):
-    for face in detected_faces:
-        fr = face['faceRectangle']
-        origin = (fr['left'], fr['top'])
-        input_image = blur_img(input_image,fr['height'],fr['width'],origin)
-    image = cv2.rotate(input_image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-    return image[:, :, ::-1]
-
-def blur_rgb_images(artifacts, face_results, images):
-    blurred_images = {}
-    blurred_images_to_post = {}
-    for artifact, face_result in zip(artifacts, face_results):
-        blurred_image = blur_face(images[artifact['id']], face_result)
-        blurred_images[artifact['id']] = blurred_image
-        _, bin_file = cv2.imencode('.JPEG', blurred_image)
-        bin_file = bin_file.tostring()
-        blurred_images_to_post[(artifact['scan_id'], artifact['id'])] = bin_file
-    return blurred_images, blurred_images_to_post
-
-def pose_and_blur_visualsation(artifacts, predictions, blurred_images):
-    pose_vis = {}
-    for (artifact, pose_prediction) in zip(artifacts, predictions):
-        img = deepcopy(blurred_images[artifact['id']])
-        no_of_pose_detected, pose_score, pose_result = pose_prediction[0]
-        if no_of_pose_detected > 0:
-            rotated_pose_preds = pose_result[0]['draw_kpt']
-            for kpt in rotated_pose_preds:
-                img = draw_pose(kpt, img)
-        _, bin_file = cv2.imencode('.JPEG', img)
-        bin_file = bin_file.tostring()
-        pose_vis[(artifact['scan_id'], artifact['id'])] = bin_file
-    return pose_vis
+
+def pose_keypoints(pose_prediction):
+    """Keypoint sets of the detected poses, in the stored image orientation, ready for draw_pose."""
+    no_of_pose_detected, pose_score, pose_result = pose_prediction[0]
+    return pose_result[0]['draw_kpt'] if no_of_pose_detected > 0 else []
+
+
+def scale_faces(faces, factor):
+    """Face API detections with their faceRectangle scaled by `factor`."""
+    if factor == 1:
+        return faces
+    return [{**face, 'faceRectangle': {k: int(round(v * factor)) for k, v in face['faceRectangle'].items()}} for face in faces]
+
+
+# Fields of a detected pose holding image coordinates, as nested lists/dicts of numbers
+POSE_COORDINATE_FIELDS = ('draw_kpt', 'key_points_coordinate', 'bbox_coordinates')
+
+
+def scale_coordinates(value, factor):
+    """Every number in the nested lists/tuples/dicts of `value` multiplied by `factor`."""
+    if isinstance(value, dict):
+        return {k: scale_coordinates(v, factor) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [scale_coordinates(v, factor) for v in value]
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return float(value * factor)
+    return value
+
+
+def scale_pose_prediction(pose_prediction, factor):
+    """Pose API prediction with the coordinate fields of each detected pose scaled by `factor`."""
+    if factor == 1:
+        return pose_prediction
+    no_of_pose_detected, pose_score, pose_result = pose_prediction[0]
+    pose_result = [{k: scale_coordinates(v, factor) if k in POSE_COORDINATE_FIELDS else v for k, v in result.items()} for result in pose_result]
+    return [[no_of_pose_detected, pose_score, pose_result], *pose_prediction[1:]]
 
 
 def draw_pose(keypoints, img):
@@ -177,17 +208,63 @@ def check_rgb_depth_alignment(rgb_image, depth_image, max_depth, threshold=0.75)
     return similarity_index, alignment_status
 
 
+@lru_cache(maxsize=16)
+def blend_tables(colors, alpha=0.3):
+    """
+    uint8 lookup tables for blending any combination of masks: entry [code, channel, value]
+    is what a pixel of `value` becomes after overlay_mask with each of `colors` whose bit
+    is set in `code`, in order, with the same rounding.
+    """
+    values = np.arange(256, dtype=np.uint8)
+    tables = np.empty((1 << len(colors), 3, 256), dtype=np.uint8)
+    for code in range(len(tables)):
+        for c in range(3):
+            channel = values
+            for bit, color in enumerate(colors):
+                if code >> bit & 1:
+                    channel = ((1 - alpha) * channel + alpha * color[c] * 255).astype(np.uint8)
+            tables[code, c] = channel
+    return tables
+
+
+def composite_masks(image, layers, alpha=0.3, chunk_rows=256):
+    """
+    Blend (mask, color) layers, in drawing order, into a contiguous uint8 RGB image in place.
+
+    Same result as calling overlay_mask once per layer, but every pixel is looked up
+    once in blend_tables instead of going through a float blend per mask and channel.
+    Layers whose mask is None are skipped.
+    """
+    layers = [(mask, color) for mask, color in layers if mask is not None]
+    if not layers:
+        return image
+    tables = blend_tables(tuple(tuple(color) for _, color in layers), alpha).reshape(-1)
+    codes = np.zeros(image.shape[:2], dtype=np.uint8)
+    for bit, (mask, _) in enumerate(layers):
+        codes |= (np.asarray(mask) != 0).view(np.uint8) << bit
+    channel_offsets = np.arange(3, dtype=np.int32) * 256
+    for start in range(0, image.shape[0], chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        if not codes[rows].any():
+            continue
+        index = codes[rows, :, None].astype(np.int32) * (3 * 256) + channel_offsets + image[rows]
+        np.take(tables, index, out=image[rows], mode='clip')
+    return image
+
+
 def overlay_mask(image, mask, color, alpha=0.3):
     # Convert grayscale/depth to 3-channel if needed
     if image.ndim == 2:
         image = np.stack([image] * 3, axis=-1)
-    
-    overlay = image.copy()
-    for c in range(3):
-        overlay[..., c] = np.where(mask,
-                                   (1 - alpha) * overlay[..., c] + alpha * color[c] * 255,
-                                   overlay[..., c])
-    return np.clip(overlay, 0, 255).astype(np.uint8)
+    if image.dtype != np.uint8:
+        # Other dtypes are blended before they are clipped to uint8
+        overlay = image.copy()
+        for c in range(3):
+            overlay[..., c] = np.where(mask,
+                                       (1 - alpha) * overlay[..., c] + alpha * color[c] * 255,
+                                       overlay[..., c])
+        return np.clip(overlay, 0, 255).astype(np.uint8)
+    return composite_masks(image.copy(), [(mask, color)], alpha)
 
 
 def plot_with_masks_on_image(image, wall_mask, floor_mask, child_mask, foot_mask=None, is_depth=False, is_standing=True):
@@ -207,19 +284,31 @@ def plot_with_masks_on_image(image, wall_mask, floor_mask, child_mask, foot_mask
     yellow = (255, 255, 0)
 
     # Start with the child and floor masks
-    combined = overlay_mask(image, floor_mask, floor_color)
-    combined = overlay_mask(combined, child_mask, child_color)
+    layers = [(floor_mask, floor_color), (child_mask, child_color)]
 
     # For standing child, overlay wall_mask, foot_mask is ignored
     if is_standing:
-        combined = overlay_mask(combined, wall_mask, wall_color)
-    
+        layers.append((wall_mask, wall_color))
+
     # For lying child, overlay foot_mask (if available)
     elif foot_mask is not None:
-        combined = overlay_mask(combined, foot_mask, foot_color)
+        layers.append((foot_mask, foot_color))
 
-    combined = add_label_cv(combined, child_mask, "Child", color=red)
-    combined = add_label_cv(combined, floor_mask, "Floor", color=green)  # Green
+    layers = [(mask, color) for mask, color in layers if mask is not None]
+
+    # Blended in place: a contiguous uint8 RGB image passed in is drawn on directly
+    if image.ndim == 2:
+        image = np.stack([image] * 3, axis=-1)
+    if image.dtype != np.uint8 and layers:
+        # The first layer turns other dtypes into uint8, blending before clipping like overlay_mask
+        image = overlay_mask(image, *layers[0])
+        layers = layers[1:]
+    elif image.dtype != np.uint8:
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    combined = composite_masks(np.ascontiguousarray(image), layers)
+
+    combined = add_label_cv(combined, child_mask, "Child", color=red, step=OVERLAY_LABEL_STEP)
+    combined = add_label_cv(combined, floor_mask, "Floor", color=green, step=OVERLAY_LABEL_STEP)  # Green
     # if is_standing:
     #     combined = add_label_cv(combined, wall_mask, "Wall", color=blue)
     #     if foot_mask is not None:
@@ -233,15 +322,26 @@ def plot_with_masks_on_image(image, wall_mask, floor_mask, child_mask, foot_mask
     return encoded_image
 
 
-def add_label_cv(image, mask, label, color=(0, 0, 255), margin = 50):
+def add_label_cv(image, mask, label, color=(0, 0, 255), margin = 50, step=1):
+    """
+    Write `label` at the middle, in raster order, of the mask pixels more than `margin`
+    away from the border.
+
+    With step > 1 only every `step`th row and column of the mask is searched and the
+    label goes to the middle pixel of the middle row, which unlike the raster-order
+    middle stays near the centre of the mask when it is subsampled; the label then
+    lands a few pixels away from where step=1 puts it.
+    """
     H, W = mask.shape[:2]
-    pos = np.argwhere(mask)
-    filtered_pos = pos[
-        (pos[:, 0] > margin) & (pos[:, 0] < H - margin) &  # y-coordinate
-        (pos[:, 1] > margin) & (pos[:, 1] < W - margin)    # x-coordinate
-    ]
-    if len(filtered_pos) > 0:
-        y, x = filtered_pos[len(filtered_pos)//2]  # Get center point
-        cv2.putText(image, label, (x, y), cv2.FONT_HERSHEY_SIMPLEX, fontScale=2, color=color, thickness=2)
+    pos = np.argwhere(np.asarray(mask)[margin + 1:H - margin:step, margin + 1:W - margin:step])
+    if len(pos) > 0:
+        if step == 1:
+            y, x = pos[len(pos)//2]
+        else:
+            row = pos[len(pos)//2, 0]
+            columns = pos[pos[:, 0] == row, 1]
+            y, x = row, columns[len(columns)//2]
+        y, x = y * step + margin + 1, x * step + margin + 1  # Get center point
+        cv2.putText(image, label, (int(x), int(y)), cv2.FONT_HERSHEY_SIMPLEX, fontScale=2, color=color, thickness=2)
 
     return image
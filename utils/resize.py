@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def compute_interpolation_weights(in_size: int, out_size: int):
+    """Source indices and weights of a half-pixel bilinear resize along one axis.
+
+    Follows tf.image.resize (bilinear, half_pixel_centers=True, no antialias),
+    computed in float32 like the TensorFlow kernel.
+    """
+    scale = np.float32(in_size) / np.float32(out_size)
+    in_coords = (np.arange(out_size, dtype=np.float32) + np.float32(0.5)) * scale - np.float32(0.5)
+    in_floor = np.floor(in_coords)
+    lower = np.maximum(in_floor.astype(np.int64), 0)
+    upper = np.minimum(np.ceil(in_coords).astype(np.int64), in_size - 1)
+    lerp = in_coords - in_floor
+    return lower, upper, lerp
+
+
+def resize_bilinear(image: np.ndarray, size) -> np.ndarray:
+    """Resize a (H, W) or (H, W, C) image to size=(height, width).
+
+    Drop-in replacement for np.array(tf.image.resize(image, size)): the result is
+    float32 and matches TensorFlow's bilinear resize up to float32 rounding.
+    """
+    image = np.asarray(image, dtype=np.float32)
+    out_height, out_width = size
+    y_lower, y_upper, y_lerp = compute_interpolation_weights(image.shape[0], out_height)
+    x_lower, x_upper, x_lerp = compute_interpolation_weights(image.shape[1], out_width)
+
+    # Broadcast the weights over any trailing channel axis
+    trailing = (1,) * (image.ndim - 2)
+    y_lerp = y_lerp.reshape((-1, 1) + trailing)
+    x_lerp = x_lerp.reshape((1, -1) + trailing)
+
+    rows_lower = image[y_lower]
+    rows_upper = image[y_upper]
+    top_left, top_right = rows_lower[:, x_lower], rows_lower[:, x_upper]
+    bottom_left, bottom_right = rows_upper[:, x_lower], rows_upper[:, x_upper]
+
+    top = top_left + (top_right - top_left) * x_lerp
+    bottom = bottom_left + (bottom_right - bottom_left) * x_lerp
+    return top + (bottom - top) * y_lerp
@@ -3,18 +3,24 @@ from typing import Dict
 import datetime
 
 import anyio
-import aiohttp
 from utils.retry_decorator import retry
+from utils.concurrency import AdaptiveLimiter
+from utils.file_decryption import StreamDecryptor, decrypt_file_data
+from utils.file_cache import file_cache
+from utils.http_client import get_session
+from utils.workflows import workflow_registry, get_workflow
 
 
-files_api_semaphore = anyio.Semaphore(10)
+files_api_limiter = AdaptiveLimiter('cgm_files', initial_limit=10, max_limit=32)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 
 class RestApi():
-    def __init__(self, base_url: str, api_key: str):
+    def __init__(self, base_url: str, api_key: str, session_name: str = 'cgm_api'):
         self.url = base_url
         self.headers = {'X-API-Key': api_key}
-        self.session = aiohttp.ClientSession()
+        # Shared, long-lived session owned by the process-wide client manager; do not close it
+        self.session = get_session(session_name)
 
     async def get_json(self, path: str, params: Dict | None = None):
         async with self.session.get(self.url + path, headers=self.headers, params= params) as resp:
@@ -22,10 +28,15 @@ class RestApi():
             data = await resp.json()
             return data, resp.status
 
-    async def get_binary(self, path: str):
+    async def get_binary(self, path: str, decryptor: StreamDecryptor | None = None):
         async with self.session.get(self.url + path, headers=self.headers) as resp:
             resp.raise_for_status()
-            data = await resp.read()
+            if decryptor is None:
+                data = await resp.read()
+            else:
+                async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    decryptor.update(chunk)
+                data = decryptor.getvalue()
             return data, resp.status
 
     async def post_json(self, path: str, json: Dict | None = None):
@@ -51,10 +62,22 @@ class CgmApi(RestApi):
     def __init__(self):
         super().__init__(getenv("APP_URL"),getenv("API_KEY"))
 
-    @retry(retries=3, delay=2)
-    async def get_files(self, file_id):
-        async with files_api_semaphore:
-            return await self.get_binary(f"/api/files/{file_id}")
+    @retry(retries=3, delay=2, endpoint='cgm_files')
+    async def get_files(self, file_id, decrypt=False):
+        cached = await anyio.to_thread.run_sync(file_cache.get, file_id)
+        if cached is not None:
+            if decrypt:
+                cached = await anyio.to_thread.run_sync(decrypt_file_data, cached)
+            return cached, 200
+        decryptor = StreamDecryptor() if decrypt else None
+        async with files_api_limiter.slot() as outcome:
+            data, status = await self.get_binary(f"/api/files/{file_id}", decryptor=decryptor)
+            outcome.status = status
+        if file_cache.enabled:
+            # The cache keeps files as served, so decrypted data is XORed back before storing
+            raw = await anyio.to_thread.run_sync(decrypt_file_data, data) if decrypt else data
+            await anyio.to_thread.run_sync(file_cache.put, file_id, raw)
+        return data, status
 
     async def get_basic_person_info(self, person_id):
         basic_info, status_code = await self.get_json(f'/api/persons/{person_id}/basic')
@@ -72,24 +95,27 @@ class CgmApi(RestApi):
                 mms.append(target_dict)
         return mms
 
-    @retry(retries=3, delay=2)
+    @retry(retries=3, delay=2, endpoint='cgm_scans')
     async def get_scan_metadata(self, scan_id):
         scan_metadata, status_code = await self.get_json(f"/api/scans/{scan_id}")
         return scan_metadata['scan']
 
-    @retry(retries=3, delay=2)
     async def get_workflows(self):
+        return await workflow_registry.get_workflows(self.fetch_workflows)
+
+    @retry(retries=3, delay=2, endpoint='cgm_workflows')
+    async def fetch_workflows(self):
         workflows, status_code = await self.get_json('/api/workflows')
         return workflows['workflows']
 
-    @retry(retries=3, delay=2)
+    @retry(retries=3, delay=2, endpoint='cgm_results')
     async def post_results(self, results):
         data, status_code = await self.post_json('/api/results', json=results)
         return status_code
 
-    @retry(retries=3, delay=2)
+    @retry(retries=3, delay=2, endpoint='cgm_files')
     async def post_files(self, bin_file, file_format) -> str:
-        async with files_api_semaphore:
+        async with files_api_limiter.slot() as outcome:
             if file_format == 'rgb':
                 filename = 'test.jpg'
             elif file_format == 'depth':
@@ -102,15 +128,14 @@ class CgmApi(RestApi):
                 'filename': filename
             }
             file_id, status_code = await self.post_binary('/api/files', files)
+            outcome.status = status_code
             if status_code != 201:
                 print(f"file upload failed with {status_code}")
             return file_id
 
     async def get_workflow_id(self, workflow_name, workflow_version):
         workflows = await self.get_workflows()
-        workflow = [workflow for workflow in workflows if workflow['name'] == workflow_name and workflow['version'] == workflow_version]
-
-        return workflow[0]['id']
+        return get_workflow(workflows, workflow_name, workflow_version)['id']
 
     async def get_results_for_workflow(self, scan_id, workflow_id):
         params = {
@@ -122,7 +147,7 @@ class CgmApi(RestApi):
         results, status_code = await self.get_json('/api/scans', params=params)
         return results['scans'][0]['results']
 
-    @retry(retries=3, delay=2)
+    @retry(retries=3, delay=2, endpoint='cgm_child_visits')
     async def put_child_visit_result(self, child_visit_id, result_data):
         results, status_code = await self.put_json(f'/api/child-visits/{child_visit_id}/result-data', json={"result_data": result_data})
         return status_code
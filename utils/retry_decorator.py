@@ -1,22 +1,183 @@
 import anyio
+import asyncio
+import contextvars
 import functools
 import logging
+import random
+import time
+from contextlib import contextmanager
+
+import aiohttp
+
+from utils.constants import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+from utils.concurrency import parse_retry_after
+
+# Statuses worth retrying; any other HTTP error will not succeed on a retry
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+# Errors without a status worth retrying: connection errors and timeouts
+RETRYABLE_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, OSError)
+
+message_deadline_var = contextvars.ContextVar('message_deadline', default=None)
+circuit_breakers = {}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+@contextmanager
+def message_deadline(seconds):
+    """Give every retried call made while handling one queue message a shared time budget; none when seconds is 0."""
+    if not seconds:
+        yield
+        return
+    token = message_deadline_var.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        message_deadline_var.reset(token)
+
+
+def remaining_budget():
+    deadline = message_deadline_var.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def is_retryable(error):
+    if isinstance(error, (CircuitOpenError, DeadlineExceededError)):
+        return False
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUSES
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def get_retry_after(error):
+    headers = getattr(error, 'headers', None) or {}
+    return parse_retry_after(headers.get('Retry-After'))
+
+
+class CircuitBreaker:
+    """
+    Stop calling an endpoint for `reset_timeout` seconds after `failure_threshold` retryable
+    failures in a row. After that a single probe call is let through (half-open): its
+    success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through; True when it is the half-open probe."""
+        state = self.state
+        if state == 'open' or (state == 'half-open' and self.probing):
+            raise CircuitOpenError(f"circuit for {self.name} is open")
+        self.probing = state == 'half-open'
+        return self.probing
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half-open' or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.state == 'half-open':
+                logging.warning(f"opening circuit for {self.name} after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+def get_circuit_breaker(name):
+    if name not in circuit_breakers:
+        circuit_breakers[name] = CircuitBreaker(name)
+    return circuit_breakers[name]
+
+
+class RetryPolicy:
+    """
+    Retry an async call with decorrelated jitter backoff.
+
+    Only retryable errors (see is_retryable) are retried, Retry-After is honoured,
+    each attempt is bounded by `call_timeout` and by the remaining message budget,
+    and the endpoint's circuit breaker fails calls fast while the endpoint is down.
+    """
+
+    def __init__(self, retries=3, base_delay=2, max_delay=30, call_timeout=None, endpoint=None):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.call_timeout = call_timeout
+        self.endpoint = endpoint
+
+    def next_delay(self, previous_delay):
+        return min(self.max_delay, random.uniform(self.base_delay, previous_delay * 3))
+
+    @staticmethod
+    async def attempt(breaker, timeout, func, *args, **kwargs):
+        """One call through the circuit breaker, freeing the half-open probe slot however it ends."""
+        probe = breaker.before_call()
+        try:
+            with anyio.fail_after(timeout):
+                return await func(*args, **kwargs)
+        finally:
+            if probe:
+                breaker.probing = False
+
+    async def call(self, func, *args, **kwargs):
+        breaker = get_circuit_breaker(self.endpoint or func.__qualname__)
+        delay = self.base_delay
+        for attempt in range(1, self.retries + 1):
+            budget = remaining_budget()
+            if budget is not None and budget <= 0:
+                raise DeadlineExceededError(f"{func.__name__}: message deadline exceeded")
+            timeouts = [t for t in (self.call_timeout, budget) if t is not None]
+            try:
+                result = await self.attempt(breaker, min(timeouts) if timeouts else None, func, *args, **kwargs)
+            except Exception as e:
+                budget = remaining_budget()
+                if isinstance(e, TimeoutError) and budget is not None and budget <= 0:
+                    # Running out of message budget says nothing about the endpoint: no breaker failure, no retry
+                    logging.error(f"{func.__name__} failed after {attempt} attempts: message deadline exceeded")
+                    raise DeadlineExceededError(f"{func.__name__}: message deadline exceeded") from e
+                retryable = is_retryable(e)
+                if retryable:
+                    breaker.record_failure()
+                delay = max(self.next_delay(delay), get_retry_after(e) or 0)
+                if not retryable or attempt == self.retries or (budget is not None and delay >= budget):
+                    logging.error(f"{func.__name__} failed after {attempt} attempts: {e}")
+                    raise e
+                logging.warning(f"Retrying {func.__name__} (Attempt {attempt}/{self.retries}) in {delay:.1f}s due to: {e}")
+                await anyio.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+
+def retry(retries=3, delay=2, max_delay=30, call_timeout=None, endpoint=None):
+    """Decorator to retry an async function according to a RetryPolicy."""
+    policy = RetryPolicy(retries=retries, base_delay=delay, max_delay=max_delay,
+                         call_timeout=call_timeout, endpoint=endpoint)
 
-def retry(retries=3, delay=2):
-    """Decorator to retry an async function with exponential backoff."""
     def decorator(func):
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
-            for attempt in range(retries):
-                try:
-                    return await func(*args, **kwargs)  # Call the function
-                except Exception as e:
-                    if attempt < retries - 1:
-                        wait_time = delay * (2 ** attempt)  # Exponential backoff
-                        logging.warning(f"Retrying {func.__name__} (Attempt {attempt+1}/{retries}) in {wait_time}s due to: {e}")
-                        await anyio.sleep(wait_time)
-                    else:
-                        logging.error(f"{func.__name__} failed after {retries} attempts: {e}")
-                        raise e  # Raise the last exception if retries fail
+            return await policy.call(func, *args, **kwargs)
         return wrapper
     return decorator
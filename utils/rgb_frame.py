@@ -0,0 +1,159 @@
+import struct
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.constants import RGB_JPEG_QUALITY, RGB_EXIF_ROTATION, RGB_INFERENCE_MAX_EDGE
+from utils.processing import draw_pose, encode_image
+
+
+# EXIF orientation 6: the stored image is shown turned 90 degrees clockwise
+EXIF_ROTATE_CLOCKWISE = 6
+FACE_BLUR_KERNEL = (91, 91)
+
+
+def exif_orientation_segment(orientation):
+    """APP1 segment holding a minimal little-endian EXIF block with only the orientation tag."""
+    ifd = struct.pack('<HHHIHHI', 1, 0x0112, 3, 1, orientation, 0, 0)
+    payload = b'Exif\x00\x00' + b'II*\x00' + struct.pack('<I', 8) + ifd
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def set_exif_orientation(jpeg, orientation):
+    """
+    The JPEG with its EXIF data replaced by just `orientation`, without touching the
+    compressed image data. None when the header segments cannot be walked.
+    """
+    if jpeg[:2] != b'\xff\xd8':
+        return None
+    position, leading, kept = 2, [], []
+    while position + 4 <= len(jpeg) and jpeg[position] == 0xff and 0xe0 <= jpeg[position + 1] <= 0xef:
+        end = position + 2 + struct.unpack('>H', jpeg[position + 2:position + 4])[0]
+        segment = jpeg[position:end]
+        if segment[1] == 0xe0 and not kept:
+            leading.append(segment)
+        elif not (segment[1] == 0xe1 and segment[4:10] == b'Exif\x00\x00'):
+            kept.append(segment)
+        position = end
+    if position + 2 > len(jpeg) or jpeg[position] != 0xff:
+        return None
+    return b''.join([b'\xff\xd8', *leading, exif_orientation_segment(orientation), *kept, jpeg[position:]])
+
+
+class cached_property:
+    """
+    functools.cached_property without the lock it holds across all instances before
+    Python 3.12, which would let only one frame at a time decode or encode. Two threads
+    asking for the same value at once both compute it.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.func(instance)
+        return value
+
+
+class RGBFrame:
+    """
+    One RGB artifact, decoded at most once.
+
+    The decoded image and everything made from it (the upright copy, the JPEG for
+    the pose and face APIs, the blurred JPEG) are computed on first use and kept, so
+    whichever flows need them pay for each only once. The stored images are
+    landscape; the APIs and the alignment check work on the upright (90 degrees
+    clockwise) image, the uploaded images keep the stored orientation.
+
+    With max_edge the APIs get a smaller copy; their coordinates must be multiplied by
+    1 / inference_scale before blurring or drawing.
+    """
+
+    def __init__(self, raw_file, quality=RGB_JPEG_QUALITY, max_edge=RGB_INFERENCE_MAX_EDGE):
+        self.raw_file = raw_file
+        self.quality = quality
+        self.max_edge = max_edge
+        self.blurred = None
+
+    @cached_property
+    def size(self):
+        """(width, height) as stored, read from the JPEG header without decoding."""
+        return Image.open(BytesIO(self.raw_file)).size
+
+    @cached_property
+    def inference_scale(self):
+        """Factor from full resolution to the resolution sent to the APIs, at most 1."""
+        if not self.max_edge:
+            return 1.0
+        return min(1.0, self.max_edge / max(self.size))
+
+    @cached_property
+    def image(self):
+        """The image as stored, RGB."""
+        return np.asarray(Image.open(BytesIO(self.raw_file)))
+
+    @cached_property
+    def upright(self):
+        """The image turned 90 degrees clockwise, RGB, as load_rgb_image returns it."""
+        return cv2.rotate(self.image, cv2.ROTATE_90_CLOCKWISE)
+
+    @cached_property
+    def inference_jpeg(self):
+        """
+        Upright JPEG for the pose and face APIs, no larger than max_edge.
+
+        With RGB_EXIF_ROTATION the stored image is sent tagged with an EXIF orientation
+        instead: the original JPEG when it needs no downscaling, else a re-encoded
+        smaller copy (BGR, so both decode to the same colours).
+        """
+        if self.inference_scale == 1:
+            jpeg = set_exif_orientation(self.raw_file, EXIF_ROTATE_CLOCKWISE) if RGB_EXIF_ROTATION else None
+            return jpeg or encode_image(self.upright, self.quality)
+        width, height = self.size
+        size = (max(1, round(width * self.inference_scale)), max(1, round(height * self.inference_scale)))
+        image = cv2.resize(self.image, size, interpolation=cv2.INTER_AREA)
+        if RGB_EXIF_ROTATION:
+            return set_exif_orientation(encode_image(image[:, :, ::-1], self.quality), EXIF_ROTATE_CLOCKWISE)
+        return encode_image(cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE), self.quality)
+
+    def blur_faces(self, faces):
+        """
+        Blur the detected faces into self.blurred, BGR in the stored orientation.
+
+        The face rectangles are in upright coordinates; they are mapped onto the
+        stored image rather than turning the image upright and back.
+        """
+        blurred = self.image[:, :, ::-1].copy()
+        height = blurred.shape[0]
+        for face in faces:
+            fr = face['faceRectangle']
+            left, top = int(fr['left']), int(fr['top'])
+            # Upright column x is stored row height - 1 - x, upright row y is stored column y
+            rows = slice(max(0, height - left - int(fr['width'])), max(0, height - left))
+            cols = slice(max(0, top), max(0, top + int(fr['height'])))
+            roi = blurred[rows, cols]
+            if roi.size:
+                blurred[rows, cols] = cv2.GaussianBlur(roi, FACE_BLUR_KERNEL, 0)
+        self.blurred = blurred
+        self.__dict__.pop('blurred_jpeg', None)
+
+    @cached_property
+    def blurred_jpeg(self):
+        if self.blurred is None:
+            raise ValueError("blur_faces has not been called for this frame")
+        return encode_image(self.blurred, self.quality)
+
+    def pose_jpeg(self, keypoint_sets):
+        """JPEG of the blurred image with the poses drawn on it, keypoints in the stored orientation."""
+        if self.blurred is None:
+            raise ValueError("blur_faces has not been called for this frame")
+        image = self.blurred.copy()
+        for keypoints in keypoint_sets:
+            image = draw_pose(keypoints, image)
+        return encode_image(image, self.quality)
@@ -0,0 +1,129 @@
+import pickle
+import struct
+
+import numpy as np
+
+from utils.constants import DEPTH_TENSOR_ENCODING, DEPTH_TENSOR_COMPRESSION
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+# Header: magic, format version, encoding, compression, ndim, then ndim uint32
+# dimensions and the float32 scale and offset used by the uint16 encoding
+MAGIC = b'CGMT'
+HEADER = struct.Struct('<4sBBBB')
+QUANTIZATION = struct.Struct('<ff')
+TENSOR_CONTENT_TYPE = 'application/x-cgm-tensor'
+PICKLE_CONTENT_TYPE = 'application/octer-stream'
+
+ENCODINGS = {'float32': 0, 'float16': 1, 'uint16': 2}
+COMPRESSIONS = {'none': 0, 'zstd': 1, 'lz4': 2}
+
+
+def check_compression(compression):
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown tensor compression: {compression}")
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError("zstd compression needs the zstandard package")
+    if compression == 'lz4' and lz4 is None:
+        raise ImportError("lz4 compression needs the lz4 package")
+
+
+def compress(data, compression):
+    check_compression(compression)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if compression == 'lz4':
+        return lz4.frame.compress(data)
+    return data
+
+
+def decompress(data, compression):
+    check_compression(compression)
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compression == 'lz4':
+        return lz4.frame.decompress(data)
+    return data
+
+
+def encode_tensor(array, encoding='float16', compression='none'):
+    """Serialize an array as header + raw little-endian values, optionally compressed.
+
+    'uint16' quantizes linearly between the array's min and max, which keeps the error
+    below (max - min) / 131070 for any depth range.
+    """
+    check_compression(compression)
+    array = np.asarray(array, dtype=np.float32)
+    scale, offset = 1.0, 0.0
+    if encoding == 'float32':
+        values = array.astype('<f4')
+    elif encoding == 'float16':
+        values = array.astype('<f2')
+    elif encoding == 'uint16':
+        offset = float(array.min()) if array.size else 0.0
+        value_range = float(array.max()) - offset if array.size else 0.0
+        scale = value_range / 65535 if value_range > 0 else 1.0
+        values = np.rint((array - offset) / scale).astype('<u2')
+    else:
+        raise ValueError(f"Unknown tensor encoding: {encoding}")
+    header = HEADER.pack(MAGIC, 1, ENCODINGS[encoding], COMPRESSIONS[compression], array.ndim)
+    shape = struct.pack(f'<{array.ndim}I', *array.shape)
+    return header + shape + QUANTIZATION.pack(scale, offset) + compress(values.tobytes(), compression)
+
+
+def decode_tensor(data):
+    """Inverse of encode_tensor, always returning float32."""
+    magic, _, encoding, compression, ndim = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an encoded tensor")
+    position = HEADER.size
+    shape = struct.unpack_from(f'<{ndim}I', data, position)
+    position += 4 * ndim
+    scale, offset = QUANTIZATION.unpack_from(data, position)
+    position += QUANTIZATION.size
+    compression = {code: name for name, code in COMPRESSIONS.items()}[compression]
+    raw = decompress(bytes(data[position:]), compression)
+    if encoding == ENCODINGS['float32']:
+        values = np.frombuffer(raw, dtype='<f4')
+    elif encoding == ENCODINGS['float16']:
+        values = np.frombuffer(raw, dtype='<f2').astype(np.float32)
+    else:
+        values = np.frombuffer(raw, dtype='<u2').astype(np.float32) * np.float32(scale) + np.float32(offset)
+    return values.reshape(shape)
+
+
+class TensorPayload:
+    """A depth batch encoded once for the scoring endpoints.
+
+    Build one per batch and pass it to every call that scores the same batch (and to
+    each retry): the body is encoded in the constructor and never again. With the
+    default DEPTH_TENSOR_ENCODING='pickle' the body is the pickled float32 array the
+    deployed endpoints expect; the other encodings need an endpoint that understands
+    TENSOR_CONTENT_TYPE (see scripts/local_scoring_server.py).
+    """
+
+    def __init__(self, depthmaps, encoding=DEPTH_TENSOR_ENCODING, compression=DEPTH_TENSOR_COMPRESSION):
+        array = np.asarray(depthmaps, dtype=np.float32)
+        self.shape = array.shape
+        if encoding == 'pickle':
+            self.body = pickle.dumps(array)
+            self.content_type = PICKLE_CONTENT_TYPE
+        else:
+            self.body = encode_tensor(array, encoding, compression)
+            self.content_type = TENSOR_CONTENT_TYPE
+
+    def __len__(self):
+        return self.shape[0]
+
+
+def as_payload(depthmaps):
+    return depthmaps if isinstance(depthmaps, TensorPayload) else TensorPayload(depthmaps)
@@ -0,0 +1,56 @@
+import time
+
+import anyio
+
+from utils.constants import WORKFLOW_CACHE_TTL
+
+
+class WorkflowList(list):
+    """List of workflows as returned by /api/workflows, indexed by (name, version)."""
+
+    def __init__(self, workflows):
+        super().__init__(workflows)
+        self.index = {(w['name'], w['version']): w for w in reversed(self)}
+
+
+class WorkflowRegistry:
+    """In-process TTL cache of /api/workflows shared by all invocations of a worker."""
+
+    def __init__(self, ttl: float = WORKFLOW_CACHE_TTL):
+        self.ttl = ttl
+        self.workflows = None
+        self.fetched_at = 0.0
+        self.lock = anyio.Lock()
+
+    def is_expired(self):
+        return self.workflows is None or time.monotonic() - self.fetched_at > self.ttl
+
+    async def get_workflows(self, fetch_workflows):
+        """Return the cached workflows, calling `fetch_workflows()` once they expire."""
+        if self.is_expired():
+            async with self.lock:
+                if self.is_expired():
+                    self.workflows = WorkflowList(await fetch_workflows())
+                    self.fetched_at = time.monotonic()
+        return self.workflows
+
+    def invalidate(self):
+        self.workflows = None
+
+
+workflow_registry = WorkflowRegistry()
+
+
+def invalidate_workflows():
+    workflow_registry.invalidate()
+
+
+def get_workflow(workflows, workflow_name, workflow_version):
+    if not isinstance(workflows, WorkflowList):
+        workflows = WorkflowList(workflows)
+    try:
+        return workflows.index[(workflow_name, workflow_version)]
+    except KeyError:
+        # The workflow may have been registered after the cache was filled
+        invalidate_workflows()
+        raise